@@ -1,23 +1,61 @@
 #!/usr/bin/env python3
+import asyncio
+from abc import ABC, abstractmethod
+import contextvars
+import atexit
+import bisect
+import inspect
+import itertools
 import os
+import queue
+import random
+import re
 import sys
 import logging
+import logging.handlers
+import math
 import shlex
-import subprocess
+import signal
+import sqlite3
 import json
+import gzip
+import hashlib
+import heapq
+import hmac
+import html
 from urllib.parse import urlencode
+from http.cookies import SimpleCookie
 import uuid
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Set, Tuple
 import threading
 import time
 from functools import wraps
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
-from flask import Flask, app, jsonify, request, Response, session
+from flask import Flask, app, g, jsonify, request, Response, session
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
+import socketio as socketio_lib
+from werkzeug.http import dump_cookie, parse_accept_header, parse_etags
 from werkzeug.middleware.proxy_fix import ProxyFix
+from itsdangerous import BadSignature
+
+try:  # Optional: only needed for the ASGI serving mode (create_asgi_app)
+    import aiohttp
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    aiohttp = None
+
+# Connection failures the async client can raise; empty without aiohttp
+_AIOHTTP_CONN_ERRORS = (aiohttp.ClientConnectionError,) if aiohttp else ()
+
+try:  # Optional: brotli is preferred over gzip when installed
+    import brotli
+except ImportError:
+    brotli = None
 
 # =========================
 # Configuration (env vars)
@@ -55,7 +93,73 @@ GUAC_USERS = {
     },
 }
 
-GUAC_TOKEN_TIMEOUT = 3600
+# Per-session lab pairs: Guacamole connections named <scenario>-<role>-<slot>
+# (e.g. "webapp-victim-07"). The lab accounts must be able to see them all.
+# Off by default: single-pair deployments keep the shared connections.
+LAB_ALLOCATION = os.getenv("LAB_ALLOCATION", "false").lower() == "true"
+LAB_CONNECTION_PATTERN = os.getenv(
+    "LAB_CONNECTION_PATTERN",
+    r"^(?P<scenario>[\w.-]+?)-(?P<role>%s)-(?P<slot>\d+)$" % "|".join(GUAC_USERS),
+)
+LAB_DEFAULT_SCENARIO = os.getenv("LAB_DEFAULT_SCENARIO", "")  # else the freest one
+LAB_QUEUE_LIMIT = int(os.getenv("LAB_QUEUE_LIMIT", "200"))  # waiting sessions per scenario
+
+# Auto-login page shells are served from versioned URLs, so they never go stale
+PAGE_ASSET_MAX_AGE = int(os.getenv("PAGE_ASSET_MAX_AGE", "31536000"))
+
+# Response compression (gzip, or brotli when installed) for bodies above this size
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "512"))  # bytes
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+
+# Pooled HTTP client for Guacamole REST calls
+GUAC_POOL_CONNECTIONS = int(os.getenv("GUAC_POOL_CONNECTIONS", "4"))  # host pools kept
+GUAC_POOL_MAXSIZE = int(os.getenv("GUAC_POOL_MAXSIZE", "32"))  # sockets per host
+GUAC_POOL_BLOCK = os.getenv("GUAC_POOL_BLOCK", "true").lower() == "true"
+
+# Guacamole REST timeouts, retries of idempotent calls and circuit breakers
+GUAC_CONNECT_TIMEOUT = float(os.getenv("GUAC_CONNECT_TIMEOUT", "3.05"))  # seconds
+GUAC_READ_TIMEOUT = float(os.getenv("GUAC_READ_TIMEOUT", "10"))  # seconds between bytes
+GUAC_RETRIES = int(os.getenv("GUAC_RETRIES", "2"))  # extra attempts, idempotent only
+GUAC_RETRY_BACKOFF = float(os.getenv("GUAC_RETRY_BACKOFF", "0.2"))  # full-jitter base
+GUAC_RETRY_BACKOFF_MAX = float(os.getenv("GUAC_RETRY_BACKOFF_MAX", "2"))
+GUAC_BREAKER_THRESHOLD = int(os.getenv("GUAC_BREAKER_THRESHOLD", "5"))  # failures in a row
+GUAC_BREAKER_COOLDOWN = float(os.getenv("GUAC_BREAKER_COOLDOWN", "15"))  # seconds open
+
+# Shared-account token cache (seconds)
+GUAC_DATA_SOURCE = os.getenv("GUAC_DATA_SOURCE", "mysql").split("#")[0].strip()
+GUAC_TOKEN_CACHE_TTL = int(os.getenv("GUAC_TOKEN_CACHE_TTL", "900"))
+GUAC_TOKEN_REFRESH_MARGIN = int(os.getenv("GUAC_TOKEN_REFRESH_MARGIN", "120"))
+GUAC_TOKEN_STALE_GRACE = int(os.getenv("GUAC_TOKEN_STALE_GRACE", "1800"))  # during outages
+GUAC_CONNECTION_DIR_TTL = int(os.getenv("GUAC_CONNECTION_DIR_TTL", "300"))
+GUAC_VALIDATION_TTL = float(os.getenv("GUAC_VALIDATION_TTL", "10"))
+GUAC_VALIDATION_WORKERS = int(os.getenv("GUAC_VALIDATION_WORKERS", "8"))
+GUAC_TEARDOWN_CONCURRENCY = int(os.getenv("GUAC_TEARDOWN_CONCURRENCY", "16"))  # sessions
+GUAC_TEARDOWN_MAX_CONCURRENCY = int(os.getenv("GUAC_TEARDOWN_MAX_CONCURRENCY", "64"))
+
+# Background invalidation of tokens left behind by expired sessions
+GUAC_REAPER_RATE = float(os.getenv("GUAC_REAPER_RATE", "20"))  # tokens per second
+GUAC_REAPER_BATCH = int(os.getenv("GUAC_REAPER_BATCH", "20"))
+GUAC_REAPER_CONCURRENCY = int(os.getenv("GUAC_REAPER_CONCURRENCY", "4"))
+GUAC_REAPER_MAX_ATTEMPTS = int(os.getenv("GUAC_REAPER_MAX_ATTEMPTS", "6"))
+GUAC_REAPER_BACKOFF = float(os.getenv("GUAC_REAPER_BACKOFF", "5"))  # seconds, doubling
+GUAC_REAPER_QUEUE = int(os.getenv("GUAC_REAPER_QUEUE", "10000"))  # tokens waiting
+
+# Pre-authenticated per-session tokens handed out by auto-login. Off by
+# default: every session then shares the cached account token, which
+# disconnects release rather than invalidate (see release_guac_token)
+GUAC_TOKEN_POOL_SIZE = int(os.getenv("GUAC_TOKEN_POOL_SIZE", "0"))  # per user type
+GUAC_TOKEN_POOL_MAX = int(os.getenv("GUAC_TOKEN_POOL_MAX", "120"))  # warm-up cap
+GUAC_TOKEN_POOL_MAX_AGE = int(os.getenv("GUAC_TOKEN_POOL_MAX_AGE", "600"))  # seconds
+GUAC_TOKEN_POOL_CONCURRENCY = int(os.getenv("GUAC_TOKEN_POOL_CONCURRENCY", "4"))
+GUAC_TOKEN_POOL_WARM_HOLD = int(os.getenv("GUAC_TOKEN_POOL_WARM_HOLD", "1800"))
+
+# Background Guacamole health probing
+GUAC_HEALTH_INTERVAL = float(os.getenv("GUAC_HEALTH_INTERVAL", "10"))
+GUAC_HEALTH_TIMEOUT = float(os.getenv("GUAC_HEALTH_TIMEOUT", "5"))
+GUAC_HEALTH_WINDOW = int(os.getenv("GUAC_HEALTH_WINDOW", "30"))  # probes
+
+# Admin endpoints: require X-Admin-Token when set, else loopback clients only
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 FLASK_HOST = os.getenv("FLASK_HOST", "127.0.0.1")
 
 
@@ -63,18 +167,230 @@ FLASK_PORT = int(os.getenv("FLASK_PORT", "5000"))
 FLASK_DEBUG = os.getenv("FLASK_DEBUG", "true").lower() == "true"
 FLASK_USE_RELOADER = os.getenv("FLASK_USE_RELOADER", "false").lower() == "true"
 
+# Socket.IO fan-out across worker processes: "" (single process),
+# "local://<name>" (in-process broker) or "redis://host:port/db"
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+SOCKETIO_CHANNEL = os.getenv("SOCKETIO_CHANNEL", "cyberrange")
+SOCKETIO_MQ_BATCH_SIZE = int(os.getenv("SOCKETIO_MQ_BATCH_SIZE", "64"))
+SOCKETIO_MQ_BATCH_INTERVAL = float(os.getenv("SOCKETIO_MQ_BATCH_INTERVAL", "0.005"))
+
 SESSION_TIMEOUT = 3600  # 1 hour
+SESSION_SHARDS = int(os.getenv("SESSION_SHARDS", "16"))
+SESSION_EXPIRY_GRANULARITY = 1.0  # seconds; minimum sleep of the expiry thread
+SESSION_EXPIRY_MAX_SLEEP = 30.0  # seconds; re-check interval with no known deadline
+
+# Session store: "memory" (single process) or "sqlite" (shared by workers)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").lower()
+SESSION_DB_PATH = os.getenv(
+    "SESSION_DB_PATH", os.path.join(os.path.dirname(__file__), "data", "sessions.db")
+)
+SESSION_STORE_FLUSH_INTERVAL = float(os.getenv("SESSION_STORE_FLUSH_INTERVAL", "1.0"))
+SESSION_STORE_BATCH_SIZE = int(os.getenv("SESSION_STORE_BATCH_SIZE", "256"))
+
+# Scenario script jobs (scripts live under SCRIPTS_ROOT/<scenario>/)
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "8"))  # concurrent processes
+JOB_SCENARIO_LIMIT = int(os.getenv("JOB_SCENARIO_LIMIT", "4"))  # per scenario
+JOB_SESSION_LIMIT = int(os.getenv("JOB_SESSION_LIMIT", "4"))  # queued+running per session
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "600"))  # seconds; also the max allowed
+JOB_KILL_GRACE = float(os.getenv("JOB_KILL_GRACE", "5"))  # SIGTERM -> SIGKILL
+JOB_OUTPUT_LINES = int(os.getenv("JOB_OUTPUT_LINES", "500"))  # tail kept per job
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))  # keep finished jobs
+# Admission control for /api/guac/*: token buckets (requests/s, burst size)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_SESSION_RATE = float(os.getenv("RATE_LIMIT_SESSION_RATE", "0.5"))
+RATE_LIMIT_SESSION_BURST = float(os.getenv("RATE_LIMIT_SESSION_BURST", "10"))
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", "10"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "200"))  # a NATed classroom
+GUAC_AUTH_CONCURRENCY = int(os.getenv("GUAC_AUTH_CONCURRENCY", "8"))  # logins in flight
+GUAC_AUTH_QUEUE = int(os.getenv("GUAC_AUTH_QUEUE", "32"))  # logins waiting for a slot
+GUAC_AUTH_QUEUE_TIMEOUT = float(os.getenv("GUAC_AUTH_QUEUE_TIMEOUT", "5"))  # seconds
+GUAC_AUTH_RETRY_AFTER = int(os.getenv("GUAC_AUTH_RETRY_AFTER", "2"))  # seconds, on 503
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 
+# Logging pipeline: records are queued and written by a background thread
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records; extra are dropped
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_INTERVAL = int(os.getenv("LOG_ROTATE_INTERVAL", "86400"))  # seconds
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "14"))  # compressed files kept
+
+# Request tracing: Server-Timing header per response, optional JSONL span export
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() == "true"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")  # relative to the logs dir
+
 
 # =========================
 # Enhanced Logging Setup
 # =========================
-def setup_logging():
+class CompressingRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """File handler that rotates on size or age, whichever comes first.
+
+    Rotated files are gzip-compressed to ``<name>.<timestamp>.gz`` and only
+    the newest ``backup_count`` are kept. It runs on the log writer thread,
+    so compression never stalls a request.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        max_bytes: int = LOG_MAX_BYTES,
+        interval: int = LOG_ROTATE_INTERVAL,
+        backup_count: int = LOG_BACKUP_COUNT,
+    ):
+        super().__init__(filename, "a", encoding="utf-8", delay=True)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record) -> bool:
+        if self.interval > 0 and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.rollover_at = time.time() + self.interval
+
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename):
+            # Microsecond stamps keep names unique and in chronological order
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            target = f"{self.baseFilename}.{stamp}.gz"
+            with open(self.baseFilename, "rb") as src, gzip.open(target, "wb") as dst:
+                while chunk := src.read(1 << 20):
+                    dst.write(chunk)
+            os.remove(self.baseFilename)
+            self._prune()
+
+        self.stream = self._open()
+
+    def _prune(self):
+        directory, base = os.path.split(self.baseFilename)
+        rotated = sorted(
+            name
+            for name in os.listdir(directory)
+            if name.startswith(base + ".") and name.endswith(".gz")
+        )
+        for name in rotated[: max(0, len(rotated) - self.backup_count)]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Non-blocking QueueHandler: drops (and counts) records when the queue is full.
+
+    ``prepare`` is a no-op, so message interpolation and formatting happen on
+    the writer thread instead of the request thread. The cost is that
+    mutable log arguments are read a little later than the call.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self._drop_lock = threading.Lock()
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+
+class _LogWriter(logging.handlers.QueueListener):
+    """QueueListener whose stop sentinel waits for room in a full queue"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """Owns the handlers behind the three loggers.
+
+    In async mode all loggers share one bounded queue that is drained by a
+    QueueListener thread. Each file handler has a name filter, so it only
+    writes its own logger's records.
+    """
+
+    def __init__(self):
+        self.queue: Optional[queue.Queue] = None
+        self.queue_handler: Optional[DroppingQueueHandler] = None
+        self.listener: Optional[_LogWriter] = None
+
+    def configure(
+        self,
+        loggers: List[logging.Logger],
+        handlers: List[logging.Handler],
+        use_queue: bool = LOG_ASYNC,
+        queue_size: int = LOG_QUEUE_SIZE,
+    ):
+        self.stop()
+        for logger in loggers:
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+
+        if not use_queue:
+            for logger in loggers:
+                for handler in handlers:
+                    logger.addHandler(handler)
+            return
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queue_handler = DroppingQueueHandler(self.queue)
+        self.listener = _LogWriter(
+            self.queue, *handlers, respect_handler_level=True
+        )
+        self.listener.start()
+        for logger in loggers:
+            logger.addHandler(self.queue_handler)
+
+    def stop(self):
+        """Drain the queue and stop the writer thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        if self.queue_handler is None:
+            return {"mode": "sync"}
+        return {
+            "mode": "async",
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "dropped": self.queue_handler.dropped,
+        }
+
+
+log_pipeline = LogPipeline()
+atexit.register(log_pipeline.stop)
+
+
+def setup_logging(
+    log_dir: Optional[str] = None,
+    use_queue: bool = LOG_ASYNC,
+    file_logs: bool = not FLASK_DEBUG,
+    console: bool = True,
+    trace_export_path: str = TRACE_EXPORT_PATH,
+):
     """Setup comprehensive logging with different levels for different components"""
     # Create logs directory if it doesn't exist
-    log_dir = os.path.join(os.path.dirname(__file__), "logs")
-    os.makedirs(log_dir, exist_ok=True)
+    log_dir = log_dir or os.path.join(os.path.dirname(__file__), "logs")
+    if file_logs:
+        os.makedirs(log_dir, exist_ok=True)
 
     # Main application logger
     app_logger = logging.getLogger("cybersec_lab")
@@ -88,48 +404,518 @@ def setup_logging():
     perf_logger = logging.getLogger("performance")
     perf_logger.setLevel(logging.INFO)
 
+    # Request trace export (JSON lines, only written when enabled)
+    trace_logger = logging.getLogger("request_traces")
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
     # Formatters
     detailed_formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s"
     )
     simple_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 
+    handlers: List[logging.Handler] = []
+
     # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.DEBUG if FLASK_DEBUG else logging.INFO)
-    console_handler.setFormatter(simple_formatter)
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setLevel(logging.DEBUG if FLASK_DEBUG else logging.INFO)
+        console_handler.setFormatter(simple_formatter)
+        console_handler.addFilter(lambda record: record.name != trace_logger.name)
+        handlers.append(console_handler)
+
+    # File handlers, one per logger, rotated and compressed
+    if file_logs:  # Only create file logs in production
+        for logger, filename in (
+            (app_logger, "app.log"),
+            (security_logger, "security.log"),
+            (perf_logger, "performance.log"),
+        ):
+            file_handler = CompressingRotatingFileHandler(
+                os.path.join(log_dir, filename)
+            )
+            file_handler.setLevel(logging.INFO)
+            file_handler.setFormatter(detailed_formatter)
+            file_handler.addFilter(logging.Filter(logger.name))
+            handlers.append(file_handler)
+
+    if trace_export_path:
+        trace_path = os.path.join(log_dir, trace_export_path)
+        os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+        trace_handler = CompressingRotatingFileHandler(trace_path)
+        trace_handler.setFormatter(logging.Formatter("%(message)s"))
+        trace_handler.addFilter(logging.Filter(trace_logger.name))
+        handlers.append(trace_handler)
+
+    log_pipeline.configure(
+        [app_logger, security_logger, perf_logger, trace_logger],
+        handlers,
+        use_queue=use_queue,
+    )
+    return app_logger, security_logger, perf_logger
 
-    # File handlers
-    if not FLASK_DEBUG:  # Only create file logs in production
-        app_file_handler = logging.FileHandler(os.path.join(log_dir, "app.log"))
-        app_file_handler.setLevel(logging.INFO)
-        app_file_handler.setFormatter(detailed_formatter)
 
-        security_file_handler = logging.FileHandler(
-            os.path.join(log_dir, "security.log")
-        )
-        security_file_handler.setLevel(logging.INFO)
-        security_file_handler.setFormatter(detailed_formatter)
+# Initialize loggers
+app_logger, security_logger, perf_logger = setup_logging()
+trace_logger = logging.getLogger("request_traces")  # handlers set by setup_logging
 
-        perf_file_handler = logging.FileHandler(
-            os.path.join(log_dir, "performance.log")
-        )
-        perf_file_handler.setLevel(logging.INFO)
-        perf_file_handler.setFormatter(detailed_formatter)
 
-        app_logger.addHandler(app_file_handler)
-        security_logger.addHandler(security_file_handler)
-        perf_logger.addHandler(perf_file_handler)
+# =========================
+# Metrics Registry
+# =========================
+def _log_buckets(low: float, high: float, per_doubling: int) -> Tuple[float, ...]:
+    """Geometric histogram bounds in seconds, ``per_doubling`` buckets per 2x"""
+    factor = 2 ** (1 / per_doubling)
+    bounds = []
+    bound = low
+    while bound < high:
+        bounds.append(float(f"{bound:.6g}"))
+        bound *= factor
+    return tuple(bounds)
+
 
-    # Add console handlers
-    for logger in [app_logger, security_logger, perf_logger]:
-        logger.addHandler(console_handler)
+# 25us .. 60s at ~41% resolution: 43 buckets per operation
+LATENCY_BUCKETS = _log_buckets(0.000025, 60.0, 2)
 
-    return app_logger, security_logger, perf_logger
 
+class OperationMetrics:
+    """Log-bucketed latency histogram, error count and in-flight gauge.
 
-# Initialize loggers
-app_logger, security_logger, perf_logger = setup_logging()
+    The hot path is one ``deque.append`` per event (atomic under the GIL,
+    no lock): ``None`` for a start, the duration for a finish and ``False``
+    for an error. Events are folded into the buckets in batches, by
+    whichever caller fills the buffer or by a reader, so recording costs
+    a few hundred nanoseconds even with many threads.
+    """
+
+    __slots__ = (
+        "name", "bounds", "counts", "count", "sum", "errors", "in_flight", "_events", "_lock"
+    )
+
+    FOLD_AT = 1024  # buffered events before a writer folds them
+
+    def __init__(self, name: str, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.in_flight = 0
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._events.append(None)
+
+    def finish(self, seconds: float, failed: bool = False):
+        events = self._events
+        events.append(seconds)
+        if failed:
+            events.append(False)
+        if len(events) >= self.FOLD_AT:
+            self._fold(blocking=False)
+
+    def _fold(self, blocking: bool = True):
+        if not self._lock.acquire(blocking):
+            return  # another thread is already folding
+        try:
+            events, bounds, counts = self._events, self.bounds, self.counts
+            popleft = events.popleft
+            for _ in range(len(events)):
+                value = popleft()
+                if value is None:
+                    self.in_flight += 1
+                elif value is False:
+                    self.errors += 1
+                else:
+                    self.in_flight -= 1
+                    self.count += 1
+                    self.sum += value
+                    counts[bisect.bisect_left(bounds, value)] += 1
+        finally:
+            self._lock.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._fold()
+        with self._lock:
+            return {
+                "counts": list(self.counts),
+                "count": self.count,
+                "sum": self.sum,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+            }
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> Optional[float]:
+        """Estimate a quantile (seconds), interpolating inside the bucket"""
+        if counts is None:
+            counts = self.snapshot()["counts"]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, bucket in enumerate(counts):
+            if bucket and seen + bucket >= rank:
+                if index >= len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index]
+                return lower + (upper - lower) * ((rank - seen) / bucket)
+            seen += bucket
+        return self.bounds[-1]
+
+
+def _prom_escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prom_labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_prom_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _guac_endpoint(path: str) -> str:
+    """Low-cardinality label for a Guacamole REST path (never includes tokens)"""
+    path = path.split("?", 1)[0]
+    if path.startswith("/api/tokens/"):
+        return "/api/tokens/{token}"
+    return re.sub(r"^/api/session/data/[^/]+", "/api/session/data/{ds}", path)
+
+
+class MetricsRegistry:
+    """In-process metrics exposed in Prometheus text format at /metrics"""
+
+    def __init__(self, prefix: str = "cyberrange"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._operations: Dict[str, OperationMetrics] = {}
+        self._guac_calls: Dict[Tuple[str, str, str], List[float]] = {}
+        self._gauges: List[Tuple[str, str, Any, str, str]] = []
+
+    def operation(self, name: str) -> OperationMetrics:
+        op = self._operations.get(name)
+        if op is None:
+            with self._lock:
+                op = self._operations.setdefault(name, OperationMetrics(name))
+        return op
+
+    def guac_call(self, method: str, path: str, status: Any, seconds: float):
+        key = (method, _guac_endpoint(path), str(status))
+        with self._lock:
+            entry = self._guac_calls.get(key)
+            if entry is None:
+                self._guac_calls[key] = [1, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+
+    def gauge(self, name: str, help_text: str, read, label: str = "", kind: str = "gauge"):
+        """Register a gauge whose value is read from ``read()`` at scrape time.
+
+        With ``label`` set, ``read()`` returns ``{label_value: value}`` and one
+        sample is rendered per entry.
+        """
+        self._gauges.append((name, help_text, read, label, kind))
+
+    def counter(self, name: str, help_text: str, read, label: str = ""):
+        """Register a monotonically increasing value read at scrape time"""
+        self.gauge(name, help_text, read, label, kind="counter")
+
+    def summary(self) -> Dict[str, Any]:
+        """Per-operation count, errors and p50/p95/p99 in milliseconds"""
+        out = {}
+        for name, op in sorted(self._operations.items()):
+            snap = op.snapshot()
+            out[name] = {
+                "count": snap["count"],
+                "errors": snap["errors"],
+                "in_flight": snap["in_flight"],
+            }
+            for label, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+                value = op.quantile(q, snap["counts"])
+                out[name][label] = round(value * 1000, 3) if value is not None else None
+        return out
+
+    def render_prometheus(self) -> str:
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_operation_duration_seconds Latency of monitored operations",
+            f"# TYPE {p}_operation_duration_seconds histogram",
+        ]
+        errors, in_flight = [], []
+        for name, op in sorted(self._operations.items()):
+            snap = op.snapshot()
+            cumulative = 0
+            for bound, bucket in zip(op.bounds, snap["counts"]):
+                cumulative += bucket
+                labels = _prom_labels(operation=name, le=f"{bound:g}")
+                lines.append(f"{p}_operation_duration_seconds_bucket{labels} {cumulative}")
+            labels = _prom_labels(operation=name, le="+Inf")
+            lines.append(f"{p}_operation_duration_seconds_bucket{labels} {snap['count']}")
+            labels = _prom_labels(operation=name)
+            lines.append(f"{p}_operation_duration_seconds_sum{labels} {snap['sum']:.6f}")
+            lines.append(f"{p}_operation_duration_seconds_count{labels} {snap['count']}")
+            errors.append(f"{p}_operation_errors_total{labels} {snap['errors']}")
+            in_flight.append(f"{p}_operation_in_flight{labels} {snap['in_flight']}")
+
+        lines += [
+            f"# HELP {p}_operation_errors_total Monitored operations that raised or returned 5xx",
+            f"# TYPE {p}_operation_errors_total counter",
+            *errors,
+            f"# HELP {p}_operation_in_flight Monitored operations currently running",
+            f"# TYPE {p}_operation_in_flight gauge",
+            *in_flight,
+        ]
+
+        with self._lock:
+            guac_calls = sorted((k, list(v)) for k, v in self._guac_calls.items())
+        lines += [
+            f"# HELP {p}_guacamole_requests_total Guacamole REST calls by outcome",
+            f"# TYPE {p}_guacamole_requests_total counter",
+        ]
+        for (method, endpoint, status), (count, _) in guac_calls:
+            labels = _prom_labels(method=method, endpoint=endpoint, status=status)
+            lines.append(f"{p}_guacamole_requests_total{labels} {count}")
+        lines += [
+            f"# HELP {p}_guacamole_request_seconds_total Time spent in Guacamole REST calls",
+            f"# TYPE {p}_guacamole_request_seconds_total counter",
+        ]
+        for (method, endpoint, status), (_, seconds) in guac_calls:
+            labels = _prom_labels(method=method, endpoint=endpoint, status=status)
+            lines.append(f"{p}_guacamole_request_seconds_total{labels} {seconds:.6f}")
+
+        for name, help_text, read, label, kind in self._gauges:
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines += [f"# HELP {p}_{name} {help_text}", f"# TYPE {p}_{name} {kind}"]
+            if label:
+                for key, v in sorted(value.items()):
+                    lines.append(f"{p}_{name}{_prom_labels(**{label: key})} {v}")
+            else:
+                lines.append(f"{p}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def _failed_result(result) -> bool:
+    """True for failed results.
+
+    Endpoints fail on 5xx: Flask ``(body, status)``, ASGI ``(status, ...)``.
+    Guacamole helpers return ``(message, data_source, status)`` and fail
+    on any error status.
+    """
+    if isinstance(result, tuple):
+        if len(result) == 3 and isinstance(result[2], int):
+            return result[2] >= 400
+        status = next((v for v in result[:2] if isinstance(v, int)), 200)
+    else:
+        status = getattr(result, "status_code", 200)
+    return status >= 500
+
+
+# =========================
+# Request Tracing
+# =========================
+# The active trace and innermost span live in context variables, so each
+# request thread or asyncio task sees its own. Work handed to a pool is run
+# in a copied context to stay attached to the request that submitted it.
+_current_trace: contextvars.ContextVar = contextvars.ContextVar(
+    "request_trace", default=None
+)
+_current_span: contextvars.ContextVar = contextvars.ContextVar(
+    "request_span", default=0
+)
+
+
+class Span:
+    """One timed step of a RequestTrace; use via ``trace_span``"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "start", "end", "error", "_token")
+
+    def __init__(self, trace: "RequestTrace", name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = next(trace._ids)
+        self.parent_id = _current_span.get()
+        self.name = name
+        self.attrs = attrs
+        self.start = self.end = None
+        self.error = False
+
+    def __enter__(self):
+        self.trace.spans.append(self)
+        self._token = _current_span.set(self.span_id)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        self.error = exc_type is not None
+        _current_span.reset(self._token)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class RequestTrace:
+    """Spans recorded while serving one request.
+
+    Rendered as a ``Server-Timing`` header (durations summed per span name,
+    plus ``total`` and ``local`` = total minus Guacamole HTTP time) and,
+    when TRACE_EXPORT_PATH is set, as JSON lines for offline flame graphs.
+    """
+
+    __slots__ = ("trace_id", "name", "attrs", "wall_start", "start", "end", "spans", "_ids")
+
+    def __init__(self, name: str, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: List[Span] = []
+        self._ids = itertools.count(1)
+
+    def record(self, name: str, start: float, **attrs):
+        """Add a span that has already happened (e.g. a lock wait)"""
+        span = Span(self, name, attrs)
+        span.start, span.end = start, time.perf_counter()
+        self.spans.append(span)
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    def server_timing(self) -> str:
+        total = ((self.end or time.perf_counter()) - self.start) * 1000
+        totals: Dict[str, List[float]] = {}
+        for span in list(self.spans):
+            if span.end is not None:
+                entry = totals.setdefault(span.name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += (span.end - span.start) * 1000
+        guac = totals.get("guac", (0, 0.0))[1]
+        parts = [f"total;dur={total:.2f}", f"local;dur={max(total - guac, 0.0):.2f}"]
+        parts += [
+            f'{name};dur={dur:.2f};desc="{int(count)}x"'
+            for name, (count, dur) in totals.items()
+        ]
+        return ", ".join(parts)
+
+    def __str__(self) -> str:
+        """JSON lines: the request as span 0, then one line per span"""
+        end = self.end or time.perf_counter()
+        lines = [
+            json.dumps(
+                {
+                    "trace_id": self.trace_id,
+                    "span_id": 0,
+                    "parent_id": None,
+                    "name": self.name,
+                    "ts": self.wall_start,
+                    "start_ms": 0.0,
+                    "duration_ms": round((end - self.start) * 1000, 3),
+                    "attrs": self.attrs,
+                }
+            )
+        ]
+        for span in list(self.spans):
+            if span.end is None:
+                continue
+            lines.append(
+                json.dumps(
+                    {
+                        "trace_id": self.trace_id,
+                        "span_id": span.span_id,
+                        "parent_id": span.parent_id,
+                        "name": span.name,
+                        "start_ms": round((span.start - self.start) * 1000, 3),
+                        "duration_ms": round((span.end - span.start) * 1000, 3),
+                        "error": span.error,
+                        "attrs": span.attrs,
+                    },
+                    default=str,
+                )
+            )
+        return "\n".join(lines)
+
+
+def trace_span(name: str, **attrs):
+    """Context manager timing a step of the current request (no-op outside one)"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return Span(trace, name, attrs)
+
+
+def start_trace(name: str, **attrs) -> Tuple[RequestTrace, contextvars.Token]:
+    trace = RequestTrace(name, **attrs)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(trace: RequestTrace, token: contextvars.Token):
+    """Detach the trace from the context and export it if enabled"""
+    trace.finish()
+    _current_trace.reset(token)
+    if TRACE_EXPORT_PATH:
+        trace_logger.info("%s", trace)  # serialized on the log writer thread
+
+
+class TracedLock:
+    """``threading.Lock`` that records contended acquisitions as ``lock.<name>`` spans.
+
+    The uncontended path is a single non-blocking acquire and records
+    nothing, so traces only show locks that actually made a request wait.
+    """
+
+    __slots__ = ("_lock", "name")
+
+    def __init__(self, name: str):
+        self._lock = threading.Lock()
+        self.name = f"lock.{name}"
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.record(self.name, start)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._lock.release()
+        return False
 
 
 # =========================
@@ -139,369 +925,4572 @@ def monitor_performance(operation_name: str):
     """Decorator to monitor API endpoint performance"""
 
     def decorator(f):
-        @wraps(f)
-        def wrapper(*args, **kwargs):
-            start_time = time.time()
-            try:
-                result = f(*args, **kwargs)
-                duration = (time.time() - start_time) * 1000  # Convert to ms
+        op = metrics.operation(operation_name)
+
+        if inspect.iscoroutinefunction(f):
+
+            @wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                op.start()
+                start_time = time.perf_counter()
+                try:
+                    with trace_span(operation_name):
+                        result = await f(*args, **kwargs)
+                except Exception as e:
+                    duration = time.perf_counter() - start_time
+                    op.finish(duration, failed=True)
+                    perf_logger.error(
+                        "PERF: %s failed after %.2fms - %s",
+                        operation_name,
+                        duration * 1000,
+                        e,
+                    )
+                    raise
+                duration = time.perf_counter() - start_time
+                op.finish(duration, failed=_failed_result(result))
                 perf_logger.info(
-                    f"PERF: {operation_name} completed in {duration:.2f}ms"
+                    "PERF: %s completed in %.2fms", operation_name, duration * 1000
                 )
                 return result
+
+            return async_wrapper
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            op.start()
+            start_time = time.perf_counter()
+            try:
+                with trace_span(operation_name):
+                    result = f(*args, **kwargs)
             except Exception as e:
-                duration = (time.time() - start_time) * 1000
+                duration = time.perf_counter() - start_time
+                op.finish(duration, failed=True)
                 perf_logger.error(
-                    f"PERF: {operation_name} failed after {duration:.2f}ms - {str(e)}"
+                    "PERF: %s failed after %.2fms - %s",
+                    operation_name,
+                    duration * 1000,
+                    e,
                 )
                 raise
+            duration = time.perf_counter() - start_time
+            op.finish(duration, failed=_failed_result(result))
+            perf_logger.info(
+                "PERF: %s completed in %.2fms", operation_name, duration * 1000
+            )
+            return result
 
         return wrapper
 
     return decorator
 
 
+# =========================
+# Admin Access Decorator
+# =========================
+def is_admin_request() -> bool:
+    """Whether the current request comes from an operator (see require_admin)"""
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+    return (request.remote_addr or "") in ("127.0.0.1", "::1")
+
+
+def require_admin(f):
+    """Restrict an endpoint to operators.
+
+    With ``ADMIN_TOKEN`` set the caller must send it in ``X-Admin-Token``;
+    without it only loopback clients (e.g. curl on the lab host) are allowed.
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        client_ip = request.remote_addr or ""
+        allowed = is_admin_request()
+        if not allowed:
+            security_logger.warning(
+                "ADMIN_DENIED: ip=%s, path=%s", client_ip, request.path
+            )
+            return jsonify({"error": "Admin access required"}), 403
+        security_logger.info("ADMIN_ACCESS: ip=%s, path=%s", client_ip, request.path)
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+# =========================
+# Response Compression & ETags
+# =========================
+_COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+)
+
+
+def http_cache(compress: bool = True, etag: bool = True):
+    """Per-endpoint policy for ResponseOptimizer.
+
+    Everything is eligible by default; endpoints whose body changes on every
+    call (timestamps, fresh tokens) should pass ``etag=False`` so we don't
+    hash bodies that can never match.
+    """
+
+    def decorator(f):
+        f._http_cache = {"compress": compress, "etag": etag}
+        return f
+
+    return decorator
+
+
+class ResponseOptimizer:
+    """Content-encoding negotiation, strong ETags and 304s for API responses.
+
+    Shared by the Flask ``after_request`` hook and the ASGI router so both
+    serving modes produce identical headers. ETags are computed over the
+    identity body and suffixed per encoding, so each representation has its
+    own strong validator.
+    """
+
+    def __init__(self, min_size: int = COMPRESS_MIN_SIZE, level: int = COMPRESS_LEVEL):
+        self.min_size = min_size
+        self.level = level
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+        self._lock = threading.Lock()
+        self._compressed = {encoding: 0 for encoding in self.encodings}
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._not_modified = 0
+        self._not_modified_bytes = 0
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        """Best supported encoding for an Accept-Encoding header, if any"""
+        if not accept_encoding:
+            return None
+        accepted = parse_accept_header(accept_encoding)
+        best, best_q = None, 0
+        for encoding in self.encodings:
+            q = accepted.quality(encoding)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=min(self.level, 11))
+        return gzip.compress(body, compresslevel=self.level)
+
+    def optimize(
+        self,
+        method: str,
+        status: int,
+        content_type: str,
+        body: bytes,
+        accept_encoding: str = "",
+        if_none_match: str = "",
+        policy: Optional[Dict[str, bool]] = None,
+    ) -> Tuple[int, bytes, Dict[str, str]]:
+        """Returns ``(status, body, headers_to_add)`` for a buffered response"""
+        policy = policy or {}
+        headers: Dict[str, str] = {}
+
+        encoding = None
+        if (
+            policy.get("compress", True)
+            and len(body) >= self.min_size
+            and (content_type or "").startswith(_COMPRESSIBLE_TYPES)
+        ):
+            headers["Vary"] = "Accept-Encoding"
+            encoding = self.negotiate(accept_encoding)
+
+        if (
+            policy.get("etag", True)
+            and method in ("GET", "HEAD")
+            and status == 200
+        ):
+            etag = hashlib.sha1(body).hexdigest()
+            if encoding:
+                etag = f"{etag}-{encoding}"
+            headers["ETag"] = f'"{etag}"'
+            if if_none_match and parse_etags(if_none_match).contains(etag):
+                with self._lock:
+                    self._not_modified += 1
+                    self._not_modified_bytes += len(body)
+                return 304, b"", headers
+
+        if encoding:
+            compressed = self.compress(body, encoding)
+            if len(compressed) < len(body):
+                with self._lock:
+                    self._compressed[encoding] += 1
+                    self._bytes_in += len(body)
+                    self._bytes_out += len(compressed)
+                headers["Content-Encoding"] = encoding
+                return status, compressed, headers
+
+        return status, body, headers
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "encodings": list(self.encodings),
+                "min_size": self.min_size,
+                "compressed": dict(self._compressed),
+                "bytes_in": self._bytes_in,
+                "bytes_out": self._bytes_out,
+                "bytes_saved": self._bytes_in - self._bytes_out,
+                "not_modified": self._not_modified,
+                "not_modified_bytes_saved": self._not_modified_bytes,
+            }
+
+
+response_optimizer = ResponseOptimizer()
+
+
 # =========================
 # Enhanced Session Management
 # =========================
-class SessionManager:
+# Bit per GUAC_USERS entry, for SessionRecord.connections
+_CONNECTION_BITS = {user_type: 1 << i for i, user_type in enumerate(GUAC_USERS)}
+
+
+class SessionRecord:
+    """Compact per-session state.
+
+    Timestamps are floats (``created_at`` is epoch seconds, ``last_seen`` is
+    on the owning store's clock), active connections are a bitmask over
+    ``GUAC_USERS`` and tokens plus the rarely used optional fields are only
+    allocated when first written. ``to_dict`` produces the historical JSON
+    shape at the API boundary.
+    """
+
+    __slots__ = ("id", "created_at", "last_seen", "connections", "tokens", "extras")
+
+    def __init__(self, session_id: str, created_at: float, last_seen: float):
+        self.id = session_id
+        self.created_at = created_at
+        self.last_seen = last_seen
+        self.connections = 0
+        self.tokens: Optional[Dict[str, str]] = None
+        self.extras: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @property
+    def active_connections(self) -> List[str]:
+        return [ut for ut, bit in _CONNECTION_BITS.items() if self.connections & bit]
+
+    def to_dict(self, wall_offset: float = 0.0) -> Dict[str, Any]:
+        """Serialize; ``wall_offset`` converts ``last_seen`` to epoch seconds"""
+        extras = self.extras or {}
+        return {
+            "id": self.id,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "last_activity": datetime.fromtimestamp(
+                self.last_seen + wall_offset
+            ).isoformat(),
+            "active_connections": self.active_connections,
+            "scenario_status": extras.get("scenario_status", {}),
+            "user_preferences": extras.get("user_preferences", {}),
+            "client_info": extras.get("client_info", {}),
+        }
+
+
+class SessionStore(ABC):
+    """Where SessionManager keeps session state.
+
+    ``SessionManager`` owns logging and the expiry thread; a store only
+    holds data. Stores choose their own clock (``clock()``) for activity
+    timestamps and deadlines: the in-memory store uses ``time.monotonic``,
+    shared stores use wall-clock time so every worker process agrees.
+    """
+
+    timeout: float
+
+    @abstractmethod
+    def clock(self) -> float:
+        raise NotImplementedError
+
+    def wall_offset(self) -> float:
+        """Seconds to add to a ``clock()`` reading to get epoch time"""
+        return 0.0
+
+    @abstractmethod
+    def create_session(self, record: SessionRecord) -> float:
+        """Store a new session; returns its expiry deadline on ``clock()``"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_record(self, session_id: str) -> Optional[SessionRecord]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def touch(self, session_id: str) -> bool:
+        """Record activity; returns False if the session does not exist"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_token(self, session_id: str, user_type: str, token: str) -> Optional[str]:
+        """Store the token; returns the one it replaced, if any"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_token(self, session_id: str, user_type: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_token(self, session_id: str, user_type: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_connection(self, session_id: str, user_type: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_connection(self, session_id: str, user_type: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def expire(self, now: float) -> List[Tuple[str, List[str]]]:
+        """Remove sessions idle past the timeout.
+
+        Returns ``(session_id, tokens)`` per removed session, with the
+        Guacamole tokens it held so they can be invalidated.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def tokens_in_use(self, tokens: Set[str]) -> Set[str]:
+        """The subset of ``tokens`` still held by some live session"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def take_rate_token(self, key: str, rate: float, burst: float) -> float:
+        """Take one token from bucket ``key``; returns 0.0, or seconds to wait"""
+        raise NotImplementedError
+
+    def prune_rate_buckets(self, idle: float) -> int:
+        """Drop buckets untouched for ``idle`` seconds (they are full again)"""
+        return 0
+
+    def next_deadline(self) -> Optional[float]:
+        """Earliest pending deadline on ``clock()``, or None if unknown"""
+        return None
+
+    @abstractmethod
+    def session_ids(self) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def session_count(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def active_connection_count(self) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _take_from_bucket(
+    tokens: float, updated: float, now: float, rate: float, burst: float
+) -> Tuple[float, float]:
+    """Token-bucket step: returns ``(tokens left, seconds to wait or 0.0)``"""
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1.0:
+        return tokens - 1.0, 0.0
+    return tokens, (1.0 - tokens) / rate
+
+
+class _SessionShard:
+    """One slice of session records with its own lock.
+
+    Writers hold ``lock``; readers go straight to the dict. Record fields
+    are replaced rather than mutated in place (token maps are copied on
+    write), so a lock-free reader always sees a consistent value. Rate
+    limit buckets ``(tokens, updated)`` hash into the same shards.
+    """
+
+    __slots__ = ("lock", "sessions", "buckets")
+
     def __init__(self):
-        self.active_sessions: Dict[str, Dict[str, Any]] = {}
-        self.user_tokens: Dict[str, Dict[str, str]] = {}
-        self.connection_status: Dict[str, Dict[str, Any]] = {}
-        self.lock = threading.Lock()
-        self._start_cleanup_thread()
+        self.lock = TracedLock("session_shard")
+        self.sessions: Dict[str, SessionRecord] = {}
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+
+
+class MemorySessionStore(SessionStore):
+    """Process-local store sharded by session_id hash.
+
+    Each shard has its own lock, so requests for different sessions rarely
+    contend, and reads (``get_record``, ``get_token``) take no lock at all.
+
+    Expiry is driven by a min-heap of ``(deadline, session_id)`` over
+    monotonic time. Activity updates only bump ``last_seen``; when an entry
+    reaches the top of the heap the session is either expired or re-queued
+    at its real deadline, so a sweep costs O(expired log n).
+    """
+
+    def __init__(self, shards: int = SESSION_SHARDS, timeout: float = SESSION_TIMEOUT):
+        # Round up to a power of two so shard selection is a mask
+        count = 1
+        while count < max(shards, 1):
+            count <<= 1
+        self._shards = [_SessionShard() for _ in range(count)]
+        self._mask = count - 1
+        self.timeout = timeout
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._expiry_lock = TracedLock("session_expiry")
+
+    def _shard(self, session_id: str) -> _SessionShard:
+        return self._shards[hash(session_id) & self._mask]
+
+    def clock(self) -> float:
+        return time.monotonic()
+
+    def wall_offset(self) -> float:
+        return time.time() - time.monotonic()
+
+    def _schedule_expiry(self, deadline: float, session_id: str):
+        with self._expiry_lock:
+            heapq.heappush(self._expiry_heap, (deadline, session_id))
+
+    def create_session(self, record: SessionRecord) -> float:
+        shard = self._shard(record.id)
+        with shard.lock:
+            shard.sessions[record.id] = record
+        deadline = record.last_seen + self.timeout
+        self._schedule_expiry(deadline, record.id)
+        return deadline
+
+    def get_record(self, session_id: str) -> Optional[SessionRecord]:
+        return self._shard(session_id).sessions.get(session_id)
+
+    def touch(self, session_id: str) -> bool:
+        # A single attribute assignment is atomic; no lock for the hot path
+        record = self._shard(session_id).sessions.get(session_id)
+        if record is None:
+            return False
+        record.last_seen = time.monotonic()
+        return True
+
+    def set_token(self, session_id: str, user_type: str, token: str):
+        shard = self._shard(session_id)
+        with shard.lock:
+            record = shard.sessions.get(session_id)
+            if record is None:
+                return None
+            tokens = dict(record.tokens) if record.tokens else {}
+            previous = tokens.get(user_type)
+            tokens[user_type] = token
+            record.tokens = tokens
+        return previous
+
+    def get_token(self, session_id: str, user_type: str) -> Optional[str]:
+        record = self._shard(session_id).sessions.get(session_id)
+        if record is None or not record.tokens:
+            return None
+        return record.tokens.get(user_type)
+
+    def remove_token(self, session_id: str, user_type: str) -> bool:
+        shard = self._shard(session_id)
+        with shard.lock:
+            record = shard.sessions.get(session_id)
+            if record is None or not record.tokens or user_type not in record.tokens:
+                return False
+            tokens = dict(record.tokens)
+            tokens.pop(user_type)
+            record.tokens = tokens or None
+        return True
+
+    def add_connection(self, session_id: str, user_type: str) -> bool:
+        bit = _CONNECTION_BITS.get(user_type, 0)
+        shard = self._shard(session_id)
+        with shard.lock:
+            record = shard.sessions.get(session_id)
+            if record is None or not bit or record.connections & bit:
+                return False
+            record.connections |= bit
+        return True
+
+    def remove_connection(self, session_id: str, user_type: str) -> bool:
+        bit = _CONNECTION_BITS.get(user_type, 0)
+        shard = self._shard(session_id)
+        with shard.lock:
+            record = shard.sessions.get(session_id)
+            if record is None or not record.connections & bit:
+                return False
+            record.connections &= ~bit
+        return True
+
+    def expire(self, now: float) -> List[Tuple[str, List[str]]]:
+        due = []
+        with self._expiry_lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                due.append(heapq.heappop(self._expiry_heap))
+
+        expired = []
+        for _, session_id in due:
+            shard = self._shard(session_id)
+            with shard.lock:
+                record = shard.sessions.get(session_id)
+                if record is None:
+                    continue  # Already removed
+                deadline = record.last_seen + self.timeout
+                if deadline > now:
+                    # Active since it was queued: re-queue at its real deadline
+                    self._schedule_expiry(deadline, session_id)
+                    continue
+                del shard.sessions[session_id]
+            expired.append((session_id, list(record.tokens.values()) if record.tokens else []))
+        return expired
+
+    def tokens_in_use(self, tokens: Set[str]) -> Set[str]:
+        # Lock-free scan, like the other readers; only the reaper calls this
+        held = set()
+        for shard in self._shards:
+            for record in list(shard.sessions.values()):
+                if record.tokens:
+                    held.update(t for t in record.tokens.values() if t in tokens)
+        return held
+
+    def next_deadline(self) -> Optional[float]:
+        with self._expiry_lock:
+            return self._expiry_heap[0][0] if self._expiry_heap else None
+
+    def take_rate_token(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        shard = self._shard(key)
+        with shard.lock:
+            bucket = shard.buckets.get(key)
+            tokens, wait = _take_from_bucket(
+                bucket[0] if bucket else burst, bucket[1] if bucket else now, now, rate, burst
+            )
+            shard.buckets[key] = (tokens, now)
+        return wait
+
+    def prune_rate_buckets(self, idle: float) -> int:
+        cutoff = time.monotonic() - idle
+        pruned = 0
+        for shard in self._shards:
+            with shard.lock:
+                stale = [k for k, (_, updated) in shard.buckets.items() if updated < cutoff]
+                for key in stale:
+                    del shard.buckets[key]
+            pruned += len(stale)
+        return pruned
+
+    def session_ids(self) -> List[str]:
+        return [sid for shard in self._shards for sid in list(shard.sessions)]
+
+    def session_count(self) -> int:
+        return sum(len(shard.sessions) for shard in self._shards)
+
+    def active_connection_count(self) -> int:
+        return sum(
+            bin(record.connections).count("1")
+            for shard in self._shards
+            for record in list(shard.sessions.values())
+        )
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session store shared by every worker process on one host.
+
+    Uses SQLite in WAL mode, so readers never block the writer, with one
+    connection per thread. ``last_activity`` updates are the hottest write
+    (every request); they are buffered in memory and flushed by a
+    background thread in one transaction every ``flush_interval`` seconds
+    or ``batch_size`` updates, whichever comes first. Expiry writes the
+    buffer and runs an indexed range query on ``last_activity``
+    (wall-clock seconds) in one transaction.
+    """
+
+    def __init__(
+        self,
+        path: str = SESSION_DB_PATH,
+        timeout: float = SESSION_TIMEOUT,
+        flush_interval: float = SESSION_STORE_FLUSH_INTERVAL,
+        batch_size: int = SESSION_STORE_BATCH_SIZE,
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._pending: Dict[str, float] = {}
+        self._pending_lock = TracedLock("session_touches")
+        self._flush_wanted = threading.Event()
+        self.flushes = 0
+        self.flushed_updates = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                last_activity REAL NOT NULL,
+                active_connections TEXT NOT NULL DEFAULT '[]'
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_activity
+                ON sessions (last_activity);
+            CREATE TABLE IF NOT EXISTS tokens (
+                session_id TEXT NOT NULL,
+                user_type TEXT NOT NULL,
+                token TEXT NOT NULL,
+                PRIMARY KEY (session_id, user_type)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID;
+            """
+        )
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def clock(self) -> float:
+        return time.time()
+
+    # ---- Batched activity writes ----
+
+    def _flush_loop(self):
+        while True:
+            self._flush_wanted.wait(self.flush_interval)
+            self._flush_wanted.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                app_logger.error("Session store flush error: %s", e)
+
+    def _take_pending(self) -> Dict[str, float]:
+        with self._pending_lock:
+            batch, self._pending = self._pending, {}
+        return batch
+
+    def _restore_pending(self, batch: Dict[str, float]):
+        """Put back touches a failed transaction did not write"""
+        with self._pending_lock:
+            for sid, ts in batch.items():
+                if ts > self._pending.get(sid, 0.0):
+                    self._pending[sid] = ts
+
+    def _write_touches(self, conn: sqlite3.Connection, batch: Dict[str, float]):
+        """Apply buffered touches inside the caller's transaction"""
+        conn.executemany(
+            "UPDATE sessions SET last_activity = MAX(last_activity, ?) WHERE id = ?",
+            [(ts, sid) for sid, ts in batch.items()],
+        )
+        self.flushes += 1
+        self.flushed_updates += len(batch)
+
+    def flush(self):
+        """Write buffered last_activity updates in one transaction"""
+        batch = self._take_pending()
+        if not batch:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            self._write_touches(conn, batch)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            self._restore_pending(batch)
+            raise
+
+    def touch(self, session_id: str) -> bool:
+        # Primary-key reads are cheap under WAL; only the write is deferred
+        exists = self._conn().execute(
+            "SELECT 1 FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if exists is None:
+            return False
+        with self._pending_lock:
+            self._pending[session_id] = time.time()
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._flush_wanted.set()
+        return True
+
+    # ---- Sessions ----
+
+    def create_session(self, record: SessionRecord) -> float:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions (id, created_at, last_activity, active_connections)"
+            " VALUES (?, ?, ?, ?)",
+            (
+                record.id,
+                record.created_at,
+                record.last_seen,
+                json.dumps(record.active_connections),
+            ),
+        )
+        return record.last_seen + self.timeout
+
+    def get_record(self, session_id: str) -> Optional[SessionRecord]:
+        row = self._conn().execute(
+            "SELECT created_at, last_activity, active_connections FROM sessions WHERE id = ?",
+            (session_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        with self._pending_lock:
+            last_seen = max(row[1], self._pending.get(session_id, 0.0))
+        record = SessionRecord(session_id, float(row[0]), last_seen)
+        for user_type in json.loads(row[2]):
+            record.connections |= _CONNECTION_BITS.get(user_type, 0)
+        return record
+
+    def _update_connections(self, session_id: str, update) -> bool:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT active_connections FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            changed = False
+            if row is not None:
+                current = json.loads(row[0])
+                updated = update(current)
+                changed = updated != current
+                if changed:
+                    conn.execute(
+                        "UPDATE sessions SET active_connections = ? WHERE id = ?",
+                        (json.dumps(updated), session_id),
+                    )
+            conn.execute("COMMIT")
+            return changed
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def add_connection(self, session_id: str, user_type: str) -> bool:
+        return self._update_connections(
+            session_id, lambda c: c if user_type in c else c + [user_type]
+        )
+
+    def remove_connection(self, session_id: str, user_type: str) -> bool:
+        return self._update_connections(
+            session_id, lambda c: [x for x in c if x != user_type]
+        )
+
+    # ---- Tokens ----
+
+    def set_token(self, session_id: str, user_type: str, token: str) -> Optional[str]:
+        previous = self.get_token(session_id, user_type)
+        # Only for live sessions, so expiry never leaves orphaned tokens behind
+        self._conn().execute(
+            "INSERT OR REPLACE INTO tokens (session_id, user_type, token)"
+            " SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE id = ?)",
+            (session_id, user_type, token, session_id),
+        )
+        return previous
+
+    def get_token(self, session_id: str, user_type: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT token FROM tokens WHERE session_id = ? AND user_type = ?",
+            (session_id, user_type),
+        ).fetchone()
+        return row[0] if row else None
+
+    def remove_token(self, session_id: str, user_type: str) -> bool:
+        cursor = self._conn().execute(
+            "DELETE FROM tokens WHERE session_id = ? AND user_type = ?",
+            (session_id, user_type),
+        )
+        return cursor.rowcount > 0
+
+    # ---- Expiry and stats ----
+
+    def expire(self, now: float) -> List[Tuple[str, List[str]]]:
+        cutoff = now - self.timeout
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        # Buffered touches are written in this transaction, so none can
+        # land between the flush and the cutoff query
+        batch = self._take_pending()
+        try:
+            if batch:
+                self._write_touches(conn, batch)
+            candidates = [
+                r[0]
+                for r in conn.execute(
+                    "SELECT id FROM sessions WHERE last_activity <= ?", (cutoff,)
+                )
+            ]
+            # Touched since the batch was taken: still alive
+            with self._pending_lock:
+                expired = {
+                    sid: []
+                    for sid in candidates
+                    if self._pending.get(sid, 0.0) <= cutoff
+                }
+            if expired:
+                for session_id, token in conn.execute(
+                    "SELECT session_id, token FROM tokens WHERE session_id IN"
+                    " (SELECT id FROM sessions WHERE last_activity <= ?)",
+                    (cutoff,),
+                ):
+                    if session_id in expired:
+                        expired[session_id].append(token)
+                ids = [(sid,) for sid in expired]
+                conn.executemany("DELETE FROM sessions WHERE id = ?", ids)
+                conn.executemany("DELETE FROM tokens WHERE session_id = ?", ids)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            self._restore_pending(batch)
+            raise
+        return list(expired.items())
+
+    def tokens_in_use(self, tokens: Set[str]) -> Set[str]:
+        if not tokens:
+            return set()
+        wanted = list(tokens)
+        rows = self._conn().execute(
+            f"SELECT DISTINCT token FROM tokens WHERE token IN ({','.join('?' * len(wanted))})",
+            wanted,
+        )
+        return {r[0] for r in rows}
+
+    def next_deadline(self) -> Optional[float]:
+        row = self._conn().execute("SELECT MIN(last_activity) FROM sessions").fetchone()
+        return row[0] + self.timeout if row and row[0] is not None else None
+
+    # ---- Rate limit buckets ----
+
+    def take_rate_token(self, key: str, rate: float, burst: float) -> float:
+        # One short write transaction; every worker process sees the same bucket
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, wait = _take_from_bucket(
+                row[0] if row else burst, row[1] if row else now, now, rate, burst
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def prune_rate_buckets(self, idle: float) -> int:
+        cursor = self._conn().execute(
+            "DELETE FROM rate_buckets WHERE updated < ?", (time.time() - idle,)
+        )
+        return cursor.rowcount
+
+    def session_ids(self) -> List[str]:
+        return [r[0] for r in self._conn().execute("SELECT id FROM sessions")]
+
+    def session_count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def active_connection_count(self) -> int:
+        row = self._conn().execute(
+            "SELECT COALESCE(SUM(json_array_length(active_connections)), 0) FROM sessions"
+        ).fetchone()
+        return row[0]
+
+    def close(self):
+        self.flush()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_session_store(kind: str = SESSION_STORE) -> SessionStore:
+    """Build the session store selected by ``SESSION_STORE`` (memory|sqlite)"""
+    if kind == "sqlite":
+        app_logger.info("Using shared SQLite session store at %s", SESSION_DB_PATH)
+        return SQLiteSessionStore()
+    if kind != "memory":
+        app_logger.warning("Unknown SESSION_STORE '%s', using memory", kind)
+    return MemorySessionStore()
+
+
+class SessionManager:
+    """Session and token registry on top of a pluggable SessionStore.
+
+    Handles logging and expiry scheduling; the store decides where state
+    lives. The default in-memory store is process-local; use the SQLite
+    store (``SESSION_STORE=sqlite``) to run several worker processes.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SessionStore] = None,
+        start_cleanup: bool = True,
+        shards: int = SESSION_SHARDS,
+        timeout: float = SESSION_TIMEOUT,
+    ):
+        self.store = store or MemorySessionStore(shards=shards, timeout=timeout)
+        self._wake = threading.Event()
+        self._next_deadline: Optional[float] = None
+        self._expiry_listeners: List[Any] = []
+        self._token_listeners: List[Any] = []
+        if start_cleanup:
+            self._start_cleanup_thread()
 
     def _start_cleanup_thread(self):
-        """Start background thread for session cleanup"""
+        """Start background thread that expires sessions at their deadline"""
 
         def cleanup_loop():
             while True:
                 try:
+                    self._next_deadline = self.store.next_deadline()
+                    if self._next_deadline is None:
+                        delay = SESSION_EXPIRY_MAX_SLEEP
+                    else:
+                        delay = self._next_deadline - self.store.clock()
+                    if delay > 0:
+                        self._wake.wait(
+                            min(max(delay, SESSION_EXPIRY_GRANULARITY), SESSION_EXPIRY_MAX_SLEEP)
+                        )
+                        self._wake.clear()
+                        continue
                     self.cleanup_expired_sessions()
-                    time.sleep(300)  # Run every 5 minutes
                 except Exception as e:
-                    app_logger.error(f"Session cleanup error: {e}")
+                    app_logger.error("Session cleanup error: %s", e)
+                    time.sleep(SESSION_EXPIRY_GRANULARITY)
 
         cleanup_thread = threading.Thread(target=cleanup_loop, daemon=True)
         cleanup_thread.start()
         app_logger.info("Session cleanup thread started")
 
-    def create_session(self, session_id: str) -> Dict[str, Any]:
-        with self.lock:
-            session_data = {
-                "id": session_id,
-                "created_at": datetime.now().isoformat(),
-                "last_activity": datetime.now().isoformat(),
-                "active_connections": [],
-                "scenario_status": {},
-                "user_preferences": {},
-                "client_info": {},
-            }
-            self.active_sessions[session_id] = session_data
-            self.user_tokens[session_id] = {}
-            app_logger.info(f"Created new session: {session_id[:8]}...")
-            security_logger.info(f"SESSION_CREATED: {session_id}")
-            return session_data
+    def create_session(self, session_id: str) -> SessionRecord:
+        record = SessionRecord(session_id, time.time(), self.store.clock())
+        deadline = self.store.create_session(record)
+        if self._next_deadline is None or deadline < self._next_deadline:
+            self._wake.set()
+        app_logger.info("Created new session: %s...", session_id[:8])
+        security_logger.info("SESSION_CREATED: %s", session_id)
+        return record
 
-    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        with self.lock:
-            session = self.active_sessions.get(session_id)
-            if session:
-                app_logger.debug(f"Retrieved session: {session_id[:8]}...")
-            else:
-                app_logger.warning(f"Session not found: {session_id[:8]}...")
-            return session
+    def get_record(self, session_id: str) -> Optional[SessionRecord]:
+        """Internal accessor: the compact record, no serialization"""
+        return self.store.get_record(session_id)
 
-    def update_session_activity(self, session_id: str):
-        with self.lock:
-            if session_id in self.active_sessions:
-                self.active_sessions[session_id][
-                    "last_activity"
-                ] = datetime.now().isoformat()
-                app_logger.debug(f"Updated activity for session: {session_id[:8]}...")
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """API accessor: the session in its JSON shape"""
+        record = self.store.get_record(session_id)
+        if record:
+            app_logger.debug("Retrieved session: %s...", session_id[:8])
+            return record.to_dict(self.store.wall_offset())
+        app_logger.warning("Session not found: %s...", session_id[:8])
+        return None
+
+    def update_session_activity(self, session_id: str) -> bool:
+        """Record activity; returns False if the session no longer exists"""
+        if self.store.touch(session_id):
+            app_logger.debug("Updated activity for session: %s...", session_id[:8])
+            return True
+        return False
 
     def store_user_token(self, session_id: str, user_type: str, token: str):
-        with self.lock:
-            if session_id not in self.user_tokens:
-                self.user_tokens[session_id] = {}
-            self.user_tokens[session_id][user_type] = token
+        previous = self.store.set_token(session_id, user_type, token)
+        if previous and previous != token:
+            self._release_tokens([previous])
+        app_logger.info(
+            "Stored token for %s in session %s...", user_type, session_id[:8]
+        )
+        security_logger.info(
+            "TOKEN_STORED: session=%s, user_type=%s", session_id, user_type
+        )
+
+    def get_user_token(self, session_id: str, user_type: str) -> Optional[str]:
+        token = self.store.get_token(session_id, user_type)
+        if token:
+            app_logger.debug(
+                "Retrieved token for %s in session %s...", user_type, session_id[:8]
+            )
+        else:
+            app_logger.debug(
+                "No token found for %s in session %s...", user_type, session_id[:8]
+            )
+        return token
+
+    def remove_user_token(self, session_id: str, user_type: str):
+        if self.store.remove_token(session_id, user_type):
             app_logger.info(
-                f"Stored token for {user_type} in session {session_id[:8]}..."
+                "Removed token for %s in session %s...", user_type, session_id[:8]
             )
             security_logger.info(
-                f"TOKEN_STORED: session={session_id}, user_type={user_type}"
+                "TOKEN_REMOVED: session=%s, user_type=%s", session_id, user_type
             )
 
-    def get_user_token(self, session_id: str, user_type: str) -> Optional[str]:
-        with self.lock:
-            token = self.user_tokens.get(session_id, {}).get(user_type)
-            if token:
-                app_logger.debug(
-                    f"Retrieved token for {user_type} in session {session_id[:8]}..."
-                )
-            else:
-                app_logger.debug(
-                    f"No token found for {user_type} in session {session_id[:8]}..."
-                )
-            return token
+    def add_active_connection(self, session_id: str, user_type: str):
+        if self.store.add_connection(session_id, user_type):
+            app_logger.info(
+                "Added active connection %s to session %s...", user_type, session_id[:8]
+            )
+            security_logger.info(
+                "CONNECTION_ADDED: session=%s, user_type=%s", session_id, user_type
+            )
 
-    def remove_user_token(self, session_id: str, user_type: str):
-        with self.lock:
-            if session_id in self.user_tokens:
-                removed = self.user_tokens[session_id].pop(user_type, None)
-                if removed:
-                    app_logger.info(
-                        f"Removed token for {user_type} in session {session_id[:8]}..."
-                    )
-                    security_logger.info(
-                        f"TOKEN_REMOVED: session={session_id}, user_type={user_type}"
-                    )
+    def remove_active_connection(self, session_id: str, user_type: str):
+        if self.store.remove_connection(session_id, user_type):
+            app_logger.info(
+                "Removed active connection %s from session %s...",
+                user_type,
+                session_id[:8],
+            )
+            security_logger.info(
+                "CONNECTION_REMOVED: session=%s, user_type=%s", session_id, user_type
+            )
+
+    def session_ids(self) -> List[str]:
+        return self.store.session_ids()
+
+    def tokens_in_use(self, tokens: Set[str]) -> Set[str]:
+        return self.store.tokens_in_use(tokens)
+
+    def session_count(self) -> int:
+        return self.store.session_count()
+
+    def active_connection_count(self) -> int:
+        return self.store.active_connection_count()
+
+    def add_expiry_listener(self, callback):
+        """Call ``callback(session_id)`` for every session that expires"""
+        self._expiry_listeners.append(callback)
+
+    def add_token_listener(self, callback):
+        """Call ``callback(tokens)`` with Guacamole tokens the store dropped.
+
+        That is every token of an expired session and any token replaced by
+        ``store_user_token``; nothing has invalidated them yet.
+        """
+        self._token_listeners.append(callback)
+
+    def _release_tokens(self, tokens: List[str]):
+        for callback in self._token_listeners:
+            try:
+                callback(tokens)
+            except Exception as e:
+                app_logger.error("Session token listener failed: %s", e)
+
+    def cleanup_expired_sessions(self, now: Optional[float] = None) -> int:
+        """Expire every session whose deadline has passed; returns the count"""
+        now = self.store.clock() if now is None else now
+        expired_sessions = self.store.expire(now)
+
+        for session_id, tokens in expired_sessions:
+            app_logger.info("Cleaned up expired session: %s...", session_id[:8])
+            security_logger.info("SESSION_EXPIRED: %s", session_id)
+            for callback in self._expiry_listeners:
+                try:
+                    callback(session_id)
+                except Exception as e:
+                    app_logger.error("Session expiry listener failed: %s", e)
+            if tokens:
+                self._release_tokens(tokens)
+
+        if expired_sessions:
+            app_logger.info("Cleaned up %s expired sessions", len(expired_sessions))
+        return len(expired_sessions)
+
+
+session_manager = SessionManager(create_session_store())
+metrics.gauge(
+    "active_sessions", "Sessions held by the session store", session_manager.session_count
+)
+metrics.gauge(
+    "active_connections",
+    "Guacamole connections marked active across sessions",
+    session_manager.active_connection_count,
+)
+
+
+# =========================
+# Admission Control
+# =========================
+class RateLimiter:
+    """Token-bucket limits per session and per client IP.
+
+    Buckets live in the session store, so with ``SESSION_STORE=sqlite``
+    every worker process draws from the same buckets. A check is one O(1)
+    store operation per bucket; idle buckets are pruned once a minute.
+    """
+
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(
+        self,
+        store: SessionStore,
+        session_rate: float = RATE_LIMIT_SESSION_RATE,
+        session_burst: float = RATE_LIMIT_SESSION_BURST,
+        ip_rate: float = RATE_LIMIT_IP_RATE,
+        ip_burst: float = RATE_LIMIT_IP_BURST,
+        enabled: bool = RATE_LIMIT_ENABLED,
+    ):
+        self.store = store
+        self.enabled = enabled
+        self.limits = {
+            "session": (session_rate, session_burst),
+            "ip": (ip_rate, ip_burst),
+        }
+        # A bucket idle this long has refilled completely and can be dropped
+        self.idle = max(
+            (burst / rate for rate, burst in self.limits.values() if rate > 0),
+            default=0.0,
+        )
+        self._next_prune = time.monotonic() + self.PRUNE_INTERVAL
+        self._prune_lock = threading.Lock()
+        self.admitted = 0
+        self.limited = {scope: 0 for scope in self.limits}
+        self.pruned = 0
+
+    def check(self, session_id: Optional[str], client_ip: Optional[str]) -> float:
+        """Seconds the caller should wait, or 0.0 when the request is admitted"""
+        if not self.enabled:
+            return 0.0
+        self._maybe_prune()
+        for scope, ident in (("session", session_id), ("ip", client_ip)):
+            rate, burst = self.limits[scope]
+            if not ident or rate <= 0:
+                continue
+            wait = self.store.take_rate_token(f"{scope}:{ident}", rate, burst)
+            if wait:
+                self.limited[scope] += 1
+                security_logger.warning(
+                    "RATE_LIMITED: %s=%s, retry_after=%.1fs", scope, ident, wait
+                )
+                return wait
+        self.admitted += 1
+        return 0.0
+
+    def _maybe_prune(self):
+        if time.monotonic() < self._next_prune or not self._prune_lock.acquire(False):
+            return
+        try:
+            self._next_prune = time.monotonic() + self.PRUNE_INTERVAL
+            self.pruned += self.store.prune_rate_buckets(self.idle)
+        except Exception as e:
+            app_logger.error("Rate limit bucket prune failed: %s", e)
+        finally:
+            self._prune_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "admitted": self.admitted,
+            "limited": dict(self.limited),
+            "pruned_buckets": self.pruned,
+            "limits": {
+                scope: {"rate": rate, "burst": burst}
+                for scope, (rate, burst) in self.limits.items()
+            },
+        }
+
+
+class AdmissionGate:
+    """Global cap on concurrent outbound Guacamole logins.
+
+    Up to ``limit`` logins run at once; up to ``queue_size`` more wait at
+    most ``wait_timeout`` seconds for a slot. Anything beyond that is
+    turned away immediately so the caller can answer 503 with Retry-After
+    instead of piling more load onto Guacamole and its database.
+    """
+
+    def __init__(
+        self,
+        limit: int = GUAC_AUTH_CONCURRENCY,
+        queue_size: int = GUAC_AUTH_QUEUE,
+        wait_timeout: float = GUAC_AUTH_QUEUE_TIMEOUT,
+    ):
+        self.limit = max(1, limit)
+        self.queue_size = max(0, queue_size)
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition(threading.Lock())
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            try:
+                with trace_span("auth_queue"):
+                    ready = self._cond.wait_for(
+                        lambda: self.active < self.limit, self.wait_timeout
+                    )
+            finally:
+                self.waiting -= 1
+            if not ready:
+                self.timeouts += 1
+                return False
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    async def aacquire(self) -> bool:
+        """Coroutine version of :meth:`acquire`; waits in an executor thread"""
+        with self._cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, contextvars.copy_context().run, self.acquire)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The slot may still be granted after we stop waiting: hand it back
+            future.add_done_callback(lambda f: f.result() and self.release())
+            raise
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "queue_size": self.queue_size,
+                "active": self.active,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+
+def admission_controlled(gate: AdmissionGate):
+    """Run a Guacamole login only once ``gate`` admits it; else return 503"""
+
+    def rejected(user_type: str) -> Tuple[str, str, int]:
+        error_msg = f"Too many concurrent Guacamole logins; retry {user_type} shortly"
+        app_logger.warning(error_msg)
+        return error_msg, "", 503
+
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+
+            @wraps(f)
+            async def async_wrapper(user_type: str, *args, **kwargs):
+                if not await gate.aacquire():
+                    return rejected(user_type)
+                try:
+                    return await f(user_type, *args, **kwargs)
+                finally:
+                    gate.release()
+
+            return async_wrapper
+
+        @wraps(f)
+        def wrapper(user_type: str, *args, **kwargs):
+            if not gate.acquire():
+                return rejected(user_type)
+            try:
+                return f(user_type, *args, **kwargs)
+            finally:
+                gate.release()
+
+        return wrapper
+
+    return decorator
+
+
+def rate_limited_body(
+    retry_after: int, user_type: Optional[str] = None, prefix: str = ""
+) -> Tuple[int, str, bytes]:
+    """429 answer: the error page for auto-login navigations, JSON otherwise"""
+    message = f"Too many requests; retry in {retry_after}s"
+    if user_type is not None:
+        page = _generate_error_page(user_type, message, prefix)
+        return 429, "text/html; charset=utf-8", page.encode("utf-8")
+    body = json.dumps({"error": message, "retry_after": retry_after})
+    return 429, "application/json", body.encode("utf-8")
+
+
+def retry_after_seconds(wait: float) -> int:
+    return max(1, int(wait + 0.999))
+
+
+def is_rate_limited_path(path: str) -> bool:
+    return path.startswith("/api/guac/") and not path.startswith("/api/guac/assets/")
+
+
+rate_limiter = RateLimiter(session_manager.store)
+guac_auth_gate = AdmissionGate()
+metrics.counter(
+    "rate_limited_total",
+    "Requests to /api/guac/* rejected with 429",
+    lambda: rate_limiter.limited,
+    label="scope",
+)
+metrics.gauge(
+    "guac_auth_in_flight", "Outbound Guacamole logins running", lambda: guac_auth_gate.active
+)
+metrics.gauge(
+    "guac_auth_waiting", "Guacamole logins queued for a slot", lambda: guac_auth_gate.waiting
+)
+metrics.counter(
+    "guac_auth_rejected_total",
+    "Guacamole logins turned away with 503 (queue full or wait timed out)",
+    lambda: guac_auth_gate.rejected + guac_auth_gate.timeouts,
+)
+
+
+# =========================
+# Guacamole HTTP Client
+# =========================
+class GuacCircuitOpen(requests.exceptions.ConnectionError):
+    """Raised instead of calling a Guacamole endpoint whose breaker is open"""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(
+            f"Circuit open for Guacamole {endpoint}; retry in {retry_in:.0f}s"
+        )
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one Guacamole endpoint.
+
+    ``threshold`` failures in a row (exceptions or 5xx) open it; while open,
+    calls fail fast with GuacCircuitOpen. After ``cooldown`` seconds one
+    trial call is let through (half-open): success closes the breaker,
+    failure opens it for another cooldown.
+    """
+
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(
+        self,
+        endpoint: str,
+        threshold: int = GUAC_BREAKER_THRESHOLD,
+        cooldown: float = GUAC_BREAKER_COOLDOWN,
+    ):
+        self.endpoint = endpoint
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def before_call(self):
+        """Admit a call or raise GuacCircuitOpen"""
+        if self.state == "closed":
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self.state == "closed":
+                return
+            # One trial per cooldown; a trial that never reported is retried
+            if now >= max(self.opened_at, self.trial_at) + self.cooldown:
+                self.state = "half_open"
+                self.trial_at = now
+                return
+            self.rejected += 1
+            retry_in = max(self.opened_at, self.trial_at) + self.cooldown - now
+        raise GuacCircuitOpen(self.endpoint, retry_in)
+
+    def record(self, ok: bool):
+        if ok and self.state == "closed" and not self.failures:
+            return
+        with self._lock:
+            previous = self.state
+            if ok:
+                self.failures = 0
+                self.state = "closed"
+            else:
+                self.failures += 1
+                if previous == "half_open" or self.failures >= self.threshold:
+                    self.state = "open"
+                    self.opened_at = time.monotonic()
+                    if previous != "open":
+                        self.times_opened += 1
+        if self.state != previous:
+            log = app_logger.warning if self.state == "open" else app_logger.info
+            log(
+                "Guacamole breaker %s: %s -> %s", self.endpoint, previous, self.state
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == "open":
+                retry_in = max(
+                    0.0, self.opened_at + self.cooldown - time.monotonic()
+                )
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "retry_in_s": round(retry_in, 1),
+            }
+
+
+class CircuitBreakerRegistry:
+    """One CircuitBreaker per Guacamole endpoint, shared by both clients"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, path: str) -> CircuitBreaker:
+        endpoint = _guac_endpoint(path)
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(endpoint, CircuitBreaker(endpoint))
+        return breaker
+
+    def any_open(self) -> bool:
+        return any(b.state != "closed" for b in list(self._breakers.values()))
+
+    def states(self) -> Dict[str, int]:
+        return {
+            name: CircuitBreaker.STATES[b.state]
+            for name, b in list(self._breakers.items())
+        }
+
+    def rejections(self) -> Dict[str, int]:
+        return {name: b.rejected for name, b in list(self._breakers.items())}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: b.snapshot() for name, b in sorted(self._breakers.items())}
+
+
+guac_breakers = CircuitBreakerRegistry()
+metrics.gauge(
+    "guac_breaker_state",
+    "Guacamole circuit breaker per endpoint (0 closed, 1 half-open, 2 open)",
+    guac_breakers.states,
+    label="endpoint",
+)
+metrics.counter(
+    "guac_breaker_rejected_total",
+    "Guacamole calls failed fast by an open breaker",
+    guac_breakers.rejections,
+    label="endpoint",
+)
+
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+_RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+def _retry_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry number ``attempt + 1``"""
+    return random.uniform(0, min(GUAC_RETRY_BACKOFF_MAX, GUAC_RETRY_BACKOFF * 2**attempt))
+
+
+class GuacamoleClient:
+    """Shared keep-alive HTTP client for the Guacamole REST API.
+
+    All Guacamole calls go through one ``requests.Session`` backed by a
+    bounded urllib3 pool, so concurrent requests reuse TCP connections
+    instead of paying a fresh handshake per call. ``pool_maxsize`` caps the
+    sockets kept per host and ``pool_block`` makes callers wait for a free
+    socket instead of opening throwaway connections past the limit.
+
+    Calls default to separate connect/read timeouts, go through the
+    endpoint's circuit breaker, and idempotent methods are retried on
+    network errors and 502/503/504 with jittered backoff.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_connections: int = GUAC_POOL_CONNECTIONS,
+        pool_maxsize: int = GUAC_POOL_MAXSIZE,
+        pool_block: bool = GUAC_POOL_BLOCK,
+        verify: bool = False,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.verify = verify
+        self.pool_maxsize = pool_maxsize
+        self._adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=0,
+        )
+        self._session = requests.Session()
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+        self._session.headers.update({"Connection": "keep-alive"})
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._retries = 0
+
+    def request(
+        self, method: str, path: str, retries: int = GUAC_RETRIES, **kwargs
+    ) -> requests.Response:
+        """Send a request to ``{base_url}{path}`` through the shared pool"""
+        kwargs.setdefault("verify", self.verify)
+        kwargs.setdefault("timeout", (GUAC_CONNECT_TIMEOUT, GUAC_READ_TIMEOUT))
+        breaker = guac_breakers.get(path)
+        attempts = 1 + max(0, retries) if method in _IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            if attempt:
+                with self._lock:
+                    self._retries += 1
+                time.sleep(_retry_delay(attempt - 1))
+            breaker.before_call()
+            try:
+                response = self._send(method, path, **kwargs)
+            except requests.exceptions.RequestException:
+                breaker.record(False)
+                if attempt + 1 >= attempts:
+                    raise
+                continue
+            except Exception:
+                breaker.record(False)
+                raise
+            breaker.record(response.status_code < 500)
+            if response.status_code not in _RETRY_STATUSES or attempt + 1 >= attempts:
+                return response
+
+    def _send(self, method: str, path: str, **kwargs) -> requests.Response:
+        status: Any = "error"
+        start = time.perf_counter()
+        try:
+            with trace_span("guac", method=method, endpoint=_guac_endpoint(path)):
+                response = self._session.request(
+                    method, f"{self.base_url}{path}", **kwargs
+                )
+            status = response.status_code
+            return response
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            metrics.guac_call(method, path, status, time.perf_counter() - start)
+            with self._lock:
+                self._requests += 1
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", path, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool usage counters: a miss is a new TCP connection, a hit is a reuse"""
+        opened = 0
+        served = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            served += pool.num_requests
+        with self._lock:
+            total, errors, retries = self._requests, self._errors, self._retries
+        return {
+            "requests": total,
+            "errors": errors,
+            "retries": retries,
+            "pool_hits": max(served - opened, 0),
+            "pool_misses": opened,
+            "host_pools": len(pools),
+            "pool_maxsize": self.pool_maxsize,
+        }
+
+    def close(self):
+        self._session.close()
+
+
+guac_client = GuacamoleClient(GUAC_BASE)
+
+
+class AsyncGuacamoleClient:
+    """asyncio counterpart of GuacamoleClient for the ASGI serving mode.
+
+    Uses one aiohttp session with a bounded keep-alive connector, created
+    lazily on the running event loop. Requests are awaited rather than
+    parked on worker threads, so one process can hold hundreds of in-flight
+    Guacamole calls.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        limit: int = GUAC_POOL_MAXSIZE,
+        keepalive_timeout: float = 30.0,
+        verify: bool = False,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.verify = verify
+        self._session = None
+        self._requests = 0
+        self._errors = 0
+        self._retries = 0
+        self._in_flight = 0
+        self._peak_in_flight = 0
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            if aiohttp is None:
+                raise RuntimeError("aiohttp is required for the async Guacamole client")
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=None if self.verify else False,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        timeout: Optional[float] = None,
+        retries: int = GUAC_RETRIES,
+        **kwargs,
+    ) -> Tuple[int, Any]:
+        """Send a request and return ``(status, body)``; JSON bodies are decoded.
+
+        Same breaker and retry policy as GuacamoleClient. ``timeout`` caps
+        the whole call; by default connect and read timeouts apply.
+        """
+        if timeout is None:
+            client_timeout = aiohttp.ClientTimeout(
+                total=None,
+                connect=GUAC_CONNECT_TIMEOUT + GUAC_READ_TIMEOUT,  # includes pool wait
+                sock_connect=GUAC_CONNECT_TIMEOUT,
+                sock_read=GUAC_READ_TIMEOUT,
+            )
+        else:
+            client_timeout = aiohttp.ClientTimeout(total=timeout)
+        breaker = guac_breakers.get(path)
+        attempts = 1 + max(0, retries) if method in _IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            if attempt:
+                self._retries += 1
+                await asyncio.sleep(_retry_delay(attempt - 1))
+            breaker.before_call()
+            try:
+                status, body = await self._send(method, path, client_timeout, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                breaker.record(False)
+                if attempt + 1 >= attempts:
+                    raise
+                continue
+            except Exception:
+                breaker.record(False)
+                raise
+            breaker.record(status < 500)
+            if status not in _RETRY_STATUSES or attempt + 1 >= attempts:
+                return status, body
+
+    async def _send(self, method: str, path: str, client_timeout, **kwargs):
+        session = self._get_session()
+        self._requests += 1
+        self._in_flight += 1
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        status: Any = "error"
+        start = time.perf_counter()
+        try:
+            with trace_span("guac", method=method, endpoint=_guac_endpoint(path)):
+                async with session.request(
+                    method,
+                    f"{self.base_url}{path}",
+                    timeout=client_timeout,
+                    **kwargs,
+                ) as response:
+                    status = response.status
+                    if response.content_type == "application/json":
+                        body = await response.json()
+                    else:
+                        body = await response.text()
+            return status, body
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            metrics.guac_call(method, path, status, time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self._requests,
+            "errors": self._errors,
+            "retries": self._retries,
+            "in_flight": self._in_flight,
+            "peak_in_flight": self._peak_in_flight,
+            "limit": self.limit,
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+async_guac_client = AsyncGuacamoleClient(GUAC_BASE)
+
+
+# =========================
+# Guacamole Token Cache
+# =========================
+class _InFlight:
+    """One pending token fetch that concurrent callers wait on"""
+
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Tuple[str, str, int] = ("Token fetch did not complete", "", 500)
+
+
+class GuacTokenCache:
+    """TTL cache of Guacamole tokens keyed by (user_type, data_source).
+
+    Concurrent misses for the same key collapse into a single in-flight
+    login (single-flight); the other callers block until it finishes and
+    share its result. Entries inside the refresh margin are still served
+    while one background login replaces them, so callers never wait on a
+    refresh of a token that has not expired yet. Failed logins are not
+    cached; when a login fails because Guacamole is unreachable or its
+    breaker is open, the expired token is served for up to ``stale_grace``
+    seconds past its TTL.
+    """
+
+    def __init__(
+        self,
+        ttl: int = GUAC_TOKEN_CACHE_TTL,
+        refresh_margin: int = GUAC_TOKEN_REFRESH_MARGIN,
+        wait_timeout: float = 30.0,
+        stale_grace: int = GUAC_TOKEN_STALE_GRACE,
+    ):
+        self.ttl = ttl
+        self.stale_grace = stale_grace
+        self.refresh_margin = min(refresh_margin, ttl)
+        self.wait_timeout = wait_timeout
+        self._entries: Dict[Tuple[str, str], Tuple[str, str, float]] = {}
+        self._inflight: Dict[Tuple[str, str], _InFlight] = {}
+        self._async_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._background = set()
+        self._lock = TracedLock("token_cache")
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.stale_served = 0
+
+    def get(self, key: Tuple[str, str], fetch, force: bool = False):
+        """Return ``(token, data_source, status)`` for ``key``, calling ``fetch`` on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not force and now < entry[2]:
+                self.hits += 1
+                if now >= entry[2] - self.refresh_margin and key not in self._inflight:
+                    self.refreshes += 1
+                    flight = self._inflight[key] = _InFlight()
+                    threading.Thread(
+                        target=self._run, args=(key, fetch, flight), daemon=True
+                    ).start()
+                return entry[0], entry[1], 200
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._inflight[key] = _InFlight()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            self._run(key, fetch, flight)
+        else:
+            with trace_span("token_wait", user_type=key[0]):
+                done = flight.done.wait(self.wait_timeout)
+            if not done:
+                return f"Timed out waiting for token refresh for {key[0]}", "", 408
+        return flight.result
+
+    def _run(self, key: Tuple[str, str], fetch, flight: _InFlight):
+        try:
+            try:
+                result = fetch()
+            except Exception as e:
+                result = (f"Token fetch failed for {key[0]}: {e}", "", 500)
+            self._store(key, result)
+            flight.result = self._fallback(key, result)
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+            flight.done.set()
+
+    def _store(self, key: Tuple[str, str], result: Tuple[str, str, int]):
+        token, ds, status = result
+        if status == 200:
+            with self._lock:
+                self._entries[key] = (token, ds, time.monotonic() + self.ttl)
+
+    def _fallback(
+        self, key: Tuple[str, str], result: Tuple[str, str, int]
+    ) -> Tuple[str, str, int]:
+        """Swap an outage-type failure for the last token, within the stale grace"""
+        if result[2] != 408 and result[2] < 500:
+            return result
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry[2] + self.stale_grace:
+                return result
+            self.stale_served += 1
+        app_logger.warning("Serving stale Guacamole token for %s: %s", key[0], result[0])
+        return entry[0], entry[1], 200
+
+    async def aget(self, key: Tuple[str, str], fetch, force: bool = False):
+        """Coroutine version of :meth:`get`; ``fetch`` is an async callable.
+
+        Shares cached entries with the threaded path. Single-flight is per
+        event loop: concurrent coroutines await one login future.
+        """
+        now = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not force and now < entry[2]:
+                self.hits += 1
+                refresh = (
+                    now >= entry[2] - self.refresh_margin
+                    and key not in self._async_inflight
+                )
+                if refresh:
+                    self.refreshes += 1
+                    self._async_inflight[key] = loop.create_future()
+            else:
+                refresh = None
+                future = self._async_inflight.get(key)
+                leader = future is None
+                if leader:
+                    self.misses += 1
+                    future = self._async_inflight[key] = loop.create_future()
+                else:
+                    self.coalesced += 1
+
+        if refresh is not None:
+            if refresh:
+                task = loop.create_task(self._arun(key, fetch))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+            return entry[0], entry[1], 200
+
+        if leader:
+            return await self._arun(key, fetch)
+        try:
+            with trace_span("token_wait", user_type=key[0]):
+                return await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+        except asyncio.TimeoutError:
+            return f"Timed out waiting for token refresh for {key[0]}", "", 408
+
+    async def _arun(self, key: Tuple[str, str], fetch) -> Tuple[str, str, int]:
+        # Waiters get this if the leader is cancelled (e.g. its client left)
+        result = (f"Token fetch for {key[0]} was cancelled", "", 503)
+        try:
+            try:
+                result = await fetch()
+            except Exception as e:
+                result = (f"Token fetch failed for {key[0]}: {e}", "", 500)
+            self._store(key, result)
+            result = self._fallback(key, result)
+        finally:
+            with self._lock:
+                future = self._async_inflight.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(result)
+        return result
+
+    def holds_token(self, token: str) -> bool:
+        """Whether ``token`` is still handed out as a shared token"""
+        with self._lock:
+            return any(v[0] == token for v in self._entries.values())
+
+    def discard_token(self, token: str):
+        """Drop any entry holding ``token`` (e.g. after it was invalidated)"""
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v[0] == token]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "in_flight": len(self._inflight) + len(self._async_inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "refreshes": self.refreshes,
+                "stale_served": self.stale_served,
+                "ttl": self.ttl,
+            }
+
+
+token_cache = GuacTokenCache()
+
+
+class TokenValidationCache:
+    """Short-lived cache of token validation results.
+
+    ``/api/status`` is polled by the frontend; a token checked a few seconds
+    ago is answered from here instead of another Guacamole round-trip. Only
+    definitive answers are cached, never network errors; while Guacamole is
+    unreachable the last known answer is used regardless of age.
+    """
+
+    MAX_ENTRIES = 4096
+
+    def __init__(self, ttl: float = GUAC_VALIDATION_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[bool, float]] = {}
+        self._lock = TracedLock("token_validation")
+        self.hits = 0
+        self.misses = 0
+        self.validations = 0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self.last_latency_ms = 0.0
+
+    def get(self, token: str, stale: bool = False) -> Optional[bool]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if stale:
+                return entry[0] if entry else None
+            if entry and time.monotonic() < entry[1]:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def record(self, latency_ms: float):
+        with self._lock:
+            self.validations += 1
+            self.total_latency_ms += latency_ms
+            self.last_latency_ms = latency_ms
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+
+    def put(self, token: str, valid: bool):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.MAX_ENTRIES:
+                self._entries = {
+                    k: v for k, v in self._entries.items() if v[1] > now
+                }
+            self._entries[token] = (valid, now + self.ttl)
+
+    def discard(self, token: str):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "validations": self.validations,
+                "avg_latency_ms": round(
+                    self.total_latency_ms / self.validations, 2
+                )
+                if self.validations
+                else 0.0,
+                "max_latency_ms": round(self.max_latency_ms, 2),
+                "last_latency_ms": round(self.last_latency_ms, 2),
+                "ttl": self.ttl,
+            }
+
+
+validation_cache = TokenValidationCache()
+_validation_pool = ThreadPoolExecutor(
+    max_workers=GUAC_VALIDATION_WORKERS, thread_name_prefix="guac-validate"
+)
+
+
+class GuacTokenPool:
+    """Pre-authenticated Guacamole tokens kept ready per ``GUAC_USERS`` entry.
+
+    At class start every student hits auto-login within seconds; handing out
+    a token that was logged in ahead of time takes the Guacamole login off
+    the request path. Each pooled token goes to exactly one session; with
+    the pool empty or disabled (size 0, the default) sessions get the
+    shared cached token instead, and disconnects only release that. A
+    background thread tops the pool back up with a bounded number of
+    parallel logins and drops tokens older than ``max_age`` before
+    Guacamole would.
+    """
+
+    SWEEP_INTERVAL = 5.0
+    MAX_BACKOFF = 60.0
+
+    def __init__(
+        self,
+        user_types,
+        size: int = GUAC_TOKEN_POOL_SIZE,
+        max_size: int = GUAC_TOKEN_POOL_MAX,
+        max_age: float = GUAC_TOKEN_POOL_MAX_AGE,
+        concurrency: int = GUAC_TOKEN_POOL_CONCURRENCY,
+        warm_hold: float = GUAC_TOKEN_POOL_WARM_HOLD,
+    ):
+        self.base_size = min(size, max_size)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.concurrency = max(1, concurrency)
+        self.warm_hold = warm_hold
+        self._tokens: Dict[str, deque] = {ut: deque() for ut in user_types}
+        self._targets = {ut: self.base_size for ut in user_types}
+        self._filling = {ut: 0 for ut in user_types}
+        self._backoff = {ut: 1.0 for ut in user_types}
+        self._retry_at = {ut: 0.0 for ut in user_types}
+        self._stale: List[str] = []
+        self._warm_until = 0.0
+        self._lock = TracedLock("token_pool")
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._handout = metrics.operation("token_pool_handout")
+        self._refill_times: deque = deque(maxlen=4096)
+        self.handed_out = {ut: 0 for ut in user_types}
+        self.misses = {ut: 0 for ut in user_types}
+        self.refilled = {ut: 0 for ut in user_types}
+        self.refill_errors = {ut: 0 for ut in user_types}
+        self.expired = 0
+
+    def start(self):
+        """Start the refill thread once per process"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="token-pool"
+            )
+            self._thread = threading.Thread(
+                target=self._loop, name="token-pool", daemon=True
+            )
+            self._thread.start()
+        self._wake.set()
+        app_logger.info(
+            "Guacamole token pool started (size=%s per user type)", self.base_size
+        )
+
+    def acquire(self, user_type: str) -> Optional[Tuple[str, str]]:
+        """Hand out one pooled ``(token, data_source)``, or None when empty"""
+        self._handout.start()
+        start_time = time.perf_counter()
+        entry = None
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            tokens = self._tokens.get(user_type)
+            while tokens:
+                token, ds, created = tokens.popleft()
+                if created >= cutoff:
+                    entry = (token, ds)
+                    break
+                self._stale.append(token)
+            if user_type in self.handed_out:
+                if entry:
+                    self.handed_out[user_type] += 1
+                else:
+                    self.misses[user_type] += 1
+        self._wake.set()
+        self._handout.finish(time.perf_counter() - start_time)
+        return entry
+
+    def warm_up(self, headcount: int, user_types=None) -> Dict[str, int]:
+        """Size the pool for ``headcount`` students until the hold expires"""
+        target = min(self.max_size, max(0, headcount) + (headcount + 9) // 10)
+        with self._lock:
+            for ut in user_types or self._targets:
+                if ut in self._targets:
+                    self._targets[ut] = max(target, self.base_size)
+                    self._retry_at[ut] = 0.0
+            self._warm_until = time.monotonic() + self.warm_hold
+            targets = dict(self._targets)
+        self._wake.set()
+        app_logger.info(
+            "Token pool warm-up for %s students: targets=%s", headcount, targets
+        )
+        return targets
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.SWEEP_INTERVAL)
+            self._wake.clear()
+            try:
+                self._sweep()
+                self._schedule()
+            except Exception as e:
+                app_logger.error("Token pool refill error: %s", e)
+
+    def _sweep(self):
+        now = time.monotonic()
+        cutoff = now - self.max_age
+        with self._lock:
+            if self._warm_until and now >= self._warm_until:
+                self._warm_until = 0.0
+                self._targets = {ut: self.base_size for ut in self._targets}
+            for tokens in self._tokens.values():
+                while tokens and tokens[0][2] < cutoff:
+                    self._stale.append(tokens.popleft()[0])
+            stale, self._stale = self._stale, []
+            self.expired += len(stale)
+        # Free the Guacamole sessions behind tokens nobody will use
+        for token in stale:
+            self._executor.submit(invalidate_guac_token, token)
+
+    def _schedule(self):
+        now = time.monotonic()
+        batch = []
+        with self._lock:
+            room = self.concurrency - sum(self._filling.values())
+            for ut, tokens in self._tokens.items():
+                if room <= 0:
+                    break
+                if now < self._retry_at[ut]:
+                    continue
+                want = self._targets[ut] - len(tokens) - self._filling[ut]
+                n = max(0, min(want, room))
+                self._filling[ut] += n
+                room -= n
+                batch += [ut] * n
+        for ut in batch:
+            self._executor.submit(self._fill, ut)
+
+    def _fill(self, user_type: str):
+        try:
+            token, ds, status = _login_guac(user_type)
+        except Exception as e:
+            token, ds, status = str(e), "", 500
+        now = time.monotonic()
+        with self._lock:
+            self._filling[user_type] -= 1
+            if status == 200:
+                self._tokens[user_type].append((token, ds, now))
+                self.refilled[user_type] += 1
+                self._refill_times.append(now)
+                self._backoff[user_type] = 1.0
+            else:
+                self.refill_errors[user_type] += 1
+                self._retry_at[user_type] = now + self._backoff[user_type]
+                self._backoff[user_type] = min(
+                    self._backoff[user_type] * 2, self.MAX_BACKOFF
+                )
+        self._wake.set()
+
+    def depth(self) -> Dict[str, int]:
+        with self._lock:
+            return {ut: len(tokens) for ut, tokens in self._tokens.items()}
+
+    def refill_rate(self, window: float = 60.0) -> float:
+        """Tokens added per minute over the last ``window`` seconds"""
+        cutoff = time.monotonic() - window
+        with self._lock:
+            recent = sum(1 for t in self._refill_times if t >= cutoff)
+        return round(recent * 60.0 / window, 2)
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self._handout.snapshot()
+        p50 = self._handout.quantile(0.5, snap["counts"])
+        p99 = self._handout.quantile(0.99, snap["counts"])
+        rate = self.refill_rate()
+        with self._lock:
+            warm_left = max(0.0, self._warm_until - time.monotonic())
+            return {
+                "running": self._thread is not None,
+                "depth": {ut: len(tokens) for ut, tokens in self._tokens.items()},
+                "targets": dict(self._targets),
+                "filling": dict(self._filling),
+                "handed_out": dict(self.handed_out),
+                "misses": dict(self.misses),
+                "refilled": dict(self.refilled),
+                "refill_errors": dict(self.refill_errors),
+                "refills_per_min": rate,
+                "expired": self.expired,
+                "handout_p50_ms": round(p50 * 1000, 4) if p50 is not None else None,
+                "handout_p99_ms": round(p99 * 1000, 4) if p99 is not None else None,
+                "warm_remaining_s": round(warm_left, 1),
+                "max_age": self.max_age,
+            }
+
+
+token_pool = GuacTokenPool(GUAC_USERS)
+metrics.gauge(
+    "token_pool_depth", "Pre-authenticated tokens ready", token_pool.depth, label="user_type"
+)
+metrics.counter(
+    "token_pool_handouts_total",
+    "Auto-logins served from the token pool",
+    lambda: token_pool.handed_out,
+    label="user_type",
+)
+metrics.counter(
+    "token_pool_misses_total",
+    "Auto-logins that found the token pool empty",
+    lambda: token_pool.misses,
+    label="user_type",
+)
+metrics.counter(
+    "token_pool_refills_total",
+    "Tokens logged in by the pool refiller",
+    lambda: token_pool.refilled,
+    label="user_type",
+)
+metrics.counter(
+    "token_pool_refill_errors_total",
+    "Failed pool refill logins",
+    lambda: token_pool.refill_errors,
+    label="user_type",
+)
+
+
+# =========================
+# Guacamole Health Prober
+# =========================
+class GuacHealthProber:
+    """Background reachability tracker for Guacamole.
+
+    A daemon thread probes ``/api/languages`` every ``interval`` seconds so
+    ``/api/health`` can answer from memory instead of making load balancer
+    checks and frontend polls hit Guacamole. Keeps the last status and
+    latency plus a rolling success rate over the last ``window`` probes.
+    """
+
+    def __init__(
+        self,
+        interval: float = GUAC_HEALTH_INTERVAL,
+        timeout: float = GUAC_HEALTH_TIMEOUT,
+        window: int = GUAC_HEALTH_WINDOW,
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self._results = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._state: Dict[str, Any] = {
+            "status": "unknown",
+            "reachable": False,
+            "last_latency_ms": None,
+            "last_checked": None,
+            "last_error": None,
+        }
+
+    def start(self):
+        """Start the probe thread once per process"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        app_logger.info("Guacamole health prober started")
+
+    def _loop(self):
+        while True:
+            self.probe()
+            time.sleep(self.interval)
+
+    def probe(self) -> Dict[str, Any]:
+        """Run one probe now and return the updated snapshot"""
+        start_time = time.perf_counter()
+        error = None
+        try:
+            response = guac_client.get(
+                "/api/languages", timeout=self.timeout, retries=0
+            )
+            status = "healthy" if response.status_code == 200 else "unhealthy"
+            if status != "healthy":
+                error = f"HTTP {response.status_code}"
+        except Exception as e:
+            status = "unreachable"
+            error = str(e)
+        latency_ms = (time.perf_counter() - start_time) * 1000
+
+        with self._lock:
+            previous = self._state["status"]
+            self._results.append(status == "healthy")
+            self._state = {
+                "status": status,
+                "reachable": status != "unreachable",
+                "last_latency_ms": round(latency_ms, 2),
+                "last_checked": datetime.now().isoformat(),
+                "last_error": error,
+            }
+        if status != previous:
+            app_logger.info("Guacamole health changed: %s -> %s", previous, status)
+        return self.snapshot()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            results = list(self._results)
+            state = dict(self._state)
+        state["success_rate"] = (
+            round(sum(results) / len(results), 3) if results else None
+        )
+        state["probes"] = len(results)
+        state["interval"] = self.interval
+        return state
+
+
+guac_health = GuacHealthProber()
+
+
+# =========================
+# Enhanced Guacamole Functions
+# =========================
+@monitor_performance("get_guac_token")
+def get_guac_token(
+    user_type: str, force_new: bool = False, exclusive: bool = False
+) -> Tuple[str, str, int]:
+    """Get a Guacamole token for a shared account, reusing a cached one when valid.
+
+    With ``exclusive`` a pre-authenticated pooled token is handed out first;
+    the shared cached token is the fallback when the pool is empty or
+    disabled, so callers must not assume the token is theirs alone.
+    """
+    if user_type not in GUAC_USERS:
+        error_msg = f"Invalid user type: {user_type}"
+        app_logger.error(error_msg)
+        return error_msg, "", 400
+
+    if exclusive and not force_new:
+        pooled = token_pool.acquire(user_type)
+        if pooled:
+            return pooled[0], pooled[1], 200
+
+    app_logger.debug(
+        "Requesting Guacamole token for %s (force_new=%s)", user_type, force_new
+    )
+    return token_cache.get(
+        (user_type, GUAC_DATA_SOURCE),
+        lambda: _login_guac(user_type),
+        force=force_new,
+    )
+
+
+@admission_controlled(guac_auth_gate)
+def _login_guac(user_type: str) -> Tuple[str, str, int]:
+    """Authenticate against Guacamole with enhanced error handling and logging"""
+    user_config = GUAC_USERS[user_type]
+    app_logger.info("Logging in to Guacamole as %s", user_type)
+
+    try:
+        # Prepare authentication data
+        auth_data = {
+            "username": user_config["username"],
+            "password": user_config["password"],
+        }
+
+        app_logger.debug(
+            "Authenticating with Guacamole API at %s/api/tokens", GUAC_BASE
+        )
+
+        # Make authentication request
+        response = guac_client.post(
+            "/api/tokens",
+            data=auth_data,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+
+        app_logger.debug("Guacamole auth response status: %s", response.status_code)
+
+        if response.status_code != 200:
+            error_msg = f"Guacamole authentication failed for {user_type}: HTTP {response.status_code}"
+            app_logger.error(error_msg)
+            security_logger.warning(
+                "AUTH_FAILED: user_type=%s, status=%s", user_type, response.status_code
+            )
+            return error_msg, "", response.status_code
+
+        data = response.json()
+        token = data.get("authToken")
+        ds = data.get("dataSource", GUAC_DATA_SOURCE)
+
+        if not token:
+            error_msg = f"No authToken received for {user_type}"
+            app_logger.error(error_msg)
+            security_logger.warning("TOKEN_MISSING: user_type=%s", user_type)
+            return error_msg, "", 500
+
+        app_logger.info("Successfully obtained token for %s", user_type)
+        security_logger.info(
+            "TOKEN_OBTAINED: user_type=%s, datasource=%s", user_type, ds
+        )
+        return token, ds, 200
+
+    except requests.exceptions.Timeout:
+        error_msg = f"Timeout connecting to Guacamole for {user_type}"
+        app_logger.error(error_msg)
+        return error_msg, "", 408
+    except requests.exceptions.ConnectionError:
+        error_msg = f"Connection error to Guacamole for {user_type}"
+        app_logger.error(error_msg)
+        return error_msg, "", 503
+    except Exception as e:
+        error_msg = f"Unexpected error getting token for {user_type}: {str(e)}"
+        app_logger.error(error_msg)
+        return error_msg, "", 500
+
+
+def validate_guac_token(token: str) -> bool:
+    """Validate if a Guacamole token is still valid, reusing recent results"""
+    cached = validation_cache.get(token)
+    if cached is not None:
+        return cached
+
+    start_time = time.perf_counter()
+    try:
+        app_logger.debug("Validating Guacamole token")
+        headers = {"Accept": "application/json"}
+        response = guac_client.get(
+            f"/api/session/data/{GUAC_DATA_SOURCE}/connections",
+            headers=headers,
+            params={"token": token},
+        )
+        is_valid = response.status_code == 200
+        if is_valid or response.status_code in (401, 403, 404):
+            validation_cache.put(token, is_valid)
+        app_logger.debug("Token validation result: %s", is_valid)
+        return is_valid
+    except Exception as e:
+        app_logger.error("Token validation error: %s", e)
+        return bool(validation_cache.get(token, stale=True))
+    finally:
+        validation_cache.record((time.perf_counter() - start_time) * 1000)
+
+
+def validate_guac_tokens(tokens: Dict[str, Optional[str]]) -> Dict[str, bool]:
+    """Validate several tokens concurrently; missing tokens are invalid"""
+    pending = {t for t in tokens.values() if t}
+    if len(pending) <= 1:
+        results = {t: validate_guac_token(t) for t in pending}
+    else:
+        # One copied context per task keeps pool-thread spans on this request
+        contexts = [contextvars.copy_context() for _ in pending]
+        results = dict(
+            zip(
+                pending,
+                _validation_pool.map(
+                    lambda ctx, token: ctx.run(validate_guac_token, token),
+                    contexts,
+                    pending,
+                ),
+            )
+        )
+    return {key: results.get(token, False) for key, token in tokens.items()}
+
+
+def get_guac_connections(token: str, data_source: str) -> dict:
+    """Get Guacamole connections with enhanced logging"""
+    try:
+        app_logger.debug("Fetching connections for datasource: %s", data_source)
+        r = guac_client.get(
+            f"/api/session/data/{data_source}/connections",
+            headers={"Accept": "application/json"},
+            params={"token": token},
+        )
+
+        if r.status_code == 200:
+            connections = r.json()
+            app_logger.info("Retrieved %s connections from Guacamole", len(connections))
+            return connections
+        else:
+            error_msg = f"HTTP {r.status_code}: {r.text}"
+            app_logger.error("Failed to get connections: %s", error_msg)
+            return {"error": error_msg}
+
+    except Exception as e:
+        error_msg = f"Exception getting connections: {str(e)}"
+        app_logger.error(error_msg)
+        return {"error": error_msg}
+
+
+class _DirectoryEntry:
+    """Connection map of one data source, indexed by id and lower-cased name"""
+
+    __slots__ = ("by_id", "by_name", "expires_at")
+
+    def __init__(self, conns: dict, ttl: float):
+        self.by_id: Dict[str, dict] = dict(conns)
+        self.by_name: Dict[str, str] = {}
+        for cid, meta in conns.items():
+            # First connection wins on duplicate names, matching the old scan
+            self.by_name.setdefault(str(meta.get("name", "")).lower(), cid)
+        self.expires_at = time.monotonic() + ttl
+
+
+class ConnectionDirectory:
+    """In-process cache of Guacamole connections per data source.
+
+    The full connection map is downloaded at most once per TTL and indexed
+    so name and id lookups are O(1). Concurrent refreshes of the same data
+    source collapse into one download; if a refresh fails the previous map
+    keeps being served until it is invalidated.
+    """
+
+    def __init__(self, ttl: int = GUAC_CONNECTION_DIR_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, _DirectoryEntry] = {}
+        self._lock = TracedLock("connection_directory")
+        self._refresh_lock = TracedLock("connection_directory_refresh")
+        self._async_refresh_lock = None
+        self.hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def _fresh(self, data_source: str) -> Optional[_DirectoryEntry]:
+        entry = self._entries.get(data_source)
+        if entry and time.monotonic() < entry.expires_at:
+            return entry
+        return None
+
+    def _install(self, data_source: str, conns: dict) -> _DirectoryEntry:
+        """Index a freshly downloaded map, or fall back to the stale one on error"""
+        stale = self._entries.get(data_source)
+        if "error" in conns:
+            with self._lock:
+                self.refresh_errors += 1
+            if stale:
+                app_logger.warning(
+                    "Serving stale connection directory for %s: %s",
+                    data_source,
+                    conns["error"],
+                )
+                return stale
+            raise RuntimeError(conns["error"])
+
+        entry = _DirectoryEntry(conns, self.ttl)
+        with self._lock:
+            self._entries[data_source] = entry
+            self.refreshes += 1
+        app_logger.info(
+            "Connection directory for %s refreshed (%s connections)",
+            data_source,
+            len(entry.by_id),
+        )
+        return entry
+
+    def get(self, token: str, data_source: str) -> _DirectoryEntry:
+        entry = self._fresh(data_source)
+        if entry:
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        with self._refresh_lock:
+            # Another thread may have refreshed while we waited
+            entry = self._fresh(data_source)
+            if entry:
+                return entry
+            return self._install(data_source, get_guac_connections(token, data_source))
+
+    async def aget(self, token: str, data_source: str) -> _DirectoryEntry:
+        """Coroutine version of :meth:`get` using the async Guacamole client"""
+        entry = self._fresh(data_source)
+        if entry:
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        if self._async_refresh_lock is None:
+            self._async_refresh_lock = asyncio.Lock()
+        async with self._async_refresh_lock:
+            entry = self._fresh(data_source)
+            if entry:
+                return entry
+            conns = await get_guac_connections_async(token, data_source)
+            return self._install(data_source, conns)
+
+    def invalidate(self, data_source: Optional[str] = None) -> int:
+        """Drop one data source (or all of them); returns the number dropped"""
+        with self._lock:
+            if data_source is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                dropped = 1 if self._entries.pop(data_source, None) else 0
+        app_logger.info("Connection directory invalidated (%s data sources)", dropped)
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "data_sources": {
+                    ds: len(e.by_id) for ds, e in self._entries.items()
+                },
+                "hits": self.hits,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "ttl": self.ttl,
+            }
+
+
+connection_directory = ConnectionDirectory()
+
+
+def resolve_connection_id(user_type: str, token: str, data_source: str) -> str:
+    """Resolve connection ID with enhanced error handling"""
+    app_logger.debug("Resolving connection ID for %s", user_type)
+
+    # Use configured ID if present
+    cfg = _configured_connection_id(user_type)
+    if cfg:
+        return cfg
+
+    # Look up the cached connection directory
+    with trace_span("resolve_connection_id", user_type=user_type):
+        return _match_connection(
+            user_type, connection_directory.get(token, data_source)
+        )
+
+
+def _configured_connection_id(user_type: str) -> str:
+    cfg = str(GUAC_USERS[user_type].get("connection_id", "")).strip()
+    if cfg:
+        app_logger.info("Using configured connection ID %s for %s", cfg, user_type)
+    return cfg
+
+
+def _match_connection(user_type: str, directory: _DirectoryEntry) -> str:
+    """Pick the connection for ``user_type`` from the directory"""
+    if len(directory.by_id) == 1:
+        cid = next(iter(directory.by_id))
+        app_logger.info(
+            "Using single available connection ID %s for %s", cid, user_type
+        )
+        return cid
+
+    # Try to match by name if there are multiple
+    uname = GUAC_USERS[user_type]["username"].lower()
+    for name in (uname, user_type.lower()):
+        cid = directory.by_name.get(name)
+        if cid is not None:
+            app_logger.info("Matched connection ID %s by name for %s", cid, user_type)
+            return cid
+
+    names = [v.get("name") for v in directory.by_id.values()]
+    error_msg = (
+        f"Multiple connections visible for {user_type}. "
+        f"Set connection_id explicitly. Found: {names}"
+    )
+    app_logger.error(error_msg)
+    raise RuntimeError(error_msg)
+
+
+def _invalidation_result(status: int) -> str:
+    """disconnect-all result for a DELETE /api/tokens status"""
+    if status == 204:
+        return "disconnected"
+    if status in (401, 403, 404):
+        # Already expired or logged out: nothing left to tear down
+        return "token_already_invalid"
+    return f"error: HTTP {status}"
+
+
+def invalidate_guac_token(token: str) -> str:
+    """Explicitly invalidate a Guacamole token; returns a disconnect result"""
+    try:
+        app_logger.debug("Invalidating Guacamole token")
+        token_cache.discard_token(token)
+        validation_cache.discard(token)
+        response = guac_client.delete(f"/api/tokens/{token}")
+        if response.status_code == 204:
+            app_logger.info("Token successfully invalidated")
+        else:
+            app_logger.warning(
+                "Token invalidation returned status: %s", response.status_code
+            )
+        return _invalidation_result(response.status_code)
+    except Exception as e:
+        app_logger.error("Error invalidating token: %s", e)
+        return f"error: {e}"
+
+
+def invalidate_guac_tokens(tokens: Dict[str, Optional[str]]) -> Dict[str, str]:
+    """Invalidate several tokens concurrently, one DELETE each.
+
+    No validation round-trip first: deleting a dead token is just a 404.
+    Keys without a token come back as ``no_active_token``.
+    """
+    pending = {t for t in tokens.values() if t}
+    if len(pending) <= 1:
+        results = {t: invalidate_guac_token(t) for t in pending}
+    else:
+        contexts = [contextvars.copy_context() for _ in pending]
+        results = dict(
+            zip(
+                pending,
+                _validation_pool.map(
+                    lambda ctx, token: ctx.run(invalidate_guac_token, token),
+                    contexts,
+                    pending,
+                ),
+            )
+        )
+    return {
+        key: results[token] if token else "no_active_token"
+        for key, token in tokens.items()
+    }
+
+
+def shared_guac_tokens(tokens: Set[str]) -> Set[str]:
+    """Tokens still handed out by the cache or held by a live session.
+
+    Callers drop their own session's reference first. Without the token
+    pool every session of an account holds the same cached token, so
+    deleting one of these would log out everyone on that account.
+    """
+    shared = {t for t in tokens if token_cache.holds_token(t)}
+    if len(shared) < len(tokens):
+        shared |= session_manager.tokens_in_use(tokens - shared)
+    return shared
+
+
+def release_guac_token(token: str) -> str:
+    """Invalidate ``token`` unless it is still shared; returns a disconnect result.
+
+    A shared token is only released: the last holder, or the reaper once
+    the cache rotates it, invalidates it.
+    """
+    if shared_guac_tokens({token}):
+        app_logger.info("Token still shared; released without invalidation")
+        return "released"
+    return invalidate_guac_token(token)
+
+
+# =========================
+# Lab Allocation
+# =========================
+class LabPair:
+    """One scenario slot: a Guacamole connection per role, networked together"""
+
+    __slots__ = ("scenario", "slot", "connections", "session_id", "assigned_at", "retired")
+
+    def __init__(self, scenario: str, slot: str, connections: Dict[str, str]):
+        self.scenario = scenario
+        self.slot = slot
+        self.connections = connections
+        self.session_id: Optional[str] = None
+        self.assigned_at = 0.0
+        self.retired = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "scenario": self.scenario,
+            "slot": self.slot,
+            "connections": dict(self.connections),
+        }
+
+
+class LabUnavailable(Exception):
+    """Every pair of the scenario is taken; the session is queued for one"""
+
+    def __init__(self, scenario: str, position: int):
+        super().__init__(
+            f"All {scenario} lab machines are in use; you are number {position} in the queue"
+        )
+        self.scenario = scenario
+        self.position = position
+
+
+class LabAllocator:
+    """Hands each session its own victim/attacker pair from a pool.
+
+    Pairs are discovered from the connection directory by name
+    (``LAB_CONNECTION_PATTERN``); a slot is pooled once every role has a
+    connection. Free pairs sit in one deque per scenario and assignments
+    in a dict keyed by session, so allocate and release are O(1). When a
+    scenario is full the session takes a FIFO ticket; a released pair goes
+    straight to the first waiter and a ``lab_assigned`` event is emitted to
+    its room. Assignments are process-local, like the job engine.
+    """
+
+    def __init__(
+        self,
+        roles=tuple(GUAC_USERS),
+        pattern: str = LAB_CONNECTION_PATTERN,
+        default_scenario: str = LAB_DEFAULT_SCENARIO,
+        queue_limit: int = LAB_QUEUE_LIMIT,
+    ):
+        self.roles = tuple(roles)
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.default_scenario = default_scenario.lower()
+        self.queue_limit = queue_limit
+        self._lock = TracedLock("lab_allocator")
+        self._pairs: Dict[Tuple[str, str], LabPair] = {}
+        self._free: Dict[str, deque] = {}
+        self._by_session: Dict[str, LabPair] = {}
+        self._waiters: Dict[str, deque] = {}
+        self._waiting: Dict[str, Tuple[str, int, float]] = {}  # scenario, ticket, since
+        self._tickets: Dict[str, int] = {}
+        self._served: Dict[str, int] = {}
+        self._source = None
+        self.emit = None
+        self.allocations = 0
+        self.releases = 0
+        self.handoffs = 0
+        self.rejected = 0
+        self.peak_allocated = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # ---- Discovery ----
+
+    def sync(self, directory: "_DirectoryEntry"):
+        """Rebuild the pool from a connection directory; no-op if unchanged"""
+        if directory is self._source:
+            return
+        found: Dict[Tuple[str, str], Dict[str, str]] = {}
+        for cid, meta in directory.by_id.items():
+            match = self.pattern.match(str(meta.get("name", "")))
+            if match is None:
+                continue
+            role = match.group("role").lower()
+            if role in self.roles:
+                key = (match.group("scenario").lower(), str(int(match.group("slot"))))
+                found.setdefault(key, {})[role] = str(cid)
+        complete = {k: v for k, v in found.items() if len(v) == len(self.roles)}
+
+        handoffs = []
+        with self._lock:
+            self._source = directory
+            for key, pair in list(self._pairs.items()):
+                if key not in complete:
+                    # Gone from Guacamole; its free-list entry is skipped lazily
+                    pair.retired = True
+                    del self._pairs[key]
+                    if pair.session_id is not None:
+                        self._by_session.pop(pair.session_id, None)
+            for key, connections in complete.items():
+                pair = self._pairs.get(key)
+                if pair is not None:
+                    pair.connections = connections
+                    continue
+                pair = self._pairs[key] = LabPair(key[0], key[1], connections)
+                handoffs += self._put_back(pair)
+            pairs = len(self._pairs)
+        self._notify(handoffs)
+        app_logger.info("Lab pool synced: %s pairs in %s scenarios", pairs, len(self.scenarios()))
+
+    def scenarios(self) -> List[str]:
+        return sorted({pair.scenario for pair in list(self._pairs.values())})
+
+    # ---- Allocation ----
+
+    def allocate(self, session_id: str, scenario: Optional[str] = None) -> Optional[LabPair]:
+        """The session's pair, assigning a free one if needed.
+
+        Returns None when no lab pairs exist (use the shared connection).
+        Raises ValueError for an unknown scenario and LabUnavailable when
+        the session has to wait.
+        """
+        scenario = scenario.lower() if scenario else None
+        handoffs = []
+        with self._lock:
+            if not self._pairs:
+                return None
+            pair = self._by_session.get(session_id)
+            if pair is not None:
+                if scenario is None or pair.scenario == scenario:
+                    return pair
+                self._pick_scenario(scenario)  # validate before giving this one up
+                handoffs = self._unassign(pair)
+
+            waiting = self._waiting.get(session_id)
+            if waiting is not None and scenario in (None, waiting[0]):
+                scenario = waiting[0]
+                position = waiting[1] - self._served.get(scenario, 0)
+            else:
+                scenario = self._pick_scenario(scenario)
+                pair = self._pop_free(scenario)
+                if pair is not None:
+                    self._waiting.pop(session_id, None)
+                    self._assign(pair, session_id)
+                    position = 0
+                else:
+                    position = self._enqueue(session_id, scenario)
+        self._notify(handoffs)
+        if position:
+            raise LabUnavailable(scenario, position)
+        app_logger.info(
+            "Lab %s-%s assigned to session %s...", pair.scenario, pair.slot, session_id[:8]
+        )
+        return pair
+
+    def release(self, session_id: str) -> bool:
+        """Return the session's pair to the pool (or its next waiter)"""
+        with self._lock:
+            self._waiting.pop(session_id, None)
+            pair = self._by_session.get(session_id)
+            if pair is None:
+                return False
+            handoffs = self._unassign(pair)
+        self._notify(handoffs)
+        app_logger.info(
+            "Lab %s-%s released by session %s...", pair.scenario, pair.slot, session_id[:8]
+        )
+        return True
+
+    def get(self, session_id: str) -> Optional[LabPair]:
+        return self._by_session.get(session_id)
+
+    def sessions(self, scenario: str) -> List[str]:
+        """Sessions holding, or queued for, a pair of ``scenario``"""
+        with self._lock:
+            held = [
+                sid for sid, pair in self._by_session.items() if pair.scenario == scenario
+            ]
+            return held + [
+                sid for sid, (name, _, _) in self._waiting.items() if name == scenario
+            ]
+
+    def queue_position(self, session_id: str) -> int:
+        with self._lock:
+            waiting = self._waiting.get(session_id)
+            if waiting is None:
+                return 0
+            return waiting[1] - self._served.get(waiting[0], 0)
+
+    def _pick_scenario(self, scenario: Optional[str]) -> str:
+        names = {pair.scenario for pair in self._pairs.values()}
+        if scenario is None and self.default_scenario in names:
+            scenario = self.default_scenario
+        if scenario is None:
+            # The scenario with the most free pairs keeps waits short
+            return max(sorted(names), key=lambda name: len(self._free.get(name, ())))
+        if scenario not in names:
+            raise ValueError(f"Unknown lab scenario: {scenario}")
+        return scenario
+
+    def _pop_free(self, scenario: str) -> Optional[LabPair]:
+        free = self._free.get(scenario)
+        while free:
+            pair = free.popleft()
+            if not pair.retired and pair.session_id is None:
+                return pair
+        return None
+
+    def _enqueue(self, session_id: str, scenario: str) -> int:
+        waiters = self._waiters.setdefault(scenario, deque())
+        served = self._served.get(scenario, 0)
+        if self._tickets.get(scenario, 0) - served >= self.queue_limit:
+            self.rejected += 1
+            raise LabUnavailable(scenario, self.queue_limit + 1)
+        ticket = self._tickets[scenario] = self._tickets.get(scenario, 0) + 1
+        waiters.append(session_id)
+        self._waiting[session_id] = (scenario, ticket, time.monotonic())
+        return ticket - served
+
+    def _assign(self, pair: LabPair, session_id: str):
+        pair.session_id = session_id
+        pair.assigned_at = time.monotonic()
+        self._by_session[session_id] = pair
+        self.allocations += 1
+        self.peak_allocated = max(self.peak_allocated, len(self._by_session))
+
+    def _unassign(self, pair: LabPair) -> List[Tuple[str, LabPair]]:
+        self._by_session.pop(pair.session_id, None)
+        pair.session_id = None
+        self.releases += 1
+        return self._put_back(pair)
+
+    def _put_back(self, pair: LabPair) -> List[Tuple[str, LabPair]]:
+        """Hand a free pair to the first live waiter, else onto the free list"""
+        waiters = self._waiters.get(pair.scenario)
+        while waiters:
+            session_id = waiters.popleft()
+            self._served[pair.scenario] = self._served.get(pair.scenario, 0) + 1
+            waiting = self._waiting.get(session_id)
+            if waiting is None or waiting[0] != pair.scenario:
+                continue  # Left the queue or moved to another scenario
+            del self._waiting[session_id]
+            waited = time.monotonic() - waiting[2]
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.handoffs += 1
+            self._assign(pair, session_id)
+            return [(session_id, pair)]
+        self._free.setdefault(pair.scenario, deque()).append(pair)
+        return []
+
+    def _notify(self, handoffs: List[Tuple[str, LabPair]]):
+        for session_id, pair in handoffs:
+            app_logger.info(
+                "Lab %s-%s handed to waiting session %s...",
+                pair.scenario,
+                pair.slot,
+                session_id[:8],
+            )
+            if self.emit is not None:
+                try:
+                    self.emit("lab_assigned", pair.to_dict(), session_id)
+                except Exception as e:
+                    app_logger.error("lab_assigned emit failed: %s", e)
+
+    # ---- Stats ----
+
+    def counts(self, field: str) -> Dict[str, int]:
+        """Per-scenario ``pairs``, ``allocated`` or ``waiting`` counts"""
+        out: Dict[str, int] = {}
+        with self._lock:
+            if field == "waiting":
+                for scenario, _, _ in self._waiting.values():
+                    out[scenario] = out.get(scenario, 0) + 1
+                return out
+            for pair in self._pairs.values():
+                out.setdefault(pair.scenario, 0)
+                if field == "pairs" or pair.session_id is not None:
+                    out[pair.scenario] += 1
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        pairs, allocated = self.counts("pairs"), self.counts("allocated")
+        waiting = self.counts("waiting")
+        scenarios = {
+            name: {
+                "pairs": total,
+                "allocated": allocated.get(name, 0),
+                "free": total - allocated.get(name, 0),
+                "waiting": waiting.get(name, 0),
+                "utilization": round(allocated.get(name, 0) / total, 3),
+            }
+            for name, total in pairs.items()
+        }
+        with self._lock:
+            return {
+                "enabled": LAB_ALLOCATION,
+                "scenarios": scenarios,
+                "allocated": len(self._by_session),
+                "waiting": len(self._waiting),
+                "allocations": self.allocations,
+                "releases": self.releases,
+                "handoffs": self.handoffs,
+                "queue_rejected": self.rejected,
+                "peak_allocated": self.peak_allocated,
+                "avg_wait_s": round(self.total_wait / self.handoffs, 2)
+                if self.handoffs
+                else 0.0,
+                "max_wait_s": round(self.max_wait, 2),
+            }
+
+    def assignments(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                dict(
+                    pair.to_dict(),
+                    session_id=pair.session_id,
+                    held_s=round(now - pair.assigned_at, 1),
+                )
+                for pair in self._by_session.values()
+            ]
+
+
+lab_allocator = LabAllocator()
+session_manager.add_expiry_listener(lab_allocator.release)
+metrics.gauge("lab_pairs", "Lab pairs discovered", lambda: lab_allocator.counts("pairs"), label="scenario")
+metrics.gauge(
+    "lab_pairs_allocated",
+    "Lab pairs assigned to a session",
+    lambda: lab_allocator.counts("allocated"),
+    label="scenario",
+)
+metrics.gauge(
+    "lab_waiting",
+    "Sessions queued for a lab pair",
+    lambda: lab_allocator.counts("waiting"),
+    label="scenario",
+)
+metrics.counter(
+    "lab_allocations_total", "Lab pairs assigned", lambda: lab_allocator.allocations
+)
+
+
+def resolve_session_connection(
+    session_id: str, user_type: str, token: str, data_source: str
+) -> str:
+    """The session's own lab connection for ``user_type``, else the shared one"""
+    if LAB_ALLOCATION and session_id:
+        with trace_span("lab_allocate", user_type=user_type):
+            try:
+                lab_allocator.sync(connection_directory.get(token, data_source))
+            except Exception as e:
+                # Keep allocating from the last known pool
+                app_logger.warning("Lab pool sync skipped: %s", e)
+            pair = lab_allocator.allocate(session_id)
+        if pair is not None:
+            return pair.connections[user_type]
+    return resolve_connection_id(user_type, token, data_source)
+
+
+async def resolve_session_connection_async(
+    session_id: str, user_type: str, token: str, data_source: str
+) -> str:
+    """Coroutine version of resolve_session_connection"""
+    if LAB_ALLOCATION and session_id:
+        with trace_span("lab_allocate", user_type=user_type):
+            try:
+                lab_allocator.sync(await connection_directory.aget(token, data_source))
+            except Exception as e:
+                app_logger.warning("Lab pool sync skipped: %s", e)
+            pair = lab_allocator.allocate(session_id)
+        if pair is not None:
+            return pair.connections[user_type]
+    return await resolve_connection_id_async(user_type, token, data_source)
+
+
+def sync_lab_pool(force: bool = False):
+    """Load lab pairs using a shared-account token; ``force`` re-downloads"""
+    token, ds, status = get_guac_token(next(iter(GUAC_USERS)))
+    if status != 200:
+        raise RuntimeError(token)
+    if force:
+        connection_directory.invalidate(ds)
+    lab_allocator.sync(connection_directory.get(token, ds))
+
+
+def release_lab_if_idle(session_id: str):
+    """Give the session's lab pair back once none of its roles is connected"""
+    record = session_manager.get_record(session_id)
+    if record is None or not record.connections:
+        lab_allocator.release(session_id)
+
+
+# =========================
+# Session Teardown
+# =========================
+def _detach_session_tokens(
+    session_id: str,
+) -> Tuple[Dict[str, Optional[str]], Dict[str, str]]:
+    """Clear a session's tokens, connections and lab.
+
+    Returns the tokens still to invalidate per user type, and ``released``
+    results for the ones another holder still shares (see
+    release_guac_token).
+    """
+    tokens = {
+        user_type: session_manager.get_user_token(session_id, user_type)
+        for user_type in GUAC_USERS
+    }
+    for user_type in GUAC_USERS:
+        session_manager.remove_user_token(session_id, user_type)
+        session_manager.remove_active_connection(session_id, user_type)
+    lab_allocator.release(session_id)
+
+    shared = shared_guac_tokens({t for t in tokens.values() if t})
+    released = {
+        user_type: "released" for user_type, token in tokens.items() if token in shared
+    }
+    if released:
+        app_logger.info(
+            "Session %s... released %s shared token(s) without invalidation",
+            session_id[:8],
+            len(released),
+        )
+    todo = {
+        user_type: None if user_type in released else token
+        for user_type, token in tokens.items()
+    }
+    return todo, released
+
+
+def disconnect_session(session_id: str, concurrent: bool = True) -> Dict[str, str]:
+    """Invalidate every token of a session and clear its connections and lab.
+
+    One DELETE per token nobody else holds; ``concurrent`` issues them in
+    parallel. Session data is cleaned up whatever Guacamole answers.
+    """
+    tokens, released = _detach_session_tokens(session_id)
+    if concurrent:
+        results = invalidate_guac_tokens(tokens)
+    else:
+        results = {
+            user_type: invalidate_guac_token(token) if token else "no_active_token"
+            for user_type, token in tokens.items()
+        }
+    results.update(released)
+    return results
+
+
+def _disconnect_failed(results: Dict[str, str]) -> bool:
+    return any(r.startswith("error") for r in results.values())
+
+
+def teardown_sessions(
+    session_ids: List[str],
+    concurrency: int = GUAC_TEARDOWN_CONCURRENCY,
+    notify=None,
+):
+    """Disconnect many sessions, at most ``concurrency`` at a time.
+
+    A generator of progress events: ``started``, one ``session`` per
+    finished session (in completion order) and a closing ``finished``
+    summary. ``notify(session_id, results)`` runs after each session. If
+    the consumer stops early the remaining sessions are still torn down.
+    """
+    total = len(session_ids)
+    concurrency = max(1, min(concurrency, GUAC_TEARDOWN_MAX_CONCURRENCY, total or 1))
+    op = metrics.operation("teardown_sessions")
+    op.start()
+    start_time = time.perf_counter()
+    done = errors = 0
+
+    def work(session_id):
+        results = disconnect_session(session_id, concurrent=False)
+        if notify is not None:
+            notify(session_id, results)
+        return results
+
+    try:
+        yield {"event": "started", "total": total, "concurrency": concurrency}
+        with ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="guac-teardown"
+        ) as pool:
+            futures = {pool.submit(work, sid): sid for sid in session_ids}
+            for future in as_completed(futures):
+                session_id = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    app_logger.error(
+                        "Teardown of session %s... failed: %s", session_id[:8], e
+                    )
+                    results = {"session": f"error: {e}"}
+                done += 1
+                errors += _disconnect_failed(results)
+                yield {
+                    "event": "session",
+                    "session_id": session_id,
+                    "results": results,
+                    "done": done,
+                    "total": total,
+                }
+    finally:
+        duration = time.perf_counter() - start_time
+        op.finish(duration, failed=bool(errors))
+        perf_logger.info(
+            "PERF: teardown_sessions completed %s/%s in %.2fms",
+            done,
+            total,
+            duration * 1000,
+        )
+
+    yield {
+        "event": "finished",
+        "total": total,
+        "successful": done - errors,
+        "errors": errors,
+        "elapsed_ms": round(duration * 1000, 1),
+    }
+
+
+class GuacTokenReaper:
+    """Invalidates Guacamole tokens that sessions dropped without a logout.
+
+    Expired sessions (and tokens replaced by a fresh login) otherwise stay
+    logged in on the Guacamole side until its own timeout. The session
+    manager hands dropped tokens to ``submit``, which only queues them; a
+    background thread deletes them in batches with at most ``concurrency``
+    requests in flight, paced to ``rate`` tokens a second, so no network
+    I/O happens under a session store lock. Failed deletes are retried
+    with jittered exponential backoff, up to ``max_attempts``. A token
+    still shared through the token cache or held by another live session
+    is skipped; the last session to drop it queues it again.
+    """
+
+    MAX_BACKOFF = 300.0
+
+    def __init__(
+        self,
+        rate: float = GUAC_REAPER_RATE,
+        batch: int = GUAC_REAPER_BATCH,
+        concurrency: int = GUAC_REAPER_CONCURRENCY,
+        max_attempts: int = GUAC_REAPER_MAX_ATTEMPTS,
+        backoff: float = GUAC_REAPER_BACKOFF,
+        queue_limit: int = GUAC_REAPER_QUEUE,
+    ):
+        self.rate = max(rate, 0.1)
+        self.batch = max(1, batch)
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.queue_limit = queue_limit
+        self._ready: deque = deque()  # (token, attempt)
+        self._retry: List[Tuple[float, str, int]] = []  # heap of (due, token, attempt)
+        self._queued: Set[str] = set()
+        self._in_flight = 0
+        self._lock = TracedLock("token_reaper")
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.submitted = 0
+        self.reaped = 0
+        self.failed = 0
+        self.retried = 0
+        self.skipped = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the reaper thread once per process"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="token-reaper"
+            )
+            self._thread = threading.Thread(
+                target=self._loop, name="token-reaper", daemon=True
+            )
+            self._thread.start()
+        self._wake.set()
+        app_logger.info("Guacamole token reaper started (%s tokens/s)", self.rate)
+
+    def submit(self, tokens: List[str]):
+        """Queue tokens for invalidation; never blocks on Guacamole"""
+        added = 0
+        with self._lock:
+            for token in tokens:
+                if not token or token in self._queued:
+                    continue
+                if len(self._queued) >= self.queue_limit:
+                    self.dropped += 1
+                    continue
+                self._queued.add(token)
+                self._ready.append((token, 0))
+                added += 1
+            self.submitted += added
+        if added:
+            self._wake.set()
+
+    def pending(self) -> int:
+        """Tokens queued, waiting to retry or being deleted right now"""
+        return len(self._queued)
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self._idle_wait())
+            self._wake.clear()
+            try:
+                self._drain()
+            except Exception as e:
+                app_logger.error("Token reaper error: %s", e)
+
+    def _idle_wait(self) -> float:
+        with self._lock:
+            if self._ready:
+                return 0.0
+            if self._retry:
+                return max(self._retry[0][0] - time.monotonic(), 0.0)
+            return self.MAX_BACKOFF
+
+    def _take_batch(self) -> List[Tuple[str, int]]:
+        now = time.monotonic()
+        with self._lock:
+            while self._retry and self._retry[0][0] <= now:
+                _, token, attempt = heapq.heappop(self._retry)
+                self._ready.append((token, attempt))
+            batch = []
+            while self._ready and len(batch) < self.batch:
+                batch.append(self._ready.popleft())
+            return batch
+
+    def _drain(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            started = time.monotonic()
+            self._reap(batch)
+            # A batch of n tokens takes at least n / rate seconds
+            delay = len(batch) / self.rate - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    def _reap(self, batch: List[Tuple[str, int]]):
+        tokens = {token for token, _ in batch}
+        in_use = shared_guac_tokens(tokens)
+        todo = [(token, attempt) for token, attempt in batch if token not in in_use]
+
+        # One copied context per task keeps invalidation spans tied to this batch
+        contexts = [contextvars.copy_context() for _ in todo]
+        results = list(
+            self._executor.map(
+                lambda ctx, item: ctx.run(invalidate_guac_token, item[0]), contexts, todo
+            )
+        )
+
+        now = time.monotonic()
+        with self._lock:
+            self.skipped += len(in_use)
+            self._queued.difference_update(in_use)
+            for (token, attempt), result in zip(todo, results):
+                if not result.startswith("error"):
+                    self.reaped += 1
+                    self._queued.discard(token)
+                elif attempt + 1 >= self.max_attempts:
+                    self.failed += 1
+                    self._queued.discard(token)
+                    app_logger.warning(
+                        "Giving up on token invalidation after %s attempts: %s",
+                        attempt + 1,
+                        result,
+                    )
+                else:
+                    self.retried += 1
+                    delay = min(self.MAX_BACKOFF, self.backoff * 2**attempt)
+                    heapq.heappush(
+                        self._retry,
+                        (now + random.uniform(delay / 2, delay), token, attempt + 1),
+                    )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._queued),
+                "ready": len(self._ready),
+                "retrying": len(self._retry),
+                "submitted": self.submitted,
+                "reaped": self.reaped,
+                "failed": self.failed,
+                "retried": self.retried,
+                "skipped_in_use": self.skipped,
+                "dropped": self.dropped,
+                "rate": self.rate,
+            }
+
+
+token_reaper = GuacTokenReaper()
+session_manager.add_token_listener(token_reaper.submit)
+metrics.gauge(
+    "guac_reaper_pending", "Dropped Guacamole tokens not yet invalidated", token_reaper.pending
+)
+metrics.counter(
+    "guac_reaper_reaped_total",
+    "Dropped Guacamole tokens invalidated by the reaper",
+    lambda: token_reaper.reaped,
+)
+metrics.counter(
+    "guac_reaper_failed_total",
+    "Dropped Guacamole tokens the reaper gave up on",
+    lambda: token_reaper.failed,
+)
+
+
+# =========================
+# Async Guacamole Functions
+# =========================
+@monitor_performance("get_guac_token")
+async def get_guac_token_async(
+    user_type: str, force_new: bool = False, exclusive: bool = False
+) -> Tuple[str, str, int]:
+    """Coroutine version of get_guac_token sharing the same token cache and pool"""
+    if user_type not in GUAC_USERS:
+        error_msg = f"Invalid user type: {user_type}"
+        app_logger.error(error_msg)
+        return error_msg, "", 400
+
+    if exclusive and not force_new:
+        pooled = token_pool.acquire(user_type)  # never blocks on I/O
+        if pooled:
+            return pooled[0], pooled[1], 200
+
+    return await token_cache.aget(
+        (user_type, GUAC_DATA_SOURCE),
+        lambda: _login_guac_async(user_type),
+        force=force_new,
+    )
+
+
+@admission_controlled(guac_auth_gate)
+async def _login_guac_async(user_type: str) -> Tuple[str, str, int]:
+    """Authenticate against Guacamole without blocking the event loop"""
+    user_config = GUAC_USERS[user_type]
+    app_logger.info("Logging in to Guacamole as %s (async)", user_type)
+
+    try:
+        status, data = await async_guac_client.request(
+            "POST",
+            "/api/tokens",
+            data={
+                "username": user_config["username"],
+                "password": user_config["password"],
+            },
+        )
+
+        if status != 200:
+            error_msg = f"Guacamole authentication failed for {user_type}: HTTP {status}"
+            app_logger.error(error_msg)
+            security_logger.warning(
+                "AUTH_FAILED: user_type=%s, status=%s", user_type, status
+            )
+            return error_msg, "", status
+
+        token = data.get("authToken") if isinstance(data, dict) else None
+        ds = data.get("dataSource", GUAC_DATA_SOURCE) if token else ""
+
+        if not token:
+            error_msg = f"No authToken received for {user_type}"
+            app_logger.error(error_msg)
+            security_logger.warning("TOKEN_MISSING: user_type=%s", user_type)
+            return error_msg, "", 500
+
+        app_logger.info("Successfully obtained token for %s", user_type)
+        security_logger.info(
+            "TOKEN_OBTAINED: user_type=%s, datasource=%s", user_type, ds
+        )
+        return token, ds, 200
+
+    except asyncio.TimeoutError:
+        error_msg = f"Timeout connecting to Guacamole for {user_type}"
+        app_logger.error(error_msg)
+        return error_msg, "", 408
+    except (*_AIOHTTP_CONN_ERRORS, GuacCircuitOpen):
+        error_msg = f"Connection error to Guacamole for {user_type}"
+        app_logger.error(error_msg)
+        return error_msg, "", 503
+    except Exception as e:
+        error_msg = f"Unexpected error getting token for {user_type}: {str(e)}"
+        app_logger.error(error_msg)
+        return error_msg, "", 500
+
+
+async def validate_guac_token_async(token: str) -> bool:
+    """Coroutine version of validate_guac_token"""
+    cached = validation_cache.get(token)
+    if cached is not None:
+        return cached
+
+    start_time = time.perf_counter()
+    try:
+        status, _ = await async_guac_client.request(
+            "GET",
+            f"/api/session/data/{GUAC_DATA_SOURCE}/connections",
+            headers={"Accept": "application/json"},
+            params={"token": token},
+        )
+        is_valid = status == 200
+        if is_valid or status in (401, 403, 404):
+            validation_cache.put(token, is_valid)
+        return is_valid
+    except Exception as e:
+        app_logger.error("Token validation error: %s", e)
+        return bool(validation_cache.get(token, stale=True))
+    finally:
+        validation_cache.record((time.perf_counter() - start_time) * 1000)
+
+
+async def validate_guac_tokens_async(
+    tokens: Dict[str, Optional[str]]
+) -> Dict[str, bool]:
+    """Coroutine version of validate_guac_tokens"""
+    pending = list({t for t in tokens.values() if t})
+    valid = await asyncio.gather(*(validate_guac_token_async(t) for t in pending))
+    results = dict(zip(pending, valid))
+    return {key: results.get(token, False) for key, token in tokens.items()}
+
+
+async def get_guac_connections_async(token: str, data_source: str) -> dict:
+    """Coroutine version of get_guac_connections"""
+    try:
+        status, body = await async_guac_client.request(
+            "GET",
+            f"/api/session/data/{data_source}/connections",
+            headers={"Accept": "application/json"},
+            params={"token": token},
+        )
+        if status == 200:
+            app_logger.info("Retrieved %s connections from Guacamole", len(body))
+            return body
+        error_msg = f"HTTP {status}: {body}"
+        app_logger.error("Failed to get connections: %s", error_msg)
+        return {"error": error_msg}
+    except Exception as e:
+        error_msg = f"Exception getting connections: {str(e)}"
+        app_logger.error(error_msg)
+        return {"error": error_msg}
+
+
+async def resolve_connection_id_async(
+    user_type: str, token: str, data_source: str
+) -> str:
+    """Coroutine version of resolve_connection_id"""
+    cfg = _configured_connection_id(user_type)
+    if cfg:
+        return cfg
+    with trace_span("resolve_connection_id", user_type=user_type):
+        directory = await connection_directory.aget(token, data_source)
+        return _match_connection(user_type, directory)
+
+
+async def invalidate_guac_token_async(token: str) -> str:
+    """Coroutine version of invalidate_guac_token"""
+    try:
+        token_cache.discard_token(token)
+        validation_cache.discard(token)
+        status, _ = await async_guac_client.request("DELETE", f"/api/tokens/{token}")
+        if status == 204:
+            app_logger.info("Token successfully invalidated")
+        else:
+            app_logger.warning("Token invalidation returned status: %s", status)
+        return _invalidation_result(status)
+    except Exception as e:
+        app_logger.error("Error invalidating token: %s", e)
+        return f"error: {e}"
+
+
+async def invalidate_guac_tokens_async(
+    tokens: Dict[str, Optional[str]]
+) -> Dict[str, str]:
+    """Coroutine version of invalidate_guac_tokens"""
+    pending = list({t for t in tokens.values() if t})
+    outcomes = await asyncio.gather(*(invalidate_guac_token_async(t) for t in pending))
+    results = dict(zip(pending, outcomes))
+    return {
+        key: results[token] if token else "no_active_token"
+        for key, token in tokens.items()
+    }
+
+
+async def release_guac_token_async(token: str) -> str:
+    """Coroutine version of release_guac_token"""
+    if shared_guac_tokens({token}):
+        app_logger.info("Token still shared; released without invalidation")
+        return "released"
+    return await invalidate_guac_token_async(token)
+
+
+async def disconnect_session_async(session_id: str) -> Dict[str, str]:
+    """Coroutine version of disconnect_session"""
+    tokens, released = _detach_session_tokens(session_id)
+    results = await invalidate_guac_tokens_async(tokens)
+    results.update(released)
+    return results
+
+
+def tokenized_connection_url(
+    connection_id: str, token: str, data_source: str = "mysql"
+) -> str:
+    """Generate tokenized connection URL"""
+    cid = str(connection_id).strip()
+    ds = str(data_source).strip()
+    qs = urlencode({"token": str(token), "embed": "true", "resize": "scale"})
+    url = f"{GUAC_BASE.rstrip('/')}/#/client/{ds}/{cid}?{qs}"
+    app_logger.debug("Generated connection URL for connection %s", cid)
+    return url
+
+
+# =========================
+# Socket.IO Message Queue
+# =========================
+class BatchingPubSubMixin:
+    """Coalesce bursts of Socket.IO publishes into single broker messages.
+
+    Mix in ahead of a ``socketio.PubSubManager`` subclass. Publishes are
+    buffered and sent as one ``batch`` message when ``batch_size`` is reached
+    or ``batch_interval`` seconds after the first buffered message; the
+    listening side unpacks batches before python-socketio sees them, so
+    every worker still handles individual emits.
+    """
+
+    batch_size = SOCKETIO_MQ_BATCH_SIZE
+    batch_interval = SOCKETIO_MQ_BATCH_INTERVAL
+
+    def _publish(self, data):
+        if not hasattr(self, "_batch"):
+            self._batch: List[Any] = []
+            self._batch_lock = threading.Lock()
+            self._batch_ready = threading.Event()
+            self.published = 0
+            self.batches = 0
+            threading.Thread(target=self._batch_loop, daemon=True).start()
+        with self._batch_lock:
+            self._batch.append(data)
+            self.published += 1
+            full = len(self._batch) >= self.batch_size
+        if full:
+            self._flush_batch()
+        else:
+            self._batch_ready.set()
+
+    def _batch_loop(self):
+        while True:
+            self._batch_ready.wait()
+            time.sleep(self.batch_interval)
+            self._batch_ready.clear()
+            self._flush_batch()
+
+    def _flush_batch(self):
+        with self._batch_lock:
+            messages, self._batch = self._batch, []
+            if messages:
+                self.batches += 1
+        if not messages:
+            return
+        if len(messages) == 1:
+            super()._publish(messages[0])
+        else:
+            super()._publish({"method": "batch", "messages": messages})
+
+    def _listen(self):
+        for message in super()._listen():
+            data = message
+            if not isinstance(message, dict):
+                try:
+                    data = self.json.loads(message)
+                except Exception:
+                    continue
+            if data.get("method") == "batch":
+                yield from data["messages"]
+            else:
+                yield data
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "channel": self.channel,
+            "published": getattr(self, "published", 0),
+            "batches": getattr(self, "batches", 0),
+        }
+
+
+class LocalBroker:
+    """In-process pub/sub hub standing in for Redis.
+
+    Lets several Socket.IO servers in one process (tests, local load runs)
+    share rooms exactly as separate workers would through a real broker.
+    """
+
+    _brokers: Dict[str, "LocalBroker"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[queue.Queue]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name: str) -> "LocalBroker":
+        with cls._registry_lock:
+            if name not in cls._brokers:
+                cls._brokers[name] = cls()
+            return cls._brokers[name]
+
+    def subscribe(self, channel: str) -> queue.Queue:
+        q: queue.Queue = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(q)
+        return q
+
+    def publish(self, channel: str, message: str):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, []))
+        for q in subscribers:
+            q.put(message)
+
+
+class _LocalPubSubManager(socketio_lib.PubSubManager):
+    name = "local"
+
+    def __init__(self, url: str = "local://default", channel: str = "socketio",
+                 write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.broker = LocalBroker.get(url.split("://", 1)[-1] or "default")
+        self._queue = None if write_only else self.broker.subscribe(channel)
+
+    def _publish(self, data):
+        self.broker.publish(self.channel, self.json.dumps(data))
+
+    def _listen(self):
+        while True:
+            yield self._queue.get()
+
+
+class LocalBrokerManager(BatchingPubSubMixin, _LocalPubSubManager):
+    """Batched Socket.IO client manager on the in-process LocalBroker"""
+
+
+class BatchingRedisManager(BatchingPubSubMixin, socketio_lib.RedisManager):
+    """Batched Socket.IO client manager on Redis pub/sub"""
+
+
+def create_socketio_client_manager(
+    url: str = SOCKETIO_MESSAGE_QUEUE, write_only: bool = False
+):
+    """Build the Socket.IO client manager for ``SOCKETIO_MESSAGE_QUEUE``.
+
+    Returns None when no queue is configured, which keeps python-socketio's
+    default process-local manager.
+    """
+    if not url:
+        return None
+    scheme = url.split("://", 1)[0]
+    if scheme == "local":
+        manager = LocalBrokerManager(url, channel=SOCKETIO_CHANNEL, write_only=write_only)
+    elif scheme in ("redis", "rediss"):
+        manager = BatchingRedisManager(url, channel=SOCKETIO_CHANNEL, write_only=write_only)
+    else:
+        raise ValueError(f"Unsupported SOCKETIO_MESSAGE_QUEUE scheme: {scheme}")
+    app_logger.info("Socket.IO fan-out through %s message queue", scheme)
+    return manager
+
+
+# =========================
+# Scenario Job Engine
+# =========================
+_SCENARIO_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+_SCRIPT_INTERPRETERS = {".sh": ["bash"], ".py": [sys.executable]}
+_JOB_FINAL_STATES = ("succeeded", "failed", "timed_out", "cancelled")
+
+
+def resolve_scenario_script(scenario: str, script: str) -> List[str]:
+    """Map ``scenario``/``script`` to the command that runs it under SCRIPTS_ROOT.
+
+    Raises ValueError for names that escape SCRIPTS_ROOT and
+    FileNotFoundError for scripts that don't exist.
+    """
+    if not _SCENARIO_NAME_RE.match(scenario or ""):
+        raise ValueError(f"Invalid scenario name: {scenario!r}")
+    root = os.path.realpath(SCRIPTS_ROOT)
+    path = os.path.realpath(os.path.join(root, scenario, script or ""))
+    if os.path.commonpath([root, path]) != root or path == root:
+        raise ValueError(f"Script must live under SCRIPTS_ROOT: {script!r}")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Script not found: {scenario}/{script}")
+
+    interpreter = _SCRIPT_INTERPRETERS.get(os.path.splitext(path)[1].lower())
+    if interpreter:
+        return [*interpreter, path]
+    if not os.access(path, os.X_OK):
+        raise ValueError(f"Script is not executable: {scenario}/{script}")
+    return [path]
+
+
+class Job:
+    """One scenario script run and the tail of its output"""
+
+    __slots__ = (
+        "id", "session_id", "scenario", "script", "args", "command", "timeout",
+        "status", "exit_code", "error", "created_at", "started_at", "finished_at",
+        "output", "lines", "task", "cancel_requested",
+    )
+
+    def __init__(
+        self,
+        session_id: str,
+        scenario: str,
+        script: str,
+        command: List[str],
+        args: List[str],
+        timeout: float,
+    ):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.scenario = scenario
+        self.script = script
+        self.command = command
+        self.args = args
+        self.timeout = timeout
+        self.status = "queued"
+        self.exit_code: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.output: deque = deque(maxlen=JOB_OUTPUT_LINES)
+        self.lines = 0
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_requested = False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in _JOB_FINAL_STATES
+
+    def to_dict(self, include_output: bool = False) -> Dict[str, Any]:
+        def iso(ts):
+            return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+        data = {
+            "job_id": self.id,
+            "scenario": self.scenario,
+            "script": self.script,
+            "args": self.args,
+            "status": self.status,
+            "exit_code": self.exit_code,
+            "error": self.error,
+            "timeout": self.timeout,
+            "created_at": iso(self.created_at),
+            "started_at": iso(self.started_at),
+            "finished_at": iso(self.finished_at),
+            "output_lines": self.lines,
+        }
+        if include_output:
+            data["output"] = [
+                {"stream": stream, "line": line} for stream, line in self.output
+            ]
+        return data
+
+
+class JobEngine:
+    """Runs scenario scripts on a private asyncio loop thread.
+
+    Jobs are coroutines, so queued work holds no thread. A global semaphore
+    bounds concurrent processes (the worker pool) and one semaphore per
+    scenario enforces its own limit. Output is read line by line from both
+    pipes and handed to ``emit(event, data, room)``, which is set by the
+    serving mode (Flask-SocketIO or the ASGI server) to reach the session's
+    room. Request threads only submit and read state; they never wait on a
+    script.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = JOB_MAX_WORKERS,
+        scenario_limit: int = JOB_SCENARIO_LIMIT,
+        session_limit: int = JOB_SESSION_LIMIT,
+        default_timeout: float = JOB_TIMEOUT,
+        retention: float = JOB_RETENTION,
+    ):
+        self.max_workers = max_workers
+        self.scenario_limit = scenario_limit
+        self.session_limit = session_limit
+        self.default_timeout = default_timeout
+        self.retention = retention
+        self.emit = None
+        self._jobs: Dict[str, Job] = {}  # insertion ordered, oldest first
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._workers: Optional[asyncio.Semaphore] = None
+        self._scenario_slots: Dict[str, asyncio.Semaphore] = {}
+        self.completed = {state: 0 for state in _JOB_FINAL_STATES}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            ready = threading.Event()
+
+            def run():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                self._workers = asyncio.Semaphore(self.max_workers)
+                ready.set()
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="job-engine", daemon=True)
+            self._thread.start()
+            ready.wait()
+        app_logger.info(
+            "Job engine started (%s workers, %s per scenario)",
+            self.max_workers,
+            self.scenario_limit,
+        )
+
+    def submit(
+        self,
+        session_id: str,
+        scenario: str,
+        script: str,
+        args: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Job:
+        """Queue a script run; raises ValueError/FileNotFoundError/OverflowError"""
+        command = resolve_scenario_script(scenario, script)
+        args = [str(a) for a in (args or [])]
+        timeout = float(self.default_timeout if timeout is None else timeout)
+        if not math.isfinite(timeout) or timeout <= 0:
+            raise ValueError(f"Invalid timeout: {timeout}")
+        timeout = min(timeout, self.default_timeout)
+        self.start()
+
+        with self._lock:
+            self._prune()
+            active = sum(
+                1
+                for job in self._jobs.values()
+                if job.session_id == session_id and not job.finished
+            )
+            if active >= self.session_limit:
+                raise OverflowError(
+                    f"Session already has {active} active jobs (limit {self.session_limit})"
+                )
+            job = Job(session_id, scenario, script, command, args, timeout)
+            self._jobs[job.id] = job
+
+        asyncio.run_coroutine_threadsafe(self._start_task(job), self._loop)
+        app_logger.info("Job %s queued: %s/%s", job.id[:8], scenario, script)
+        security_logger.info(
+            "JOB_SUBMITTED: session=%s, job=%s, script=%s/%s %s",
+            session_id,
+            job.id,
+            scenario,
+            script,
+            shlex.join(args),
+        )
+        self._publish(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, session_id: Optional[str] = None) -> List[Job]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if session_id is not None:
+            jobs = [job for job in jobs if job.session_id == session_id]
+        return jobs
+
+    def cancel(self, job_id: str) -> bool:
+        """Request cancellation; returns False if the job already finished"""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished or self._loop is None:
+            return False
+        job.cancel_requested = True
+        self._loop.call_soon_threadsafe(self._cancel_task, job)
+        security_logger.info("JOB_CANCELLED: job=%s", job.id)
+        return True
+
+    def _cancel_task(self, job: Job):
+        # If the task hasn't started yet, _start_task sees cancel_requested
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    def _prune(self):
+        """Forget finished jobs past retention (oldest first; caller holds the lock)"""
+        cutoff = time.time() - self.retention
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if job.finished and (job.finished_at or 0) < cutoff:
+                del self._jobs[job_id]
+            elif job.created_at >= cutoff:
+                break
+
+    def _publish(self, job: Job):
+        if self.emit is not None:
+            try:
+                self.emit("job_status", job.to_dict(), job.session_id)
+            except Exception as e:
+                app_logger.error("Job status emit failed: %s", e)
 
-    def add_active_connection(self, session_id: str, user_type: str):
-        with self.lock:
-            if session_id in self.active_sessions:
-                connections = self.active_sessions[session_id]["active_connections"]
-                if user_type not in connections:
-                    connections.append(user_type)
-                    app_logger.info(
-                        f"Added active connection {user_type} to session {session_id[:8]}..."
-                    )
-                    security_logger.info(
-                        f"CONNECTION_ADDED: session={session_id}, user_type={user_type}"
-                    )
+    async def _start_task(self, job: Job):
+        job.task = asyncio.current_task()
+        if job.cancel_requested:
+            job.task.cancel()
+        try:
+            await self._run(job)
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except asyncio.TimeoutError:
+            job.status = "timed_out"
+            job.error = f"Timed out after {job.timeout:.0f}s"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            app_logger.error("Job %s failed to run: %s", job.id[:8], e)
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self.completed[job.status] = self.completed.get(job.status, 0) + 1
+            app_logger.info(
+                "Job %s %s (exit=%s, %s lines)",
+                job.id[:8],
+                job.status,
+                job.exit_code,
+                job.lines,
+            )
+            self._publish(job)
 
-    def remove_active_connection(self, session_id: str, user_type: str):
-        with self.lock:
-            if session_id in self.active_sessions:
-                connections = self.active_sessions[session_id]["active_connections"]
-                if user_type in connections:
-                    connections.remove(user_type)
-                    app_logger.info(
-                        f"Removed active connection {user_type} from session {session_id[:8]}..."
-                    )
-                    security_logger.info(
-                        f"CONNECTION_REMOVED: session={session_id}, user_type={user_type}"
-                    )
+    async def _run(self, job: Job):
+        scenario_slot = self._scenario_slots.setdefault(
+            job.scenario, asyncio.Semaphore(self.scenario_limit)
+        )
+        async with scenario_slot, self._workers:
+            job.status = "running"
+            job.started_at = time.time()
+            self._publish(job)
+            env = dict(
+                os.environ,
+                CYBERRANGE_JOB_ID=job.id,
+                CYBERRANGE_SCENARIO=job.scenario,
+                CYBERRANGE_SESSION_ID=job.session_id,
+            )
+            proc = await asyncio.create_subprocess_exec(
+                *job.command,
+                *job.args,
+                cwd=os.path.dirname(job.command[-1]),
+                env=env,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,  # own process group, so kill reaches children
+                limit=1 << 20,
+            )
+            try:
+                await asyncio.wait_for(self._communicate(job, proc), job.timeout)
+            except BaseException:
+                await self._kill(proc)
+                raise
+            job.exit_code = proc.returncode
+            job.status = "succeeded" if proc.returncode == 0 else "failed"
 
-    def cleanup_expired_sessions(self):
-        with self.lock:
-            current_time = datetime.now()
-            expired_sessions = []
-            for session_id, session_data in self.active_sessions.items():
+    async def _communicate(self, job: Job, proc):
+        await asyncio.gather(
+            self._pump(job, proc.stdout, "stdout"),
+            self._pump(job, proc.stderr, "stderr"),
+        )
+        await proc.wait()
+
+    async def _pump(self, job: Job, stream, name: str):
+        while True:
+            raw = await stream.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+            job.lines += 1
+            job.output.append((name, line))
+            if self.emit is not None:
                 try:
-                    last_activity = datetime.fromisoformat(
-                        session_data["last_activity"]
+                    self.emit(
+                        "job_output",
+                        {"job_id": job.id, "seq": job.lines, "stream": name, "line": line},
+                        job.session_id,
                     )
-                    if (current_time - last_activity).seconds > SESSION_TIMEOUT:
-                        expired_sessions.append(session_id)
                 except Exception as e:
-                    app_logger.error(
-                        f"Error checking session expiry for {session_id}: {e}"
-                    )
-                    expired_sessions.append(session_id)  # Remove corrupted sessions
-
-            for session_id in expired_sessions:
-                del self.active_sessions[session_id]
-                if session_id in self.user_tokens:
-                    del self.user_tokens[session_id]
-                app_logger.info(f"Cleaned up expired session: {session_id[:8]}...")
-                security_logger.info(f"SESSION_EXPIRED: {session_id}")
+                    app_logger.error("Job output emit failed: %s", e)
 
-            if expired_sessions:
-                app_logger.info(f"Cleaned up {len(expired_sessions)} expired sessions")
+    async def _kill(self, proc):
+        """SIGTERM the script's process group, then SIGKILL after a grace period"""
+        if proc.returncode is not None:
+            return
+        for sig, grace in ((signal.SIGTERM, JOB_KILL_GRACE), (signal.SIGKILL, None)):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                return
+            if grace is None:
+                break
+            try:
+                await asyncio.wait_for(asyncio.shield(proc.wait()), grace)
+                return
+            except asyncio.TimeoutError:
+                continue
+        await proc.wait()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+            completed = dict(self.completed)
+        running = [job for job in jobs if job.status == "running"]
+        by_scenario: Dict[str, int] = {}
+        for job in running:
+            by_scenario[job.scenario] = by_scenario.get(job.scenario, 0) + 1
+        return {
+            "max_workers": self.max_workers,
+            "scenario_limit": self.scenario_limit,
+            "running": len(running),
+            "queued": sum(1 for job in jobs if job.status == "queued"),
+            "running_by_scenario": by_scenario,
+            "completed": completed,
+        }
 
 
-session_manager = SessionManager()
+job_engine = JobEngine()
 
 
 # =========================
-# Enhanced Guacamole Functions
+# HTML Page Templates
 # =========================
-@monitor_performance("get_guac_token")
-def get_guac_token(user_type: str, force_new: bool = False) -> Tuple[str, str, int]:
-    """Get Guacamole authentication token with enhanced error handling and logging"""
-    if user_type not in GUAC_USERS:
-        error_msg = f"Invalid user type: {user_type}"
-        app_logger.error(error_msg)
-        return error_msg, "", 400
-
-    user_config = GUAC_USERS[user_type]
-    app_logger.info(
-        f"Requesting Guacamole token for {user_type} (force_new={force_new})"
-    )
+# The auto-login and error pages are split into a static shell (CSS + JS,
+# rendered once per GUAC_USERS entry, pre-compressed and served with a strong
+# ETag under a versioned URL) and a tiny per-request document that only
+# carries the escaped values that change between requests.
+_ERROR_PAGE_CSS = """body {
+    display: flex;
+    justify-content: center;
+    align-items: center;
+    height: 100vh;
+    margin: 0;
+    background: linear-gradient(135deg, #c0392b, #e74c3c);
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+}
+.error-card {
+    background: rgba(255,255,255,0.95);
+    border-radius: 16px;
+    padding: 40px;
+    text-align: center;
+    box-shadow: 0 10px 30px rgba(0,0,0,.2);
+    max-width: 500px;
+    border-left: 6px solid #e74c3c;
+}
+.error-icon { font-size: 48px; color: #e74c3c; margin-bottom: 20px; }
+.retry-btn {
+    background: #e74c3c;
+    color: white;
+    border: none;
+    padding: 12px 24px;
+    border-radius: 8px;
+    cursor: pointer;
+    font-size: 16px;
+    margin-top: 20px;
+    transition: background 0.3s;
+}
+.retry-btn:hover { background: #c0392b; }
+.error-details { margin-top: 15px; font-size: 14px; color: #7f8c8d; }
+"""
 
-    try:
-        # Prepare authentication data
-        auth_data = {
-            "username": user_config["username"],
-            "password": user_config["password"],
+_ERROR_PAGE_JS = """(function() {
+    const data = document.body.dataset;
+    document.body.insertAdjacentHTML('afterbegin', `
+    <div class="error-card">
+        <div class="error-icon">⚠️</div>
+        <h2>Connection Failed</h2>
+        <p><strong id="errorTarget"></strong></p>
+        <button class="retry-btn" id="retryBtn">Retry Connection</button>
+        <div class="error-details">
+            <details>
+                <summary>Technical Details</summary>
+                <p id="errorMessage"></p>
+            </details>
+        </div>
+    </div>`);
+    document.getElementById('errorTarget').textContent =
+        `Unable to connect to ${data.userLabel} machine`;
+    document.getElementById('errorMessage').textContent = data.errorMessage;
+    document.getElementById('retryBtn').addEventListener('click', () => location.reload());
+
+    // Auto-retry after 5 seconds
+    setTimeout(() => {
+        if (confirm('Connection failed. Would you like to retry automatically?')) {
+            location.reload();
         }
+    }, 5000);
+})();
+"""
 
-        app_logger.debug(f"Authenticating with Guacamole API at {GUAC_BASE}/api/tokens")
 
-        # Make authentication request
-        response = requests.post(
-            f"{GUAC_BASE}/api/tokens",
-            data=auth_data,
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=GUAC_TOKEN_TIMEOUT,
-            verify=False,
-        )
+def _connection_page_css(user_config: dict) -> str:
+    """Render the themed stylesheet for one user type's connection page"""
+    theme = user_config["color_theme"]
+    return f"""body {{
+    display: flex;
+    justify-content: center;
+    align-items: center;
+    height: 100vh;
+    margin: 0;
+    background: linear-gradient(135deg, {theme}, {theme}88);
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+}}
+.connection-card {{
+    background: rgba(255,255,255,0.95);
+    border-radius: 16px;
+    padding: 40px;
+    text-align: center;
+    box-shadow: 0 10px 30px rgba(0,0,0,.15);
+    border-left: 6px solid {theme};
+    max-width: 450px;
+    min-width: 350px;
+}}
+.user-badge {{
+    display: inline-block;
+    background: {theme};
+    color: white;
+    padding: 8px 16px;
+    border-radius: 25px;
+    font-size: 0.85em;
+    margin-bottom: 20px;
+    font-weight: 600;
+}}
+.status-text {{
+    color: #5a6c7d;
+    font-size: 0.9em;
+    margin: 20px 0;
+}}
+.loading-spinner {{
+    border: 3px solid #f3f3f3;
+    border-top: 3px solid {theme};
+    border-radius: 50%;
+    width: 30px;
+    height: 30px;
+    animation: spin 1s linear infinite;
+    margin: 20px auto;
+}}
+@keyframes spin {{
+    0% {{ transform: rotate(0deg); }}
+    100% {{ transform: rotate(360deg); }}
+}}
+.manual-link {{
+    margin-top: 25px;
+    padding-top: 20px;
+    border-top: 1px solid #ecf0f1;
+    font-size: 0.85em;
+}}
+.manual-link a {{
+    color: {theme};
+    text-decoration: none;
+    font-weight: 500;
+    padding: 8px 16px;
+    border: 1px solid {theme};
+    border-radius: 6px;
+    display: inline-block;
+    transition: all 0.3s;
+}}
+.manual-link a:hover {{
+    background: {theme};
+    color: white;
+}}
+.connection-info {{
+    background: #f8f9fa;
+    border-radius: 8px;
+    padding: 15px;
+    margin: 20px 0;
+    font-size: 0.8em;
+    color: #6c757d;
+}}
+"""
 
-        app_logger.debug(f"Guacamole auth response status: {response.status_code}")
 
-        if response.status_code != 200:
-            error_msg = f"Guacamole authentication failed for {user_type}: HTTP {response.status_code}"
-            app_logger.error(error_msg)
-            security_logger.warning(
-                f"AUTH_FAILED: user_type={user_type}, status={response.status_code}"
-            )
-            return error_msg, "", response.status_code
+def _connection_page_js(user_type: str, user_config: dict) -> str:
+    """Render the connection page script with the card markup baked in"""
+    markup = f"""
+    <div class="connection-card">
+        <div class="user-badge">{html.escape(user_type.title())}</div>
+        <h2>{html.escape(user_config['display_name'])}</h2>
+        <div class="loading-spinner"></div>
+        <p class="status-text" id="statusText">Establishing secure connection...</p>
 
-        data = response.json()
-        token = data.get("authToken")
-        ds = data.get("dataSource", "mysql")  # Default to mysql
+        <div class="connection-info">
+            <strong>Description:</strong> {html.escape(user_config['description'])}<br>
+            <strong>Status:</strong> <span id="connectionStatus">Connecting...</span>
+        </div>
 
-        if not token:
-            error_msg = f"No authToken received for {user_type}"
-            app_logger.error(error_msg)
-            security_logger.warning(f"TOKEN_MISSING: user_type={user_type}")
-            return error_msg, "", 500
+        <div class="manual-link">
+            <a target="_blank" rel="noopener" id="manualLink">
+                Open Connection Manually
+            </a>
+        </div>
+    </div>"""
+    return f"""(function() {{
+    const connectionUrl = document.body.dataset.connectionUrl;
+    document.body.insertAdjacentHTML('afterbegin', {json.dumps(markup)});
+    document.getElementById('manualLink').href = connectionUrl;
+
+    let attemptCount = 0;
+    const maxAttempts = 3;
+
+    function updateStatus(message, isError = false) {{
+        const statusEl = document.getElementById('statusText');
+        const connectionStatusEl = document.getElementById('connectionStatus');
+        statusEl.textContent = message;
+        connectionStatusEl.textContent = isError ? 'Failed' : 'In Progress';
+        statusEl.style.color = isError ? '#e74c3c' : '#5a6c7d';
+    }}
+
+    function attemptConnection() {{
+        attemptCount++;
+        updateStatus(`Attempting connection (${{attemptCount}}/${{maxAttempts}})...`);
+
+        try {{
+            // Try to redirect to the connection
+            window.location.replace(connectionUrl);
+        }}
+        catch(e) {{
+            console.error('Redirect failed:', e);
+            // Fallback: open in new window
+            const newWindow = window.open(connectionUrl, "_blank", "noopener,noreferrer");
+            if (newWindow) {{
+                updateStatus("Connection opened in new tab.");
+                document.getElementById('connectionStatus').textContent = 'Opened';
+            }} else {{
+                updateStatus("Pop-up blocked. Please use manual link.", true);
+            }}
+        }}
+    }}
+
+    // Initial connection attempt after delay
+    setTimeout(attemptConnection, 2000);
+
+    // Add click handler for manual link
+    document.getElementById('manualLink').addEventListener('click', function(e) {{
+        e.preventDefault();
+        window.open(connectionUrl, '_blank', 'noopener,noreferrer');
+        updateStatus("Connection opened manually.");
+        document.getElementById('connectionStatus').textContent = 'Opened';
+    }});
+
+    // Auto-retry logic with exponential backoff
+    let retryTimeout = 5000;
+    function scheduleRetry() {{
+        if (attemptCount < maxAttempts) {{
+            setTimeout(() => {{
+                retryTimeout *= 1.5; // Exponential backoff
+                attemptConnection();
+                scheduleRetry();
+            }}, retryTimeout);
+        }} else {{
+            updateStatus("Auto-connection attempts exhausted. Please use manual link.", true);
+        }}
+    }}
 
-        app_logger.info(f"Successfully obtained token for {user_type}")
-        security_logger.info(f"TOKEN_OBTAINED: user_type={user_type}, datasource={ds}")
-        return token, ds, 200
+    // Only schedule retries if the page is still visible
+    if (!document.hidden) {{
+        setTimeout(scheduleRetry, 3000);
+    }}
+}})();
+"""
 
-    except requests.exceptions.Timeout:
-        error_msg = f"Timeout connecting to Guacamole for {user_type}"
-        app_logger.error(error_msg)
-        return error_msg, "", 408
-    except requests.exceptions.ConnectionError:
-        error_msg = f"Connection error to Guacamole for {user_type}"
-        app_logger.error(error_msg)
-        return error_msg, "", 503
-    except Exception as e:
-        error_msg = f"Unexpected error getting token for {user_type}: {str(e)}"
-        app_logger.error(error_msg)
-        return error_msg, "", 500
 
+class StaticAsset:
+    """Immutable asset body with its gzip encoding and strong validators"""
 
-def validate_guac_token(token: str) -> bool:
-    """Validate if a Guacamole token is still valid with enhanced logging"""
-    try:
-        app_logger.debug("Validating Guacamole token")
-        headers = {"Accept": "application/json"}
-        response = requests.get(
-            f"{GUAC_BASE}/api/session/data/mysql/connections",
-            headers=headers,
-            params={"token": token},
-            timeout=10,
-            verify=False,
-        )
-        is_valid = response.status_code == 200
-        app_logger.debug(f"Token validation result: {is_valid}")
-        return is_valid
-    except Exception as e:
-        app_logger.error(f"Token validation error: {e}")
-        return False
+    __slots__ = ("body", "gzipped", "etag", "gzip_etag", "content_type")
 
+    def __init__(self, body: str, content_type: str):
+        self.body = body.encode("utf-8")
+        # mtime=0 keeps the compressed bytes (and so the ETag) reproducible
+        self.gzipped = gzip.compress(self.body, compresslevel=9, mtime=0)
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.gzip_etag = f"{self.etag}-gz"
+        self.content_type = content_type
 
-def get_guac_connections(token: str, data_source: str) -> dict:
-    """Get Guacamole connections with enhanced logging"""
-    try:
-        app_logger.debug(f"Fetching connections for datasource: {data_source}")
-        r = requests.get(
-            f"{GUAC_BASE}/api/session/data/{data_source}/connections",
-            headers={"Accept": "application/json"},
-            params={"token": token},
-            timeout=GUAC_TOKEN_TIMEOUT,
-            verify=False,
-        )
+    def select(self, accept_gzip: bool) -> Tuple[bytes, str]:
+        """Pick the representation for a client and return (body, etag)"""
+        if accept_gzip:
+            return self.gzipped, self.gzip_etag
+        return self.body, self.etag
 
-        if r.status_code == 200:
-            connections = r.json()
-            app_logger.info(f"Retrieved {len(connections)} connections from Guacamole")
-            return connections
-        else:
-            error_msg = f"HTTP {r.status_code}: {r.text}"
-            app_logger.error(f"Failed to get connections: {error_msg}")
-            return {"error": error_msg}
+    def cache_headers(self, etag: str) -> Dict[str, str]:
+        return {
+            "ETag": f'"{etag}"',
+            "Cache-Control": f"public, max-age={PAGE_ASSET_MAX_AGE}, immutable",
+            "Vary": "Accept-Encoding",
+        }
 
-    except Exception as e:
-        error_msg = f"Exception getting connections: {str(e)}"
-        app_logger.error(error_msg)
-        return {"error": error_msg}
 
+class PageAssetRegistry:
+    """Pre-rendered page shells, built once at import for every GUAC_USERS entry"""
 
-def resolve_connection_id(user_type: str, token: str, data_source: str) -> str:
-    """Resolve connection ID with enhanced error handling"""
-    app_logger.debug(f"Resolving connection ID for {user_type}")
+    def __init__(self, users: Dict[str, dict]):
+        self._assets: Dict[str, StaticAsset] = {}
+        self._add("error.css", _ERROR_PAGE_CSS, "text/css; charset=utf-8")
+        self._add("error.js", _ERROR_PAGE_JS, "text/javascript; charset=utf-8")
+        for user_type, user_config in users.items():
+            self._add(
+                f"connect-{user_type}.css",
+                _connection_page_css(user_config),
+                "text/css; charset=utf-8",
+            )
+            self._add(
+                f"connect-{user_type}.js",
+                _connection_page_js(user_type, user_config),
+                "text/javascript; charset=utf-8",
+            )
+        self._titles = {
+            user_type: html.escape(user_config["display_name"])
+            for user_type, user_config in users.items()
+        }
 
-    # Use configured ID if present
-    cfg = str(GUAC_USERS[user_type].get("connection_id", "")).strip()
-    if cfg:
-        app_logger.info(f"Using configured connection ID {cfg} for {user_type}")
-        return cfg
+    def _add(self, name: str, body: str, content_type: str):
+        self._assets[name] = StaticAsset(body, content_type)
 
-    # Get available connections
-    conns = get_guac_connections(token, data_source)
-    if "error" in conns:
-        raise RuntimeError(conns["error"])
+    def get(self, name: str) -> Optional[StaticAsset]:
+        return self._assets.get(name)
 
-    ids = list(conns.keys())
-    app_logger.debug(f"Available connection IDs: {ids}")
+    def url(self, name: str, prefix: str = "") -> str:
+        """Versioned asset URL; a new build changes the query so caches can be immutable"""
+        return f"{prefix}/api/guac/assets/{name}?v={self._assets[name].etag[:12]}"
 
-    if len(ids) == 1:
-        app_logger.info(
-            f"Using single available connection ID {ids[0]} for {user_type}"
+    def connection_page(
+        self, user_type: str, connection_url: str, prefix: str = ""
+    ) -> str:
+        return (
+            '<!doctype html><html lang="en"><head><meta charset="utf-8">'
+            f"<title>Connecting to {self._titles[user_type]}</title>"
+            '<meta name="viewport" content="width=device-width, initial-scale=1">'
+            f'<link rel="stylesheet" href="{self.url(f"connect-{user_type}.css", prefix)}">'
+            f'<script src="{self.url(f"connect-{user_type}.js", prefix)}" defer></script>'
+            f'</head><body data-connection-url="{html.escape(connection_url)}">'
+            "</body></html>"
         )
-        return ids[0]
 
-    # Try to match by name if there are multiple
-    uname = GUAC_USERS[user_type]["username"].lower()
-    for cid, meta in conns.items():
-        name = str(meta.get("name", "")).lower()
-        if name in (uname, user_type.lower()):
-            app_logger.info(f"Matched connection ID {cid} by name for {user_type}")
-            return cid
+    def error_page(self, user_type: str, error_message: str, prefix: str = "") -> str:
+        label = html.escape(user_type.title())
+        return (
+            '<!doctype html><html lang="en"><head><meta charset="utf-8">'
+            f"<title>Connection Failed - {label}</title>"
+            '<meta name="viewport" content="width=device-width, initial-scale=1">'
+            f'<link rel="stylesheet" href="{self.url("error.css", prefix)}">'
+            f'<script src="{self.url("error.js", prefix)}" defer></script>'
+            f'</head><body data-user-label="{label}" '
+            f'data-error-message="{html.escape(str(error_message))}">'
+            "</body></html>"
+        )
 
-    names = [v.get("name") for v in conns.values()]
-    error_msg = (
-        f"Multiple connections visible for {user_type}. "
-        f"Set connection_id explicitly. Found: {names}"
-    )
-    app_logger.error(error_msg)
-    raise RuntimeError(error_msg)
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "assets": len(self._assets),
+            "bytes": sum(len(a.body) for a in self._assets.values()),
+            "gzip_bytes": sum(len(a.gzipped) for a in self._assets.values()),
+        }
 
 
-def invalidate_guac_token(token: str):
-    """Explicitly invalidate a Guacamole token with logging"""
-    try:
-        app_logger.debug("Invalidating Guacamole token")
-        response = requests.delete(
-            f"{GUAC_BASE}/api/tokens/{token}", timeout=5, verify=False
-        )
-        if response.status_code == 204:
-            app_logger.info("Token successfully invalidated")
-        else:
-            app_logger.warning(
-                f"Token invalidation returned status: {response.status_code}"
-            )
-    except Exception as e:
-        app_logger.error(f"Error invalidating token: {e}")
+page_assets = PageAssetRegistry(GUAC_USERS)
 
 
-def tokenized_connection_url(
-    connection_id: str, token: str, data_source: str = "mysql"
+def _generate_error_page(user_type: str, error_message: str, prefix: str = "") -> str:
+    """Generate the per-request error document around the cached shell"""
+    with trace_span("render", page="error"):
+        return page_assets.error_page(user_type, error_message, prefix)
+
+
+def _generate_connection_page(
+    user_type: str, connection_url: str, prefix: str = ""
 ) -> str:
-    """Generate tokenized connection URL"""
-    cid = str(connection_id).strip()
-    ds = str(data_source).strip()
-    qs = urlencode({"token": str(token), "embed": "true", "resize": "scale"})
-    url = f"{GUAC_BASE.rstrip('/')}/#/client/{ds}/{cid}?{qs}"
-    app_logger.debug(f"Generated connection URL for connection {cid}")
-    return url
+    """Generate the per-request connection document around the cached shell"""
+    with trace_span("render", page="connection"):
+        return page_assets.connection_page(user_type, connection_url, prefix)
 
 
 # =========================
@@ -528,6 +5517,11 @@ def create_app() -> Flask:
     )
 
     # Socket.IO with enhanced configuration
+    socketio_options = {}
+    client_manager = create_socketio_client_manager()
+    if client_manager is not None:
+        # Emits from any worker reach the room wherever the client is connected
+        socketio_options["client_manager"] = client_manager
     socketio = SocketIO(
         app,
         cors_allowed_origins=ALLOWED_ORIGINS,
@@ -536,18 +5530,43 @@ def create_app() -> Flask:
         async_mode="threading",  # Explicit async mode
         ping_timeout=60,
         ping_interval=25,
+        **socketio_options,
     )
 
     # Enhanced request logging
     @app.before_request
     def before_request():
+        # Scrapers don't keep cookies; don't mint a session per scrape
+        if request.path == "/metrics":
+            return
+
+        g.trace, g.trace_token = start_trace(
+            f"{request.method} {request.path}", method=request.method, path=request.path
+        )
+
         # Initialize session if needed
         if "session_id" not in session:
             session["session_id"] = str(uuid.uuid4())
             session.permanent = True
-            session_data = session_manager.create_session(session["session_id"])
-        else:
-            session_manager.update_session_activity(session["session_id"])
+            session_manager.create_session(session["session_id"])
+        elif not session_manager.update_session_activity(session["session_id"]):
+            # Cookie outlived the server-side session (expiry or restart)
+            session_manager.create_session(session["session_id"])
+
+        # Throttle reload loops before they reach Guacamole
+        if is_rate_limited_path(request.path):
+            wait = rate_limiter.check(session["session_id"], request.remote_addr)
+            if wait:
+                retry_after = retry_after_seconds(wait)
+                user_type = None
+                if request.endpoint == "guac_auto_login":
+                    user_type = (request.view_args or {}).get("user_type", "")
+                status, content_type, body = rate_limited_body(
+                    retry_after, user_type, request.script_root
+                )
+                response = Response(body, status=status, content_type=content_type)
+                response.headers["Retry-After"] = str(retry_after)
+                return response
 
         # Log request details
         client_ip = request.headers.get("X-Forwarded-For", request.remote_addr)
@@ -559,10 +5578,13 @@ def create_app() -> Flask:
                 body_preview = "<unavailable>"
 
             app_logger.debug(
-                f"REQUEST: {client_ip} {request.method} {request.path} "
-                f"Session: {session.get('session_id', 'none')[:8]}... "
-                f"User-Agent: {request.headers.get('User-Agent', 'unknown')[:50]}... "
-                f"Body: {body_preview}"
+                "REQUEST: %s %s %s Session: %s... User-Agent: %s... Body: %s",
+                client_ip,
+                request.method,
+                request.path,
+                session.get("session_id", "none")[:8],
+                request.headers.get("User-Agent", "unknown")[:50],
+                body_preview,
             )
 
     @app.after_request
@@ -572,41 +5594,93 @@ def create_app() -> Flask:
             response.headers["X-Frame-Options"] = "DENY"
             response.headers["X-XSS-Protection"] = "1; mode=block"
 
+        # Compression / ETags only for buffered bodies we haven't encoded yet
+        if not (
+            response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+        ):
+            view = app.view_functions.get(request.endpoint)
+            status, body, headers = response_optimizer.optimize(
+                request.method,
+                response.status_code,
+                response.mimetype,
+                response.get_data(),
+                request.headers.get("Accept-Encoding", ""),
+                request.headers.get("If-None-Match", ""),
+                getattr(view, "_http_cache", None),
+            )
+            if "Vary" in headers:
+                response.vary.add(headers.pop("Vary"))
+            response.headers.update(headers)
+            response.status_code = status
+            response.set_data(body)
+
+        if (
+            response.status_code == 503
+            and "Retry-After" not in response.headers
+            and is_rate_limited_path(request.path)
+        ):
+            response.headers["Retry-After"] = str(GUAC_AUTH_RETRY_AFTER)
+
+        trace = g.get("trace")
+        if trace is not None:
+            trace.finish()
+            trace.attrs["status"] = response.status_code
+            if SERVER_TIMING:
+                response.headers["Server-Timing"] = trace.server_timing()
+
         if FLASK_DEBUG:
             app_logger.debug(
-                f"RESPONSE: {response.status} for {request.method} {request.path}"
+                "RESPONSE: %s for %s %s", response.status, request.method, request.path
             )
         return response
 
+    @app.teardown_request
+    def teardown_request(exc):
+        trace = g.pop("trace", None)
+        if trace is not None:
+            end_trace(trace, g.pop("trace_token"))
+
     # =========================
     # API Endpoints
     # =========================
 
     @app.get("/api/health")
+    @http_cache(etag=False)
     @monitor_performance("health_check")
     def health():
         """Enhanced health check with system status"""
         try:
-            # Basic connectivity test to Guacamole
-            guac_status = "unknown"
-            try:
-                response = requests.get(
-                    f"{GUAC_BASE}/api/languages", timeout=5, verify=False
-                )
-                guac_status = "healthy" if response.status_code == 200 else "unhealthy"
-            except Exception:
-                guac_status = "unreachable"
+            # Guacamole state comes from the background prober, not a live call
+            guac_probe = guac_health.snapshot()
 
             health_data = {
                 "ok": True,
                 "timestamp": datetime.now().isoformat(),
                 "session_id": session.get("session_id"),
                 "guac_base": GUAC_BASE,
-                "guac_status": guac_status,
-                "active_sessions": len(session_manager.active_sessions),
-                "total_active_connections": sum(
-                    len(s.get("active_connections", []))
-                    for s in session_manager.active_sessions.values()
+                "guac_status": guac_probe["status"],
+                "guac_probe": guac_probe,
+                "guac_breakers": guac_breakers.snapshot(),
+                "active_sessions": session_manager.session_count(),
+                "total_active_connections": session_manager.active_connection_count(),
+                "guac_pool": guac_client.stats(),
+                "guac_token_cache": token_cache.stats(),
+                "connection_directory": connection_directory.stats(),
+                "token_validation": validation_cache.stats(),
+                "page_assets": page_assets.stats(),
+                "compression": response_optimizer.stats(),
+                "logging": log_pipeline.stats(),
+                "latency": metrics.summary(),
+                "jobs": job_engine.stats(),
+                "token_pool": token_pool.stats(),
+                "token_reaper": token_reaper.stats(),
+                "labs": lab_allocator.stats(),
+                "rate_limit": rate_limiter.stats(),
+                "guac_auth": guac_auth_gate.stats(),
+                "socketio_queue": (
+                    client_manager.stats() if client_manager is not None else None
                 ),
                 "version": "2.0.0",  # Add version tracking
             }
@@ -615,7 +5689,7 @@ def create_app() -> Flask:
             return jsonify(health_data)
 
         except Exception as e:
-            app_logger.error(f"Health check failed: {e}")
+            app_logger.error("Health check failed: %s", e)
             return (
                 jsonify(
                     {
@@ -627,7 +5701,50 @@ def create_app() -> Flask:
                 500,
             )
 
+    @app.get("/metrics")
+    @http_cache(etag=False)
+    def prometheus_metrics():
+        """Prometheus text exposition of the in-process metrics registry"""
+        return Response(
+            metrics.render_prometheus(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+    @app.get("/api/health/deep")
+    @http_cache(etag=False)
+    @require_admin
+    @monitor_performance("health_deep_check")
+    def health_deep():
+        """Operator health check: live Guacamole probe and login per account"""
+        guac_probe = guac_health.probe()
+        auth = {}
+        for user_type in GUAC_USERS:
+            # A fresh login outside the token cache: a cached token would
+            # report healthy, and forcing the cache would rotate the token
+            # every session shares
+            token, _, status_code = _login_guac(user_type)
+            auth[user_type] = "ok" if status_code == 200 else f"HTTP {status_code}"
+            if status_code == 200:
+                invalidate_guac_token(token)
+
+        return jsonify(
+            {
+                "ok": guac_probe["status"] == "healthy"
+                and all(v == "ok" for v in auth.values()),
+                "timestamp": datetime.now().isoformat(),
+                "guac_base": GUAC_BASE,
+                "guac_probe": guac_probe,
+                "guac_breakers": guac_breakers.snapshot(),
+                "guac_auth": auth,
+                "guac_pool": guac_client.stats(),
+                "guac_token_cache": token_cache.stats(),
+                "connection_directory": connection_directory.stats(),
+                "token_validation": validation_cache.stats(),
+            }
+        )
+
     @app.get("/api/status")
+    @http_cache(etag=False)  # carries last_activity, so it never repeats
     @monitor_performance("status_check")
     def status():
         """Enhanced status endpoint with detailed session info"""
@@ -635,11 +5752,17 @@ def create_app() -> Flask:
             session_id = session.get("session_id")
             session_data = session_manager.get_session(session_id)
 
-            # Validate all stored tokens
+            # Validate all stored tokens concurrently
+            tokens = {
+                user_type: session_manager.get_user_token(session_id, user_type)
+                for user_type in GUAC_USERS
+            }
+            validity = validate_guac_tokens(tokens)
+
             validated_users = {}
             for user_type, config in GUAC_USERS.items():
-                token = session_manager.get_user_token(session_id, user_type)
-                token_valid = validate_guac_token(token) if token else False
+                token = tokens[user_type]
+                token_valid = validity[user_type]
 
                 validated_users[user_type] = {
                     "username": config["username"],
@@ -664,11 +5787,11 @@ def create_app() -> Flask:
                 },
             }
 
-            app_logger.debug(f"Status check for session {session_id[:8]}...")
+            app_logger.debug("Status check for session %s...", session_id[:8])
             return jsonify(status_data)
 
         except Exception as e:
-            app_logger.error(f"Status check failed: {e}")
+            app_logger.error("Status check failed: %s", e)
             return jsonify({"error": str(e)}), 500
 
     @app.post("/api/guac/token/<user_type>")
@@ -678,21 +5801,22 @@ def create_app() -> Flask:
         session_id = session.get("session_id")
 
         if user_type not in GUAC_USERS:
-            app_logger.warning(f"Invalid user type requested: {user_type}")
+            app_logger.warning("Invalid user type requested: %s", user_type)
             return jsonify({"error": f"Invalid user type: {user_type}"}), 400
 
         try:
             app_logger.info(
-                f"Token requested for {user_type} in session {session_id[:8]}..."
+                "Token requested for %s in session %s...", user_type, session_id[:8]
             )
 
-            # Get fresh token
-            token, ds, status = get_guac_token(user_type, force_new=True)
+            # Pooled per-session token if the pool is enabled and has one,
+            # else the shared cached token
+            token, ds, status = get_guac_token(user_type, exclusive=True)
             if status != 200:
                 return jsonify({"error": token}), status
 
-            # Resolve connection ID
-            conn_id = resolve_connection_id(user_type, token, ds)
+            # The session's own lab pair, else the shared connection
+            conn_id = resolve_session_connection(session_id, user_type, token, ds)
 
             # Generate connection URL
             url = tokenized_connection_url(conn_id, token, ds)
@@ -708,296 +5832,84 @@ def create_app() -> Flask:
                 "data_source": ds,
             }
 
-            app_logger.info(f"Token successfully generated for {user_type}")
+            app_logger.info("Token successfully generated for %s", user_type)
             return jsonify(response_data)
 
+        except LabUnavailable as e:
+            # Queued for a lab: the token taken for it must not linger
+            token_reaper.submit([token])
+            return (
+                jsonify(
+                    {"error": str(e), "scenario": e.scenario, "queue_position": e.position}
+                ),
+                503,
+            )
         except Exception as e:
-            app_logger.error(f"Token generation failed for {user_type}: {e}")
+            app_logger.error("Token generation failed for %s: %s", user_type, e)
             return jsonify({"error": str(e)}), 500
 
     @app.get("/api/guac/auto-login/<user_type>")
+    @http_cache(etag=False)
     @monitor_performance("auto_login")
     def guac_auto_login(user_type):
         """Enhanced auto-login with better error handling and logging"""
         session_id = session.get("session_id")
 
         if user_type not in GUAC_USERS:
-            app_logger.warning(f"Invalid user type for auto-login: {user_type}")
-            return jsonify({"error": f"Invalid user type: {user_type}"}), 400
-
-        app_logger.info(
-            f"Auto-login requested for {user_type} in session {session_id[:8]}..."
-        )
-
-        try:
-            # Get fresh token for auto-login
-            token, ds, status_code = get_guac_token(user_type, force_new=True)
-            if status_code != 200:
-                error_html = self._generate_error_page(user_type, token)
-                return Response(error_html, mimetype="text/html", status=status_code)
-
-            # Store token and mark connection as active
-            session_manager.store_user_token(session_id, user_type, token)
-            session_manager.add_active_connection(session_id, user_type)
-
-            # Generate connection details
-            user_config = GUAC_USERS[user_type]
-            connection_id = resolve_connection_id(user_type, token, ds)
-            connection_url = tokenized_connection_url(connection_id, token, ds)
-
-            # Generate enhanced HTML page
-            html = _generate_connection_page(user_type, user_config, connection_url)
-
-            app_logger.info(f"Auto-login page generated for {user_type}")
-            return Response(html, mimetype="text/html")
-
-        except Exception as e:
-            app_logger.error(f"Auto-login failed for {user_type}: {e}")
-            error_html = _generate_error_page(user_type, str(e))
-            return Response(error_html, mimetype="text/html", status=500)
-
-    def _generate_error_page(user_type: str, error_message: str) -> str:
-        """Generate enhanced error page"""
-        return f"""<!doctype html>
-<html lang="en">
-<head>
-    <meta charset="utf-8">
-    <title>Connection Failed - {user_type.title()}</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        body {{
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            height: 100vh;
-            margin: 0;
-            background: linear-gradient(135deg, #c0392b, #e74c3c);
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-        }}
-        .error-card {{
-            background: rgba(255,255,255,0.95);
-            border-radius: 16px;
-            padding: 40px;
-            text-align: center;
-            box-shadow: 0 10px 30px rgba(0,0,0,.2);
-            max-width: 500px;
-            border-left: 6px solid #e74c3c;
-        }}
-        .error-icon {{ font-size: 48px; color: #e74c3c; margin-bottom: 20px; }}
-        .retry-btn {{
-            background: #e74c3c;
-            color: white;
-            border: none;
-            padding: 12px 24px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 16px;
-            margin-top: 20px;
-            transition: background 0.3s;
-        }}
-        .retry-btn:hover {{ background: #c0392b; }}
-        .error-details {{ margin-top: 15px; font-size: 14px; color: #7f8c8d; }}
-    </style>
-</head>
-<body>
-    <div class="error-card">
-        <div class="error-icon">⚠️</div>
-        <h2>Connection Failed</h2>
-        <p><strong>Unable to connect to {user_type.title()} machine</strong></p>
-        <button class="retry-btn" onclick="location.reload()">Retry Connection</button>
-        <div class="error-details">
-            <details>
-                <summary>Technical Details</summary>
-                <p>{error_message}</p>
-            </details>
-        </div>
-    </div>
-    <script>
-        // Auto-retry after 5 seconds
-        setTimeout(() => {{
-            if (confirm('Connection failed. Would you like to retry automatically?')) {{
-                location.reload();
-            }}
-        }}, 5000);
-    </script>
-</body>
-</html>"""
-
-    def _generate_connection_page(
-        user_type: str, user_config: dict, connection_url: str
-    ) -> str:
-        """Generate enhanced connection page with better UX"""
-        return f"""<!doctype html>
-<html lang="en">
-<head>
-    <meta charset="utf-8">
-    <title>Connecting to {user_config['display_name']}</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        body {{
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            height: 100vh;
-            margin: 0;
-            background: linear-gradient(135deg, {user_config['color_theme']}, {user_config['color_theme']}88);
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-        }}
-        .connection-card {{
-            background: rgba(255,255,255,0.95);
-            border-radius: 16px;
-            padding: 40px;
-            text-align: center;
-            box-shadow: 0 10px 30px rgba(0,0,0,.15);
-            border-left: 6px solid {user_config['color_theme']};
-            max-width: 450px;
-            min-width: 350px;
-        }}
-        .user-badge {{
-            display: inline-block;
-            background: {user_config['color_theme']};
-            color: white;
-            padding: 8px 16px;
-            border-radius: 25px;
-            font-size: 0.85em;
-            margin-bottom: 20px;
-            font-weight: 600;
-        }}
-        .status-text {{ 
-            color: #5a6c7d; 
-            font-size: 0.9em; 
-            margin: 20px 0;
-        }}
-        .loading-spinner {{
-            border: 3px solid #f3f3f3;
-            border-top: 3px solid {user_config['color_theme']};
-            border-radius: 50%;
-            width: 30px;
-            height: 30px;
-            animation: spin 1s linear infinite;
-            margin: 20px auto;
-        }}
-        @keyframes spin {{
-            0% {{ transform: rotate(0deg); }}
-            100% {{ transform: rotate(360deg); }}
-        }}
-        .manual-link {{ 
-            margin-top: 25px; 
-            padding-top: 20px; 
-            border-top: 1px solid #ecf0f1; 
-            font-size: 0.85em; 
-        }}
-        .manual-link a {{ 
-            color: {user_config['color_theme']}; 
-            text-decoration: none; 
-            font-weight: 500; 
-            padding: 8px 16px;
-            border: 1px solid {user_config['color_theme']};
-            border-radius: 6px;
-            display: inline-block;
-            transition: all 0.3s;
-        }}
-        .manual-link a:hover {{ 
-            background: {user_config['color_theme']};
-            color: white;
-        }}
-        .connection-info {{
-            background: #f8f9fa;
-            border-radius: 8px;
-            padding: 15px;
-            margin: 20px 0;
-            font-size: 0.8em;
-            color: #6c757d;
-        }}
-    </style>
-</head>
-<body>
-    <div class="connection-card">
-        <div class="user-badge">{user_type.title()}</div>
-        <h2>{user_config['display_name']}</h2>
-        <div class="loading-spinner"></div>
-        <p class="status-text" id="statusText">Establishing secure connection...</p>
-        
-        <div class="connection-info">
-            <strong>Description:</strong> {user_config['description']}<br>
-            <strong>Status:</strong> <span id="connectionStatus">Connecting...</span>
-        </div>
-        
-        <div class="manual-link">
-            <a href="{connection_url}" target="_blank" rel="noopener" id="manualLink">
-                Open Connection Manually
-            </a>
-        </div>
-    </div>
-
-    <script>
-        (function() {{
-            const connectionUrl = "{connection_url}";
-            let attemptCount = 0;
-            const maxAttempts = 3;
-            
-            function updateStatus(message, isError = false) {{
-                const statusEl = document.getElementById('statusText');
-                const connectionStatusEl = document.getElementById('connectionStatus');
-                statusEl.textContent = message;
-                connectionStatusEl.textContent = isError ? 'Failed' : 'In Progress';
-                statusEl.style.color = isError ? '#e74c3c' : '#5a6c7d';
-            }}
-            
-            function attemptConnection() {{
-                attemptCount++;
-                updateStatus(`Attempting connection (${{attemptCount}}/${{maxAttempts}})...`);
-                
-                try {{ 
-                    // Try to redirect to the connection
-                    window.location.replace(connectionUrl); 
-                }}
-                catch(e) {{
-                    console.error('Redirect failed:', e);
-                    // Fallback: open in new window
-                    const newWindow = window.open(connectionUrl, "_blank", "noopener,noreferrer");
-                    if (newWindow) {{
-                        updateStatus("Connection opened in new tab.");
-                        document.getElementById('connectionStatus').textContent = 'Opened';
-                    }} else {{
-                        updateStatus("Pop-up blocked. Please use manual link.", true);
-                    }}
-                }}
-            }}
-            
-            // Initial connection attempt after delay
-            setTimeout(attemptConnection, 2000);
-            
-            // Add click handler for manual link
-            document.getElementById('manualLink').addEventListener('click', function(e) {{
-                e.preventDefault();
-                window.open(connectionUrl, '_blank', 'noopener,noreferrer');
-                updateStatus("Connection opened manually.");
-                document.getElementById('connectionStatus').textContent = 'Opened';
-            }});
-            
-            // Auto-retry logic with exponential backoff
-            let retryTimeout = 5000;
-            function scheduleRetry() {{
-                if (attemptCount < maxAttempts) {{
-                    setTimeout(() => {{
-                        retryTimeout *= 1.5; // Exponential backoff
-                        attemptConnection();
-                        scheduleRetry();
-                    }}, retryTimeout);
-                }} else {{
-                    updateStatus("Auto-connection attempts exhausted. Please use manual link.", true);
-                }}
-            }}
-            
-            // Only schedule retries if the page is still visible
-            if (!document.hidden) {{
-                setTimeout(scheduleRetry, 3000);
-            }}
-        }})();
-    </script>
-</body>
-</html>"""
+            app_logger.warning("Invalid user type for auto-login: %s", user_type)
+            return jsonify({"error": f"Invalid user type: {user_type}"}), 400
+
+        app_logger.info(
+            "Auto-login requested for %s in session %s...", user_type, session_id[:8]
+        )
+
+        try:
+            # Pooled per-session token if the pool is enabled and has one,
+            # else the shared cached token
+            token, ds, status_code = get_guac_token(user_type, exclusive=True)
+            if status_code != 200:
+                error_html = _generate_error_page(user_type, token, request.script_root)
+                return Response(error_html, mimetype="text/html", status=status_code)
+
+            # The session's own lab pair, else the shared connection
+            connection_id = resolve_session_connection(session_id, user_type, token, ds)
+            connection_url = tokenized_connection_url(connection_id, token, ds)
+
+            # Store token and mark connection as active
+            session_manager.store_user_token(session_id, user_type, token)
+            session_manager.add_active_connection(session_id, user_type)
+
+            # Only the URL is per-request; the page shell is cached client-side
+            page = _generate_connection_page(
+                user_type, connection_url, request.script_root
+            )
+
+            app_logger.info("Auto-login page generated for %s", user_type)
+            return Response(page, mimetype="text/html")
+
+        except LabUnavailable as e:
+            token_reaper.submit([token])
+            error_html = _generate_error_page(user_type, str(e), request.script_root)
+            return Response(error_html, mimetype="text/html", status=503)
+        except Exception as e:
+            app_logger.error("Auto-login failed for %s: %s", user_type, e)
+            error_html = _generate_error_page(user_type, str(e), request.script_root)
+            return Response(error_html, mimetype="text/html", status=500)
+
+    @app.get("/api/guac/assets/<name>")
+    def guac_page_asset(name):
+        """Serve a pre-rendered page shell; gzip and ETags are computed at startup"""
+        asset = page_assets.get(name)
+        if asset is None:
+            return jsonify({"error": f"Unknown asset: {name}"}), 404
+
+        body, etag = asset.select("gzip" in request.accept_encodings)
+        headers = asset.cache_headers(etag)
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        if body is asset.gzipped:
+            headers["Content-Encoding"] = "gzip"
+        return Response(body, content_type=asset.content_type, headers=headers)
 
     @app.post("/api/guac/disconnect/<user_type>")
     @monitor_performance("disconnect_user")
@@ -1006,25 +5918,28 @@ def create_app() -> Flask:
         session_id = session.get("session_id")
 
         if user_type not in GUAC_USERS:
-            app_logger.warning(f"Invalid user type for disconnect: {user_type}")
+            app_logger.warning("Invalid user type for disconnect: %s", user_type)
             return jsonify({"error": f"Invalid user type: {user_type}"}), 400
 
         try:
             app_logger.info(
-                f"Disconnect requested for {user_type} in session {session_id[:8]}..."
+                "Disconnect requested for %s in session %s...",
+                user_type,
+                session_id[:8],
             )
 
             # Remove active connection first
             session_manager.remove_active_connection(session_id, user_type)
+            release_lab_if_idle(session_id)
 
-            # Get and invalidate token
+            # Drop this session's token, then invalidate it unless shared
             token = session_manager.get_user_token(session_id, user_type)
             if token:
-                invalidate_guac_token(token)
                 session_manager.remove_user_token(session_id, user_type)
-                app_logger.info(f"Token invalidated for {user_type}")
+                result = release_guac_token(token)
+                app_logger.info("Token %s for %s", result, user_type)
             else:
-                app_logger.info(f"No active token found for {user_type}")
+                app_logger.info("No active token found for %s", user_type)
 
             # Emit socket event for real-time updates
             socketio.emit(
@@ -1044,15 +5959,15 @@ def create_app() -> Flask:
                 "timestamp": datetime.now().isoformat(),
             }
 
-            app_logger.info(f"Successfully disconnected {user_type}")
+            app_logger.info("Successfully disconnected %s", user_type)
             security_logger.info(
-                f"USER_DISCONNECTED: session={session_id}, user_type={user_type}"
+                "USER_DISCONNECTED: session=%s, user_type=%s", session_id, user_type
             )
 
             return jsonify(response_data)
 
         except Exception as e:
-            app_logger.error(f"Disconnect failed for {user_type}: {e}")
+            app_logger.error("Disconnect failed for %s: %s", user_type, e)
             return jsonify({"error": str(e)}), 500
 
     @app.route("/api/guac/disconnect-all", methods=["POST", "DELETE", "OPTIONS"])
@@ -1060,37 +5975,14 @@ def create_app() -> Flask:
     def disconnect_all():
         """Enhanced disconnect-all with detailed results and cleanup"""
         session_id = session.get("session_id")
-        results = {}
-        success_count = 0
-        error_count = 0
 
-        app_logger.info(f"Disconnect-all requested for session {session_id[:8]}...")
+        app_logger.info("Disconnect-all requested for session %s...", session_id[:8])
 
         try:
-            for user_type in GUAC_USERS.keys():
-                try:
-                    token = session_manager.get_user_token(session_id, user_type)
-                    if token:
-                        # Validate token before attempting to invalidate
-                        if validate_guac_token(token):
-                            invalidate_guac_token(token)
-                            results[user_type] = "disconnected"
-                            success_count += 1
-                        else:
-                            results[user_type] = "token_already_invalid"
-                            success_count += 1
-                    else:
-                        results[user_type] = "no_active_token"
-                        success_count += 1
-
-                    # Clean up session data regardless
-                    session_manager.remove_user_token(session_id, user_type)
-                    session_manager.remove_active_connection(session_id, user_type)
-
-                except Exception as e:
-                    results[user_type] = f"error: {str(e)}"
-                    error_count += 1
-                    app_logger.error(f"Error disconnecting {user_type}: {e}")
+            # One concurrent DELETE per token; session data is cleared regardless
+            results = disconnect_session(session_id)
+            error_count = sum(r.startswith("error") for r in results.values())
+            success_count = len(results) - error_count
 
             # Emit socket event for all disconnections
             socketio.emit(
@@ -1115,18 +6007,290 @@ def create_app() -> Flask:
             }
 
             app_logger.info(
-                f"Disconnect-all completed: {success_count} successful, {error_count} errors"
+                "Disconnect-all completed: %s successful, %s errors",
+                success_count,
+                error_count,
             )
             security_logger.info(
-                f"ALL_USERS_DISCONNECTED: session={session_id}, success={success_count}, errors={error_count}"
+                "ALL_USERS_DISCONNECTED: session=%s, success=%s, errors=%s",
+                session_id,
+                success_count,
+                error_count,
             )
 
             return jsonify(response_data)
 
         except Exception as e:
-            app_logger.error(f"Disconnect-all failed: {e}")
+            app_logger.error("Disconnect-all failed: %s", e)
             return jsonify({"error": str(e)}), 500
 
+    # =========================
+    # Admin Endpoints
+    # =========================
+
+    @app.post("/api/admin/connections/invalidate")
+    @require_admin
+    def invalidate_connection_directory():
+        """Drop the cached connection directory after lab connections change"""
+        data_source = (request.get_json(silent=True) or {}).get("data_source")
+        dropped = connection_directory.invalidate(data_source)
+        return jsonify(
+            {
+                "ok": True,
+                "invalidated": dropped,
+                "data_source": data_source,
+                "timestamp": datetime.now().isoformat(),
+            }
+        )
+
+    @app.post("/api/admin/token-pool/warm-up")
+    @require_admin
+    def warm_token_pool():
+        """Pre-authenticate tokens for an expected headcount before class starts"""
+        data = request.get_json(silent=True) or {}
+        try:
+            headcount = int(data.get("headcount", 0))
+        except (TypeError, ValueError):
+            return jsonify({"error": "headcount must be an integer"}), 400
+        if headcount < 0:
+            return jsonify({"error": "headcount must not be negative"}), 400
+        user_types = data.get("user_types") or list(GUAC_USERS)
+        unknown = [ut for ut in user_types if ut not in GUAC_USERS]
+        if unknown:
+            return jsonify({"error": f"Invalid user types: {unknown}"}), 400
+
+        targets = token_pool.warm_up(headcount, user_types)
+        security_logger.info(
+            "TOKEN_POOL_WARM_UP: headcount=%s, targets=%s", headcount, targets
+        )
+        return (
+            jsonify(
+                {
+                    "ok": True,
+                    "headcount": headcount,
+                    "targets": targets,
+                    "pool": token_pool.stats(),
+                    "timestamp": datetime.now().isoformat(),
+                }
+            ),
+            202,
+        )
+
+    @app.get("/api/admin/labs")
+    @require_admin
+    def lab_assignments():
+        """Lab pool utilization and which session holds which pair"""
+        return jsonify(
+            {
+                "ok": True,
+                "stats": lab_allocator.stats(),
+                "assignments": lab_allocator.assignments(),
+                "timestamp": datetime.now().isoformat(),
+            }
+        )
+
+    @app.post("/api/admin/labs/refresh")
+    @require_admin
+    def refresh_labs():
+        """Rediscover lab pairs after connections were added or removed in Guacamole"""
+        try:
+            sync_lab_pool(force=True)
+        except Exception as e:
+            app_logger.error("Lab pool refresh failed: %s", e)
+            return jsonify({"error": str(e)}), 502
+        return jsonify({"ok": True, "stats": lab_allocator.stats()})
+
+    @app.post("/api/admin/sessions/teardown")
+    @require_admin
+    def teardown_all_sessions():
+        """End-of-class cleanup: disconnect every session (or one scenario's).
+
+        Streams one JSON line per finished session, then a summary.
+        """
+        data = request.get_json(silent=True) or {}
+        scenario = data.get("scenario")
+        try:
+            concurrency = int(data.get("concurrency", GUAC_TEARDOWN_CONCURRENCY))
+        except (TypeError, ValueError):
+            return jsonify({"error": "concurrency must be an integer"}), 400
+        if scenario is None:
+            session_ids = session_manager.session_ids()
+        elif scenario in lab_allocator.scenarios():
+            session_ids = lab_allocator.sessions(scenario)
+        else:
+            return jsonify({"error": f"Unknown lab scenario: {scenario}"}), 400
+
+        security_logger.info(
+            "SESSIONS_TEARDOWN: scenario=%s, sessions=%s", scenario, len(session_ids)
+        )
+
+        def notify(session_id, results):
+            socketio.emit(
+                "all_users_disconnected",
+                {
+                    "session_id": session_id,
+                    "results": results,
+                    "timestamp": datetime.now().isoformat(),
+                },
+                room=session_id,
+            )
+
+        def stream():
+            for event in teardown_sessions(session_ids, concurrency, notify):
+                if event["event"] == "finished":
+                    security_logger.info(
+                        "SESSIONS_TORN_DOWN: scenario=%s, success=%s, errors=%s",
+                        scenario,
+                        event["successful"],
+                        event["errors"],
+                    )
+                yield json.dumps(event) + "\n"
+
+        return Response(stream(), mimetype="application/x-ndjson")
+
+    # =========================
+    # Lab Allocation
+    # =========================
+
+    @app.get("/api/lab")
+    def get_lab():
+        """The session's lab pair, or its place in the queue"""
+        session_id = session.get("session_id")
+        pair = lab_allocator.get(session_id)
+        return jsonify(
+            {
+                "ok": True,
+                "lab": pair.to_dict() if pair else None,
+                "queue_position": lab_allocator.queue_position(session_id),
+                "scenarios": lab_allocator.scenarios(),
+            }
+        )
+
+    @app.post("/api/lab")
+    @monitor_performance("allocate_lab")
+    def allocate_lab():
+        """Claim a lab pair, optionally for a named scenario"""
+        session_id = session.get("session_id")
+        scenario = (request.get_json(silent=True) or {}).get("scenario")
+        if not LAB_ALLOCATION:
+            return jsonify({"error": "Lab allocation is disabled"}), 404
+        try:
+            if not lab_allocator.scenarios():
+                sync_lab_pool()
+        except Exception as e:
+            app_logger.error("Lab pool sync failed: %s", e)
+            return jsonify({"error": str(e)}), 502
+        try:
+            pair = lab_allocator.allocate(session_id, scenario)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except LabUnavailable as e:
+            return (
+                jsonify(
+                    {
+                        "ok": False,
+                        "error": str(e),
+                        "scenario": e.scenario,
+                        "queue_position": e.position,
+                    }
+                ),
+                202,
+            )
+        if pair is None:
+            return jsonify({"error": "No lab pairs are configured"}), 404
+        return jsonify({"ok": True, "lab": pair.to_dict()})
+
+    @app.delete("/api/lab")
+    def release_lab():
+        """Give the session's lab pair back (or leave the queue)"""
+        session_id = session.get("session_id")
+        released = lab_allocator.release(session_id)
+        return jsonify({"ok": True, "released": released})
+
+    # =========================
+    # Scenario Jobs
+    # =========================
+
+    @app.post("/api/jobs")
+    @monitor_performance("submit_job")
+    def submit_job():
+        """Queue a scenario script; output streams to the session's room.
+
+        Operators may run any scenario's scripts with arguments. Students
+        only run their allocated lab's scripts, without arguments.
+        """
+        session_id = session.get("session_id")
+        data = request.get_json(silent=True) or {}
+        scenario = str(data.get("scenario", ""))
+        args = data.get("args") or []
+        if isinstance(args, str):
+            try:
+                args = shlex.split(args)
+            except ValueError as e:
+                return jsonify({"error": f"Invalid args: {e}"}), 400
+
+        if not is_admin_request():
+            pair = lab_allocator.get(session_id)
+            if pair is None or pair.scenario != scenario:
+                security_logger.warning(
+                    "JOB_DENIED: session=%s, scenario=%s", session_id, scenario
+                )
+                return jsonify({"error": "Scripts can only be run for your own lab"}), 403
+            if args:
+                security_logger.warning(
+                    "JOB_ARGS_DENIED: session=%s, scenario=%s", session_id, scenario
+                )
+                return jsonify({"error": "Script arguments require admin access"}), 403
+
+        try:
+            job = job_engine.submit(
+                session_id,
+                scenario,
+                str(data.get("script", "")),
+                args=args,
+                timeout=data.get("timeout"),
+            )
+        except FileNotFoundError as e:
+            return jsonify({"error": str(e)}), 404
+        except OverflowError as e:
+            return jsonify({"error": str(e)}), 429
+        except (TypeError, ValueError) as e:
+            app_logger.warning("Rejected job request: %s", e)
+            return jsonify({"error": str(e)}), 400
+
+        return jsonify({"ok": True, "job": job.to_dict()}), 202
+
+    @app.get("/api/jobs")
+    @http_cache(etag=False)
+    def list_jobs():
+        """Jobs submitted by this session, newest first"""
+        jobs = job_engine.list_jobs(session.get("session_id"))
+        return jsonify(
+            {
+                "jobs": [job.to_dict() for job in reversed(jobs)],
+                "engine": job_engine.stats(),
+            }
+        )
+
+    @app.get("/api/jobs/<job_id>")
+    @http_cache(etag=False)
+    def get_job(job_id):
+        """One job with the retained tail of its output"""
+        job = job_engine.get(job_id)
+        if job is None or job.session_id != session.get("session_id"):
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify({"job": job.to_dict(include_output=True)})
+
+    @app.route("/api/jobs/<job_id>/cancel", methods=["POST", "DELETE"])
+    def cancel_job(job_id):
+        """Cancel a queued or running job (the script's process group is killed)"""
+        job = job_engine.get(job_id)
+        if job is None or job.session_id != session.get("session_id"):
+            return jsonify({"error": "Job not found"}), 404
+        if not job_engine.cancel(job_id):
+            return jsonify({"error": f"Job already {job.status}"}), 409
+        return jsonify({"ok": True, "job_id": job_id}), 202
+
     # =========================
     # WebSocket Event Handlers
     # =========================
@@ -1137,7 +6301,7 @@ def create_app() -> Flask:
         session_id = session.get("session_id")
         if session_id:
             join_room(session_id)
-            app_logger.info(f"WebSocket client connected to room {session_id[:8]}...")
+            app_logger.info("WebSocket client connected to room %s...", session_id[:8])
 
             # Send current session status
             session_data = session_manager.get_session(session_id)
@@ -1164,7 +6328,7 @@ def create_app() -> Flask:
         if session_id:
             leave_room(session_id)
             app_logger.info(
-                f"WebSocket client disconnected from room {session_id[:8]}..."
+                "WebSocket client disconnected from room %s...", session_id[:8]
             )
 
     @socketio.on("ping")
@@ -1178,21 +6342,27 @@ def create_app() -> Flask:
 
     @app.errorhandler(404)
     def not_found(error):
-        app_logger.warning(f"404 error for {request.path}")
+        app_logger.warning("404 error for %s", request.path)
         return jsonify({"error": "Resource not found"}), 404
 
     @app.errorhandler(500)
     def internal_error(error):
-        app_logger.error(f"500 error: {error}")
+        app_logger.error("500 error: %s", error)
         return jsonify({"error": "Internal server error"}), 500
 
     @app.errorhandler(Exception)
     def handle_exception(e):
-        app_logger.error(f"Unhandled exception: {e}", exc_info=True)
+        app_logger.error("Unhandled exception: %s", e, exc_info=True)
         return jsonify({"error": "An unexpected error occurred"}), 500
 
     # Store socketio reference
     app.socketio = socketio
+    job_engine.emit = lambda event, data, room: socketio.emit(event, data, room=room)
+    lab_allocator.emit = job_engine.emit
+
+    guac_health.start()
+    token_pool.start()
+    token_reaper.start()
 
     # Log successful app creation
     app_logger.info("Flask application created successfully")
@@ -1204,6 +6374,467 @@ def create_wsgi_app():
     return create_app()
 
 
+# =========================
+# ASGI Application
+# =========================
+def _json_body(data: Dict[str, Any], status: int = 200) -> Tuple[int, str, bytes]:
+    return status, "application/json", json.dumps(data).encode("utf-8")
+
+
+def _html_body(html: str, status: int = 200) -> Tuple[int, str, bytes]:
+    return status, "text/html; charset=utf-8", html.encode("utf-8")
+
+
+class GuacAsgiRouter:
+    """ASGI router serving the Guacamole-bound endpoints as coroutines.
+
+    Token, auto-login, status and disconnect routes are handled natively on
+    the event loop with the async Guacamole client; everything else falls
+    through to the Flask app via asgiref's WSGI bridge. Sessions use the
+    same signed Flask cookie, so both paths see the same session_id.
+    """
+
+    def __init__(self, flask_app: Flask, sio):
+        self.flask_app = flask_app
+        self.sio = sio
+        self.fallback = WsgiToAsgi(flask_app)
+        self.serializer = flask_app.session_interface.get_signing_serializer(
+            flask_app
+        )
+        self.cookie_name = flask_app.config["SESSION_COOKIE_NAME"]
+        # (methods, path pattern, handler, handler takes the mount prefix)
+        self.routes = [
+            ({"POST"}, re.compile(r"/api/guac/token/(?P<user_type>[^/]+)"), self.get_token_for_user, False),
+            ({"GET"}, re.compile(r"/api/guac/auto-login/(?P<user_type>[^/]+)"), self.guac_auto_login, True),
+            ({"GET"}, re.compile(r"/api/status"), self.status, False),
+            ({"POST"}, re.compile(r"/api/guac/disconnect/(?P<user_type>[^/]+)"), self.disconnect_user, False),
+            ({"POST", "DELETE"}, re.compile(r"/api/guac/disconnect-all"), self.disconnect_all, False),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for methods, pattern, handler, wants_root in self.routes:
+                match = pattern.fullmatch(scope["path"])
+                if match and scope["method"] in methods:
+                    params = match.groupdict()
+                    if wants_root:
+                        params["root_path"] = scope.get("root_path", "")
+                    await self._dispatch(handler, params, scope, send)
+                    return
+        await self.fallback(scope, receive, send)
+
+    def session_id_from_cookie(self, cookie_header: str) -> Optional[str]:
+        """Read session_id from the signed Flask session cookie, if valid"""
+        if not cookie_header:
+            return None
+        cookie = SimpleCookie()
+        try:
+            cookie.load(cookie_header)
+        except Exception:
+            return None
+        morsel = cookie.get(self.cookie_name)
+        if morsel is None:
+            return None
+        try:
+            data = self.serializer.loads(morsel.value, max_age=SESSION_TIMEOUT)
+        except BadSignature:
+            return None
+        return data.get("session_id")
+
+    def _load_session(self, headers: Dict[str, str]) -> Tuple[str, Optional[str]]:
+        """Mirror before_request: returns ``(session_id, set_cookie_header)``"""
+        session_id = self.session_id_from_cookie(headers.get("cookie", ""))
+        if session_id:
+            if not session_manager.update_session_activity(session_id):
+                session_manager.create_session(session_id)
+            return session_id, None
+
+        session_id = str(uuid.uuid4())
+        session_manager.create_session(session_id)
+        value = self.serializer.dumps({"_permanent": True, "session_id": session_id})
+        set_cookie = dump_cookie(
+            self.cookie_name,
+            value,
+            max_age=SESSION_TIMEOUT,
+            path="/",
+            httponly=self.flask_app.config["SESSION_COOKIE_HTTPONLY"],
+            secure=self.flask_app.config["SESSION_COOKIE_SECURE"],
+            samesite=self.flask_app.config["SESSION_COOKIE_SAMESITE"],
+        )
+        return session_id, set_cookie
+
+    @staticmethod
+    def _client_ip(scope, headers: Dict[str, str]) -> Optional[str]:
+        """Client address as ProxyFix(x_for=1) sees it on the Flask side"""
+        forwarded = headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.rsplit(",", 1)[-1].strip()
+        client = scope.get("client")
+        return client[0] if client else None
+
+    async def _dispatch(self, handler, params, scope, send):
+        trace, trace_token = start_trace(
+            f"{scope['method']} {scope['path']}",
+            method=scope["method"],
+            path=scope["path"],
+        )
+        try:
+            await self._respond(handler, params, scope, send, trace)
+        finally:
+            end_trace(trace, trace_token)
+
+    async def _respond(self, handler, params, scope, send, trace: RequestTrace):
+        headers = {
+            k.decode("latin-1").lower(): v.decode("latin-1")
+            for k, v in scope.get("headers", [])
+        }
+        session_id, set_cookie = self._load_session(headers)
+        retry_after = None
+        wait = 0.0
+        if is_rate_limited_path(scope["path"]):
+            wait = rate_limiter.check(session_id, self._client_ip(scope, headers))
+        if wait:
+            retry_after = retry_after_seconds(wait)
+            # Only auto-login (the route taking root_path) answers with a page
+            user_type = params.get("user_type") if "root_path" in params else None
+            status, content_type, body = rate_limited_body(
+                retry_after, user_type, params.get("root_path", "")
+            )
+        else:
+            try:
+                status, content_type, body = await handler(session_id, **params)
+            except Exception as e:
+                app_logger.error("Unhandled exception: %s", e, exc_info=True)
+                status, content_type, body = _json_body(
+                    {"error": "An unexpected error occurred"}, 500
+                )
+            if status == 503 and is_rate_limited_path(scope["path"]):
+                retry_after = GUAC_AUTH_RETRY_AFTER
+
+        status, body, extra = response_optimizer.optimize(
+            scope["method"],
+            status,
+            content_type,
+            body,
+            headers.get("accept-encoding", ""),
+            headers.get("if-none-match", ""),
+            getattr(handler, "_http_cache", None),
+        )
+
+        response_headers = [
+            (b"content-type", content_type.encode("latin-1")),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ]
+        response_headers += [
+            (k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in extra.items()
+        ]
+        if set_cookie:
+            response_headers.append((b"set-cookie", set_cookie.encode("latin-1")))
+        if retry_after is not None:
+            response_headers.append((b"retry-after", str(retry_after).encode("latin-1")))
+
+        # Same CORS policy as flask_cors: echo allowed origins, with credentials
+        origin = headers.get("origin")
+        if origin and ("*" in ALLOWED_ORIGINS or origin in ALLOWED_ORIGINS):
+            response_headers += [
+                (b"access-control-allow-origin", origin.encode("latin-1")),
+                (b"access-control-allow-credentials", b"true"),
+                (b"vary", b"Origin"),
+            ]
+
+        if not FLASK_DEBUG:
+            response_headers += [
+                (b"x-content-type-options", b"nosniff"),
+                (b"x-frame-options", b"DENY"),
+                (b"x-xss-protection", b"1; mode=block"),
+            ]
+
+        trace.finish()
+        trace.attrs["status"] = status
+        if SERVER_TIMING:
+            response_headers.append(
+                (b"server-timing", trace.server_timing().encode("latin-1"))
+            )
+
+        await send(
+            {"type": "http.response.start", "status": status, "headers": response_headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    # ---- Endpoints ----
+
+    @http_cache(etag=False)
+    @monitor_performance("status_check")
+    async def status(self, session_id: str):
+        """Async status endpoint: token validations run on the event loop"""
+        session_data = session_manager.get_session(session_id)
+
+        tokens = {
+            user_type: session_manager.get_user_token(session_id, user_type)
+            for user_type in GUAC_USERS
+        }
+        validity = await validate_guac_tokens_async(tokens)
+
+        validated_users = {}
+        for user_type, config in GUAC_USERS.items():
+            token = tokens[user_type]
+            token_valid = validity[user_type]
+            validated_users[user_type] = {
+                "username": config["username"],
+                "display_name": config["display_name"],
+                "description": config["description"],
+                "color_theme": config["color_theme"],
+                "connection_id": config["connection_id"],
+                "has_active_token": token is not None,
+                "token_valid": token_valid,
+                "last_activity": (
+                    session_data.get("last_activity") if session_data else None
+                ),
+            }
+
+        return _json_body(
+            {
+                "session": session_data,
+                "guac_users": validated_users,
+                "system_info": {
+                    "flask_debug": FLASK_DEBUG,
+                    "session_timeout": SESSION_TIMEOUT,
+                    "scripts_root": SCRIPTS_ROOT,
+                },
+            }
+        )
+
+    @monitor_performance("get_token")
+    async def get_token_for_user(self, session_id: str, user_type: str):
+        if user_type not in GUAC_USERS:
+            app_logger.warning("Invalid user type requested: %s", user_type)
+            return _json_body({"error": f"Invalid user type: {user_type}"}, 400)
+
+        try:
+            token, ds, status = await get_guac_token_async(user_type, exclusive=True)
+            if status != 200:
+                return _json_body({"error": token}, status)
+
+            conn_id = await resolve_session_connection_async(
+                session_id, user_type, token, ds
+            )
+            url = tokenized_connection_url(conn_id, token, ds)
+            session_manager.store_user_token(session_id, user_type, token)
+
+            app_logger.info("Token successfully generated for %s", user_type)
+            return _json_body(
+                {
+                    "ok": True,
+                    "connection_url": url,
+                    "user_type": user_type,
+                    "connection_id": conn_id,
+                    "data_source": ds,
+                }
+            )
+        except LabUnavailable as e:
+            token_reaper.submit([token])
+            return _json_body(
+                {"error": str(e), "scenario": e.scenario, "queue_position": e.position},
+                503,
+            )
+        except Exception as e:
+            app_logger.error("Token generation failed for %s: %s", user_type, e)
+            return _json_body({"error": str(e)}, 500)
+
+    @http_cache(etag=False)
+    @monitor_performance("auto_login")
+    async def guac_auto_login(self, session_id: str, user_type: str, root_path: str = ""):
+        if user_type not in GUAC_USERS:
+            app_logger.warning("Invalid user type for auto-login: %s", user_type)
+            return _json_body({"error": f"Invalid user type: {user_type}"}, 400)
+
+        try:
+            token, ds, status_code = await get_guac_token_async(
+                user_type, exclusive=True
+            )
+            if status_code != 200:
+                return _html_body(
+                    _generate_error_page(user_type, token, root_path), status_code
+                )
+
+            connection_id = await resolve_session_connection_async(
+                session_id, user_type, token, ds
+            )
+            connection_url = tokenized_connection_url(connection_id, token, ds)
+            session_manager.store_user_token(session_id, user_type, token)
+            session_manager.add_active_connection(session_id, user_type)
+
+            page = _generate_connection_page(user_type, connection_url, root_path)
+            app_logger.info("Auto-login page generated for %s", user_type)
+            return _html_body(page)
+
+        except LabUnavailable as e:
+            token_reaper.submit([token])
+            return _html_body(_generate_error_page(user_type, str(e), root_path), 503)
+        except Exception as e:
+            app_logger.error("Auto-login failed for %s: %s", user_type, e)
+            return _html_body(_generate_error_page(user_type, str(e), root_path), 500)
+
+    @monitor_performance("disconnect_user")
+    async def disconnect_user(self, session_id: str, user_type: str):
+        if user_type not in GUAC_USERS:
+            app_logger.warning("Invalid user type for disconnect: %s", user_type)
+            return _json_body({"error": f"Invalid user type: {user_type}"}, 400)
+
+        try:
+            session_manager.remove_active_connection(session_id, user_type)
+            release_lab_if_idle(session_id)
+            token = session_manager.get_user_token(session_id, user_type)
+            if token:
+                session_manager.remove_user_token(session_id, user_type)
+                result = await release_guac_token_async(token)
+                app_logger.info("Token %s for %s", result, user_type)
+            else:
+                app_logger.info("No active token found for %s", user_type)
+
+            await self.sio.emit(
+                "user_disconnected",
+                {
+                    "session_id": session_id,
+                    "user_type": user_type,
+                    "timestamp": datetime.now().isoformat(),
+                },
+                room=session_id,
+            )
+            security_logger.info(
+                "USER_DISCONNECTED: session=%s, user_type=%s", session_id, user_type
+            )
+            return _json_body(
+                {
+                    "success": True,
+                    "user_type": user_type,
+                    "message": f"{user_type} disconnected successfully",
+                    "timestamp": datetime.now().isoformat(),
+                }
+            )
+        except Exception as e:
+            app_logger.error("Disconnect failed for %s: %s", user_type, e)
+            return _json_body({"error": str(e)}, 500)
+
+    @monitor_performance("disconnect_all")
+    async def disconnect_all(self, session_id: str):
+        results = await disconnect_session_async(session_id)
+        error_count = sum(r.startswith("error") for r in results.values())
+        success_count = len(results) - error_count
+
+        await self.sio.emit(
+            "all_users_disconnected",
+            {
+                "session_id": session_id,
+                "results": results,
+                "timestamp": datetime.now().isoformat(),
+            },
+            room=session_id,
+        )
+        security_logger.info(
+            "ALL_USERS_DISCONNECTED: session=%s, success=%s, errors=%s",
+            session_id,
+            success_count,
+            error_count,
+        )
+        return _json_body(
+            {
+                "ok": True,
+                "results": results,
+                "summary": {
+                    "total_processed": len(GUAC_USERS),
+                    "successful": success_count,
+                    "errors": error_count,
+                },
+                "timestamp": datetime.now().isoformat(),
+            }
+        )
+
+
+def create_asgi_app(flask_app: Optional[Flask] = None):
+    """Create ASGI application for non-blocking deployment.
+
+    Run with e.g. ``uvicorn app:create_asgi_app --factory``. Socket.IO is
+    served by python-socketio's asyncio server instead of the threading one.
+    Requires the optional ``aiohttp`` and ``asgiref`` packages.
+    """
+    if aiohttp is None:
+        raise RuntimeError("ASGI mode requires the aiohttp and asgiref packages")
+
+    flask_app = flask_app or create_app()
+    sio_options = {}
+    if SOCKETIO_MESSAGE_QUEUE.startswith(("redis://", "rediss://")):
+        sio_options["client_manager"] = socketio_lib.AsyncRedisManager(
+            SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL
+        )
+    elif SOCKETIO_MESSAGE_QUEUE:
+        app_logger.warning(
+            "ASGI mode only supports redis:// message queues; Socket.IO stays process-local"
+        )
+    sio = socketio_lib.AsyncServer(
+        async_mode="asgi",
+        cors_allowed_origins=ALLOWED_ORIGINS,
+        logger=FLASK_DEBUG,
+        engineio_logger=FLASK_DEBUG,
+        ping_timeout=60,
+        ping_interval=25,
+        **sio_options,
+    )
+    router = GuacAsgiRouter(flask_app, sio)
+
+    @sio.event
+    async def connect(sid, environ):
+        session_id = router.session_id_from_cookie(environ.get("HTTP_COOKIE", ""))
+        if not session_id:
+            app_logger.warning("WebSocket connection without valid session")
+            await sio.emit("error", {"message": "No valid session"}, to=sid)
+            return
+        await sio.save_session(sid, {"session_id": session_id})
+        await sio.enter_room(sid, session_id)
+        app_logger.info("WebSocket client connected to room %s...", session_id[:8])
+
+        session_data = session_manager.get_session(session_id)
+        await sio.emit(
+            "session_status",
+            {
+                "session_id": session_id,
+                "active_connections": (
+                    session_data.get("active_connections", []) if session_data else []
+                ),
+                "timestamp": datetime.now().isoformat(),
+            },
+            to=sid,
+        )
+
+    @sio.event
+    async def disconnect(sid, *args):
+        session_id = (await sio.get_session(sid)).get("session_id")
+        if session_id:
+            app_logger.info(
+                "WebSocket client disconnected from room %s...", session_id[:8]
+            )
+
+    @sio.on("ping")
+    async def handle_ping(sid, *args):
+        await sio.emit("pong", {"timestamp": datetime.now().isoformat()}, to=sid)
+
+    async def on_startup():
+        # Job output is produced on the engine's loop; hop onto the server's
+        loop = asyncio.get_running_loop()
+        job_engine.emit = lambda event, data, room: asyncio.run_coroutine_threadsafe(
+            sio.emit(event, data, room=room), loop
+        )
+        lab_allocator.emit = job_engine.emit
+
+    app_logger.info("ASGI application created successfully")
+    return socketio_lib.ASGIApp(
+        sio,
+        other_asgi_app=router,
+        on_startup=on_startup,
+        on_shutdown=async_guac_client.close,
+    )
+
+
 # =========================
 # Application Entry Point
 # =========================
@@ -1243,17 +6874,15 @@ def main():
 
         # Test Guacamole connectivity
         try:
-            response = requests.get(
-                f"{GUAC_BASE}/api/languages", timeout=10, verify=False
-            )
+            response = guac_client.get("/api/languages", timeout=10, retries=0)
             if response.status_code == 200:
                 app_logger.info("✅ Guacamole connectivity test passed")
             else:
                 app_logger.warning(
-                    f"⚠️  Guacamole connectivity test returned {response.status_code}"
+                    "⚠️  Guacamole connectivity test returned %s", response.status_code
                 )
         except Exception as e:
-            app_logger.error(f"❌ Guacamole connectivity test failed: {e}")
+            app_logger.error("❌ Guacamole connectivity test failed: %s", e)
 
         # Start the server
         security_logger.info("SERVER_STARTING")
@@ -1270,8 +6899,8 @@ def main():
         app_logger.info("🛑 Server shutdown requested by user")
         security_logger.info("SERVER_STOPPED_BY_USER")
     except Exception as e:
-        app_logger.error(f"❌ Server startup error: {e}")
-        security_logger.error(f"SERVER_STARTUP_ERROR: {e}")
+        app_logger.error("❌ Server startup error: %s", e)
+        security_logger.error("SERVER_STARTUP_ERROR: %s", e)
         sys.exit(1)
 
 application = create_wsgi_app()
@@ -0,0 +1,99 @@
+"""Shared helpers for the backend benchmark scripts.
+
+Benchmarks import ``app`` directly. Importing it builds the Flask app and
+starts background threads, so Guacamole is pointed at a closed local port
+and the loggers are silenced. That way the numbers measure the code under
+test, not console I/O or network probes.
+"""
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(log_level: int = logging.WARNING):
+    """Import the backend module with benchmark-friendly settings"""
+    os.environ.setdefault("GUAC_BASE", "http://127.0.0.1:9/guacamole")
+    os.environ.setdefault("GUAC_HEALTH_INTERVAL", "3600")
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import app  # noqa: E402
+
+    for name in ("cybersec_lab", "security_events", "performance"):
+        logging.getLogger(name).setLevel(log_level)
+    return app
+
+
+def run_threads(worker: Callable[[int, int], None], threads: int, iterations: int) -> float:
+    """Run ``worker(thread_index, iterations)`` on N threads; returns ops/sec"""
+    barrier = threading.Barrier(threads + 1)
+
+    def target(index):
+        barrier.wait()
+        worker(index, iterations)
+
+    pool = [threading.Thread(target=target, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return threads * iterations / elapsed
+
+
+def run_info() -> Dict:
+    """Where the numbers came from, for comparing result files across commits"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "commit": commit or None,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def emit(results: List[Dict], json_path: str = "", meta: Optional[Dict] = None):
+    """Print a table of results and optionally write them as JSON.
+
+    With ``meta`` the file is ``{"meta": ..., "results": [...]}``,
+    otherwise just the list.
+    """
+    if not results:
+        return
+    keys = list(results[0].keys())
+    widths = [max(len(k), *(len(_fmt(r[k])) for r in results)) for k in keys]
+    print("  ".join(k.ljust(w) for k, w in zip(keys, widths)))
+    for r in results:
+        print("  ".join(_fmt(r[k]).ljust(w) for k, w in zip(keys, widths)))
+    if json_path:
+        with open(json_path, "w") as fh:
+            json.dump(results if meta is None else {"meta": meta, "results": results}, fh, indent=2)
+        print(f"\nWrote {len(results)} results to {json_path}")
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:,.1f}"
+    return str(value)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the per-request hot path and SessionManager operations.
+
+The ``middleware`` suite times Flask's request hooks in isolation, inside
+a pushed request context with no view function:
+- before_request for a new session, a known session, and a POST with a
+  body while FLASK_DEBUG is on (the debug body capture)
+- the same plus after_request on a JSON response
+- monitor_performance around a no-op
+- jsonify of a /api/status-shaped payload
+The context push/pop alone is the baseline, and ``overhead ns`` is
+measured against it.
+
+The ``sessions`` suite times SessionManager create, get_record,
+get_session, update_session_activity, store_user_token, get_user_token
+and cleanup_expired_sessions on a memory store. Both suites run with the
+store pre-filled to each ``--sessions`` size and at each ``--threads``
+count; with several threads every op is aggregate throughput under
+contention. Loggers are at WARNING, as in production.
+
+A request context costs far more than a session op, so the middleware
+suite runs ``--request-iterations`` per case instead of ``--iterations``.
+Use ``--json`` to write the rows plus the commit and Python version,
+for comparing runs across commits.
+
+    python benchmarks/bench_hot_paths.py --sessions 100 1000 10000 100000 --threads 1 4
+    python benchmarks/bench_hot_paths.py --suite sessions --json before.json
+"""
+import argparse
+import time
+
+from _common import emit, load_app, run_info, run_threads
+
+app = load_app()
+DEBUG_BODY = "x" * 4096
+
+
+def _ids(prefix: str, count: int):
+    return [f"{prefix}-{i:08d}-0000-4000-8000-000000000000" for i in range(count)]
+
+
+def _picks(ids, threads: int, iterations: int):
+    """A fixed pseudo-random session per iteration and thread, computed up front"""
+    n = len(ids)
+    return [
+        [ids[(index * 7919 + i * 104729) % n] for i in range(iterations)]
+        for index in range(threads)
+    ]
+
+
+def _result(suite: str, case: str, sessions: int, threads: int, ops: float) -> dict:
+    return {
+        "suite": suite,
+        "case": case,
+        "sessions": sessions,
+        "threads": threads,
+        "ops/s": ops,
+        "ns/op": 1e9 / ops,  # aggregate: threads share the GIL
+        "overhead ns": None,
+    }
+
+
+# ---- Middleware ----
+
+
+# Cases that only need an app context; workers push one for the whole run
+APP_CONTEXT_CASES = {"monitor_performance(no-op)", "jsonify(status)"}
+# Cases run with FLASK_DEBUG on; set once per case, since it is module-global
+DEBUG_CASES = {"before_request (debug body capture)"}
+
+
+def middleware_cases(flask_app):
+    """name -> callable(session_id) doing one request's worth of work"""
+    ctx = flask_app.test_request_context
+    status_payload = {
+        "session": app.SessionRecord("bench", time.time(), 0.0).to_dict(),
+        "guac_users": {
+            user_type: dict(config, has_active_token=True, token_valid=True)
+            for user_type, config in app.GUAC_USERS.items()
+        },
+        "system_info": {"flask_debug": False, "session_timeout": app.SESSION_TIMEOUT},
+    }
+    decorated = app.monitor_performance("bench_hot_path")(lambda: None)
+
+    def baseline(_sid):
+        with ctx("/api/status"):
+            pass
+
+    def before_new(_sid):
+        with ctx("/api/status"):
+            flask_app.preprocess_request()
+
+    def before_known(sid):
+        with ctx("/api/status"):
+            app.session["session_id"] = sid
+            flask_app.preprocess_request()
+
+    def before_debug_body(sid):
+        # FLASK_DEBUG is switched on around the whole case (DEBUG_CASES)
+        with ctx("/api/status", method="POST", data=DEBUG_BODY):
+            app.session["session_id"] = sid
+            flask_app.preprocess_request()
+
+    def before_after(sid):
+        with ctx("/api/status"):
+            app.session["session_id"] = sid
+            flask_app.preprocess_request()
+            flask_app.process_response(app.jsonify(status_payload))
+
+    def monitored(_sid):
+        decorated()
+
+    def jsonify_status(_sid):
+        app.jsonify(status_payload)
+
+    return {
+        "context push/pop": baseline,
+        "before_request (new session)": before_new,
+        "before_request (known session)": before_known,
+        "before_request (debug body capture)": before_debug_body,
+        "before + after_request": before_after,
+        "monitor_performance(no-op)": monitored,
+        "jsonify(status)": jsonify_status,
+    }
+
+
+def run_middleware(sizes, thread_counts, iterations):
+    flask_app = app.create_app()
+    cases = middleware_cases(flask_app)
+    results = []
+    known = []
+    for size in sizes:
+        # Sizes are ascending, so each step only adds the missing sessions
+        # ("new session" cases add more as they run)
+        for sid in _ids("mw", size)[len(known):]:
+            app.session_manager.create_session(sid)
+            known.append(sid)
+        for threads in thread_counts:
+            picks = _picks(known, threads, iterations)
+            baseline = None
+            for name, fn in cases.items():
+
+                def worker(index, count, fn=fn, name=name):
+                    if name in APP_CONTEXT_CASES:
+                        with flask_app.app_context():
+                            for sid in picks[index][:count]:
+                                fn(sid)
+                    else:
+                        for sid in picks[index][:count]:
+                            fn(sid)
+
+                debug = app.FLASK_DEBUG
+                app.FLASK_DEBUG = name in DEBUG_CASES or debug
+                try:
+                    ops_per_s = run_threads(worker, threads, iterations)
+                finally:
+                    app.FLASK_DEBUG = debug
+                row = _result("middleware", name, size, threads, ops_per_s)
+                if baseline is None:
+                    baseline = row["ns/op"]
+                if name not in APP_CONTEXT_CASES:
+                    row["overhead ns"] = row["ns/op"] - baseline
+                results.append(row)
+    return results
+
+
+# ---- SessionManager ----
+
+
+def run_sessions(sizes, thread_counts, iterations):
+    results = []
+    for size in sizes:
+        for threads in thread_counts:
+            manager = app.SessionManager(start_cleanup=False)
+            ids = _ids("s", size)
+            for sid in ids:
+                manager.create_session(sid)
+                manager.store_user_token(sid, "victim", sid)
+            picks = _picks(ids, threads, iterations)
+            fresh = [_ids(f"new{index}", iterations) for index in range(threads)]
+
+            def create(index, count):
+                for sid in fresh[index][:count]:
+                    manager.create_session(sid)
+
+            ops_per_s = run_threads(create, threads, iterations)
+            results.append(_result("sessions", "create_session", size, threads, ops_per_s))
+
+            ops = {
+                "get_record": lambda sid: manager.get_record(sid),
+                "get_session": lambda sid: manager.get_session(sid),
+                "update_session_activity": lambda sid: manager.update_session_activity(sid),
+                "store_user_token": lambda sid: manager.store_user_token(sid, "attacker", sid),
+                "get_user_token": lambda sid: manager.get_user_token(sid, "victim"),
+                "cleanup (nothing due)": lambda _sid: manager.cleanup_expired_sessions(),
+            }
+            for name, op in ops.items():
+
+                def worker(index, count, op=op):
+                    for sid in picks[index][:count]:
+                        op(sid)
+
+                results.append(
+                    _result("sessions", name, size, threads, run_threads(worker, threads, iterations))
+                )
+
+            # Expiring the whole store is one call; report it per expired session
+            total = manager.session_count()
+            start = time.perf_counter()
+            expired = manager.cleanup_expired_sessions(
+                now=manager.store.clock() + manager.store.timeout + 1
+            )
+            elapsed = time.perf_counter() - start
+            assert expired == total
+            results.append(_result("sessions", "cleanup (all due)", size, 1, total / elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--suite", choices=["all", "middleware", "sessions"], default="all")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--iterations", type=int, default=20000, help="session ops per thread and case")
+    parser.add_argument(
+        "--request-iterations", type=int, default=2000, help="middleware calls per thread and case"
+    )
+    parser.add_argument("--json", default="", help="write results to this file")
+    args = parser.parse_args()
+
+    sizes = sorted(args.sessions)
+    results = []
+    if args.suite in ("all", "middleware"):
+        results += run_middleware(sizes, args.threads, args.request_iterations)
+    if args.suite in ("all", "sessions"):
+        results += run_sessions(sizes, args.threads, args.iterations)
+    emit(results, args.json, meta=dict(run_info(), args=vars(args)))
+
+
+if __name__ == "__main__":
+    main()
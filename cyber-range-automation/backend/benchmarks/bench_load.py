@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""Class-start load test: N students against the backend and a fake Guacamole.
+
+Each simulated student runs the scenario page flow from the frontend:
+1. load /api/status
+2. open a Socket.IO connection
+3. for both roles, request a token then load the auto-login iframe
+4. poll /api/status for ``--hold`` seconds
+5. disconnect both roles and close the socket
+
+Students start spread over ``--ramp`` seconds. Each student sends its own
+X-Forwarded-For address, so per-IP rate limits see a classroom of
+separate machines. Pass ``--same-ip`` to model a NATed lab instead.
+Socket.IO uses the websocket transport, as the frontend does. The
+disconnect time includes waiting for the server to close the socket,
+which the threaded dev server does slowly; ``--transports polling``
+measures the handshake alone.
+
+By default the script starts ``benchmarks/fake_guacamole.py`` and the
+backend (``python app.py``, or uvicorn with ``--asgi``) as subprocesses
+on local ports. With ``--url`` it targets a backend you started yourself,
+which must already point its GUAC_BASE at a fake server. The report has
+requests, error rate, throughput and latency percentiles per endpoint;
+errors are broken down by status.
+
+    python benchmarks/bench_load.py --students 60 --ramp 5 --hold 20
+    python benchmarks/bench_load.py --students 60 --latency 50 --error-rate 0.02 --asgi
+    python benchmarks/bench_load.py --url http://127.0.0.1:5000 --students 30
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from _common import BACKEND_DIR, emit
+
+try:
+    import socketio
+except ImportError:
+    socketio = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROLES = ("victim", "attacker")
+
+
+class Recorder:
+    """Latency samples and outcomes per endpoint, shared by every student"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, endpoint: str, ms: float, error: Optional[str] = None):
+        with self._lock:
+            self.samples[endpoint].append(ms)
+            if error is not None:
+                self.errors[endpoint][error] += 1
+
+    def timed(self, endpoint: str, fn, *args, **kwargs):
+        """Run one call; 4xx/5xx and exceptions count as errors"""
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.add(endpoint, (time.perf_counter() - start) * 1000, type(e).__name__)
+            return None
+        status = getattr(result, "status_code", None)
+        error = str(status) if status is not None and status >= 400 else None
+        self.add(endpoint, (time.perf_counter() - start) * 1000, error)
+        return result
+
+    def report(self, elapsed: float) -> List[Dict]:
+        rows = []
+        for endpoint in sorted(self.samples):
+            rows.append(_row(endpoint, self.samples[endpoint], self.errors[endpoint], elapsed))
+        every = [ms for samples in self.samples.values() for ms in samples]
+        if every:
+            total_errors = sum((c for c in self.errors.values()), Counter())
+            rows.append(_row("TOTAL", every, total_errors, elapsed))
+        return rows
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _row(endpoint: str, samples: List[float], errors: Counter, elapsed: float) -> Dict:
+    ordered = sorted(samples)
+    failed = sum(errors.values())
+    return {
+        "endpoint": endpoint,
+        "requests": len(ordered),
+        "errors": failed,
+        "error %": 100.0 * failed / len(ordered),
+        "req/s": len(ordered) / elapsed,
+        "p50 ms": _percentile(ordered, 0.50),
+        "p90 ms": _percentile(ordered, 0.90),
+        "p99 ms": _percentile(ordered, 0.99),
+        "max ms": ordered[-1],
+        "by status": ",".join(f"{k}:{v}" for k, v in errors.most_common()) or "-",
+    }
+
+
+def student(index: int, args, recorder: Recorder, start_at: float):
+    """One browser session running the scenario page"""
+    time.sleep(max(0.0, start_at - time.monotonic()))
+    http = requests.Session()
+    if not args.same_ip:
+        http.headers["X-Forwarded-For"] = f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+    base = args.url.rstrip("/")
+    timeout = args.request_timeout
+
+    recorder.timed("GET /api/status", http.get, f"{base}/api/status", timeout=timeout)
+
+    sio = None
+    if socketio is not None and not args.no_socketio:
+        sio = socketio.Client(http_session=http, reconnection=False)
+        recorder.timed(
+            "socket.io connect",
+            sio.connect,
+            base,
+            headers=dict(http.headers),
+            transports=args.transports,
+            wait_timeout=timeout,
+        )
+
+    for role in ROLES:
+        recorder.timed(
+            "POST /api/guac/token/{role}",
+            http.post,
+            f"{base}/api/guac/token/{role}",
+            json={},
+            timeout=timeout,
+        )
+        recorder.timed(
+            "GET /api/guac/auto-login/{role}",
+            http.get,
+            f"{base}/api/guac/auto-login/{role}",
+            timeout=timeout,
+        )
+
+    # Students join at different moments, so polls don't line up
+    deadline = time.monotonic() + args.hold
+    time.sleep(random.uniform(0, args.poll_interval))
+    while time.monotonic() < deadline:
+        recorder.timed("GET /api/status", http.get, f"{base}/api/status", timeout=timeout)
+        time.sleep(args.poll_interval)
+
+    for role in ROLES:
+        recorder.timed(
+            "POST /api/guac/disconnect/{role}",
+            http.post,
+            f"{base}/api/guac/disconnect/{role}",
+            json={},
+            timeout=timeout,
+        )
+    if sio is not None and sio.connected:
+        recorder.timed("socket.io disconnect", sio.disconnect)
+    http.close()
+
+
+def _wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_stack(args) -> Tuple[List[subprocess.Popen], str]:
+    """Start the fake Guacamole and the backend; returns processes and fake base URL"""
+    output = None if args.verbose else subprocess.DEVNULL
+    fake_cmd = [
+        sys.executable,
+        os.path.join(BENCH_DIR, "fake_guacamole.py"),
+        "--port", str(args.guac_port),
+        "--latency", str(args.latency),
+        "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate),
+        "--error-status", str(args.error_status),
+        "--hang-rate", str(args.hang_rate),
+        "--labs", str(args.labs),
+    ]
+    fake_url = f"http://127.0.0.1:{args.guac_port}"
+    procs = [subprocess.Popen(fake_cmd, stdout=output, stderr=output)]
+    _wait_ready(f"{fake_url}/_fake/stats")
+
+    env = dict(
+        os.environ,
+        GUAC_BASE=f"{fake_url}/guacamole",
+        FLASK_HOST="127.0.0.1",
+        FLASK_PORT=str(args.port),
+        FLASK_DEBUG="false",
+        SECRET_KEY=os.urandom(16).hex(),
+        LAB_ALLOCATION="true" if args.labs else "false",
+    )
+    env.update(item.split("=", 1) for item in args.backend_env)
+    if args.asgi:
+        backend_cmd = [
+            sys.executable, "-m", "uvicorn", "app:create_asgi_app", "--factory",
+            "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning",
+        ]
+    else:
+        backend_cmd = [sys.executable, os.path.join(BACKEND_DIR, "app.py")]
+    procs.append(
+        subprocess.Popen(backend_cmd, cwd=BACKEND_DIR, env=env, stdout=output, stderr=output)
+    )
+    args.url = f"http://127.0.0.1:{args.port}"
+    _wait_ready(f"{args.url}/api/status")
+    return procs, fake_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=40)
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which students join")
+    parser.add_argument("--hold", type=float, default=10.0, help="seconds each student polls status")
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    parser.add_argument("--request-timeout", type=float, default=30.0)
+    parser.add_argument("--same-ip", action="store_true", help="all students behind one address")
+    parser.add_argument("--no-socketio", action="store_true")
+    parser.add_argument("--transports", nargs="+", default=["websocket"], choices=["websocket", "polling"])
+    parser.add_argument("--url", default="", help="use an already running backend")
+    parser.add_argument("--asgi", action="store_true", help="serve the backend with uvicorn")
+    parser.add_argument("--port", type=int, default=5055, help="backend port when started here")
+    parser.add_argument("--guac-port", type=int, default=18090, help="fake Guacamole port")
+    parser.add_argument("--latency", type=float, default=20.0, help="fake Guacamole ms per call")
+    parser.add_argument("--jitter", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--labs", type=int, default=0, help="lab pairs the fake server lists; enables lab allocation")
+    parser.add_argument(
+        "--backend-env", action="append", default=[], metavar="KEY=VALUE",
+        help="extra environment for the backend, repeatable",
+    )
+    parser.add_argument("--verbose", action="store_true", help="show subprocess output")
+    parser.add_argument("--json", default="", help="write results to this file")
+    args = parser.parse_args()
+
+    procs: List[subprocess.Popen] = []
+    fake_url = ""
+    try:
+        if not args.url:
+            procs, fake_url = start_stack(args)
+
+        recorder = Recorder()
+        begin = time.monotonic()
+        spacing = args.ramp / max(args.students - 1, 1)
+        pool = [
+            threading.Thread(target=student, args=(i, args, recorder, begin + i * spacing))
+            for i in range(args.students)
+        ]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.monotonic() - begin
+
+        print(
+            f"{args.students} students, ramp {args.ramp:.0f}s, hold {args.hold:.0f}s:"
+            f" {elapsed:.1f}s wall\n"
+        )
+        emit(recorder.report(elapsed), args.json)
+        if fake_url:
+            guac = requests.get(f"{fake_url}/_fake/stats", timeout=5).json()
+            print(
+                f"\nGuacamole calls {guac['requests']}, injected failures {guac['injected']},"
+                f" tokens issued {guac['tokens_issued']}, still live {guac['tokens_live']}"
+            )
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+if __name__ == "__main__":
+    main()
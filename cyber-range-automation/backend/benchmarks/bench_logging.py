@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Request latency with logging off, synchronous file logging and the queue pipeline.
+
+Each mode drives GET /api/status through the Flask test client at INFO level
+with file logs written to a temporary directory. Every request writes the
+same app/perf records as production; console output is disabled. With
+``--disk-delay`` each file write sleeps first, which shows how a slow disk
+blocks requests in sync mode while async mode only drops records.
+
+    python benchmarks/bench_logging.py --requests 5000 --threads 1 4
+    python benchmarks/bench_logging.py --disk-delay 0.5
+"""
+import argparse
+import logging
+import statistics
+import tempfile
+import threading
+import time
+
+from _common import emit, load_app
+
+app = load_app()
+LOGGERS = ("cybersec_lab", "security_events", "performance")
+
+
+def configure(mode: str, log_dir: str, disk_delay_ms: float):
+    if mode == "off":
+        app.setup_logging(log_dir, use_queue=False, file_logs=False, console=False)
+        for name in LOGGERS:
+            logging.getLogger(name).setLevel(logging.CRITICAL)
+        return
+
+    app.setup_logging(log_dir, use_queue=(mode == "async"), file_logs=True, console=False)
+    for name in LOGGERS:
+        logging.getLogger(name).setLevel(logging.INFO)
+
+    if disk_delay_ms:
+        if app.log_pipeline.listener is not None:
+            handlers = app.log_pipeline.listener.handlers
+        else:
+            handlers = logging.getLogger(LOGGERS[0]).handlers
+        for handler in handlers:
+            emit_record = handler.emit
+
+            def slow_emit(record, emit_record=emit_record):
+                time.sleep(disk_delay_ms / 1000)
+                emit_record(record)
+
+            handler.emit = slow_emit
+
+
+def run(mode: str, requests: int, threads: int, disk_delay_ms: float) -> dict:
+    with tempfile.TemporaryDirectory() as log_dir:
+        configure(mode, log_dir, disk_delay_ms)
+        flask_app = app.create_app()
+        latencies = [[] for _ in range(threads)]
+        barrier = threading.Barrier(threads + 1)
+
+        def worker(index):
+            client = flask_app.test_client()
+            client.get("/api/status")  # establish the session cookie
+            barrier.wait()
+            out = latencies[index]
+            for _ in range(requests // threads):
+                start = time.perf_counter()
+                client.get("/api/status")
+                out.append((time.perf_counter() - start) * 1000)
+
+        pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for t in pool:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        dropped = app.log_pipeline.stats().get("dropped", 0)
+        app.log_pipeline.stop()
+
+    samples = sorted(ms for per_thread in latencies for ms in per_thread)
+    return {
+        "mode": mode,
+        "threads": threads,
+        "req/s": len(samples) / elapsed,
+        "p50 ms": statistics.median(samples),
+        "p99 ms": samples[int(len(samples) * 0.99) - 1],
+        "dropped": dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--disk-delay", type=float, default=0.0, help="ms per file write")
+    parser.add_argument("--json", default="", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for threads in args.threads:
+        for mode in ("off", "sync", "async"):
+            results.append(run(mode, args.requests, threads, args.disk_delay))
+    emit(results, args.json)
+
+
+if __name__ == "__main__":
+    main()
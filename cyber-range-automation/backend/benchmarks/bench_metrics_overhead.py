@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Hot-path cost of monitor_performance with the metrics registry.
+
+Times a no-op function called bare, through the original log-only
+decorator and through the current monitor_performance, which also
+records into the histogram. The perf logger is at WARNING, as it would be
+for a quiet production logger, so the numbers show decorator and metrics
+cost rather than log I/O. With several threads every call hits the same
+OperationMetrics lock, which is the worst case for contention.
+
+    python benchmarks/bench_metrics_overhead.py --iterations 200000 --threads 1 4
+"""
+import argparse
+import time
+from functools import wraps
+
+from _common import emit, load_app, run_threads
+
+app = load_app()
+
+
+def legacy_monitor_performance(operation_name: str):
+    """monitor_performance before the metrics registry: a log line per call"""
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start_time = time.time()
+            try:
+                result = f(*args, **kwargs)
+                duration = (time.time() - start_time) * 1000
+                app.perf_logger.info(
+                    f"PERF: {operation_name} completed in {duration:.2f}ms"
+                )
+                return result
+            except Exception as e:
+                duration = (time.time() - start_time) * 1000
+                app.perf_logger.error(
+                    f"PERF: {operation_name} failed after {duration:.2f}ms - {str(e)}"
+                )
+                raise
+
+        return wrapper
+
+    return decorator
+
+
+def noop():
+    return None
+
+
+VARIANTS = {
+    "bare": noop,
+    "legacy decorator": legacy_monitor_performance("bench_legacy")(noop),
+    "monitor_performance": app.monitor_performance("bench_metrics")(noop),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--json", default="", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for threads in args.threads:
+        baseline = None
+        for name, fn in VARIANTS.items():
+
+            def worker(_index, iterations, fn=fn):
+                for _ in range(iterations):
+                    fn()
+
+            ops = run_threads(worker, threads, args.iterations)
+            ns_per_call = 1e9 / ops  # aggregate: threads share the GIL
+            if baseline is None:
+                baseline = ns_per_call
+            results.append(
+                {
+                    "variant": name,
+                    "threads": threads,
+                    "ops/s": ops,
+                    "ns/call": ns_per_call,
+                    "overhead ns": ns_per_call - baseline,
+                }
+            )
+
+    snap = app.metrics.operation("bench_metrics").snapshot()
+    print(f"histogram recorded {snap['count']} calls, in_flight={snap['in_flight']}\n")
+    emit(results, args.json)
+
+
+if __name__ == "__main__":
+    main()
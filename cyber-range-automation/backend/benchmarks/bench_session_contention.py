@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Contention benchmark: single-lock vs sharded SessionManager.
+
+Replays the per-request mix from ``before_request`` and the Guacamole
+endpoints (mostly activity updates and token reads, some token writes)
+across 1..N threads and reports operations per second.
+
+    python benchmarks/bench_session_contention.py --threads 1 2 4 8 16
+"""
+import argparse
+import random
+import threading
+from datetime import datetime
+
+from _common import emit, load_app, run_threads
+
+app = load_app()
+
+
+class LegacySessionManager:
+    """The pre-sharding SessionManager: one lock around every dict access"""
+
+    def __init__(self):
+        self.active_sessions = {}
+        self.user_tokens = {}
+        self.lock = threading.Lock()
+
+    def create_session(self, session_id):
+        with self.lock:
+            self.active_sessions[session_id] = {
+                "id": session_id,
+                "created_at": datetime.now().isoformat(),
+                "last_activity": datetime.now().isoformat(),
+                "active_connections": [],
+                "scenario_status": {},
+                "user_preferences": {},
+                "client_info": {},
+            }
+            self.user_tokens[session_id] = {}
+            app.app_logger.info(f"Created new session: {session_id[:8]}...")
+
+    def get_session(self, session_id):
+        with self.lock:
+            session = self.active_sessions.get(session_id)
+            app.app_logger.debug(f"Retrieved session: {session_id[:8]}...")
+            return session
+
+    def update_session_activity(self, session_id):
+        with self.lock:
+            if session_id in self.active_sessions:
+                self.active_sessions[session_id][
+                    "last_activity"
+                ] = datetime.now().isoformat()
+                app.app_logger.debug(f"Updated activity for session: {session_id[:8]}...")
+
+    def store_user_token(self, session_id, user_type, token):
+        with self.lock:
+            self.user_tokens.setdefault(session_id, {})[user_type] = token
+            app.app_logger.info(f"Stored token for {user_type} in session {session_id[:8]}...")
+
+    def get_user_token(self, session_id, user_type):
+        with self.lock:
+            token = self.user_tokens.get(session_id, {}).get(user_type)
+            app.app_logger.debug(f"Retrieved token for {user_type} in session {session_id[:8]}...")
+            return token
+
+
+def make_worker(manager, session_ids):
+    def worker(index, iterations):
+        rng = random.Random(index)
+        for i in range(iterations):
+            sid = session_ids[rng.randrange(len(session_ids))]
+            manager.update_session_activity(sid)
+            op = i % 10
+            if op < 6:
+                manager.get_user_token(sid, "victim")
+            elif op < 9:
+                manager.get_session(sid)
+            else:
+                manager.store_user_token(sid, "victim", "token")
+
+    return worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=20000, help="per thread")
+    parser.add_argument("--json", default="", help="write results to this file")
+    args = parser.parse_args()
+
+    session_ids = [f"bench-{i:06d}" for i in range(args.sessions)]
+    managers = {
+        "single-lock": LegacySessionManager(),
+        "sharded": app.SessionManager(start_cleanup=False),
+    }
+    for manager in managers.values():
+        for sid in session_ids:
+            manager.create_session(sid)
+
+    results = []
+    for threads in args.threads:
+        row = {"threads": threads}
+        for name, manager in managers.items():
+            row[f"{name} ops/s"] = run_threads(
+                make_worker(manager, session_ids), threads, args.iterations
+            )
+        row["speedup"] = row["sharded ops/s"] / row["single-lock ops/s"]
+        results.append(row)
+    emit(results, args.json)
+
+
+if __name__ == "__main__":
+    main()
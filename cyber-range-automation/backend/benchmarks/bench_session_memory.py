@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Memory benchmark: per-session bytes, legacy dicts vs SessionRecord.
+
+The legacy layout is the original SessionManager: a seven-key dict per
+session (ISO strings, a list and three empty dicts) plus a parallel
+``user_tokens`` entry. The current layout is MemorySessionStore with
+``SessionRecord`` objects. Both are measured with tracemalloc after
+creating N sessions, with and without two stored tokens.
+
+    python benchmarks/bench_session_memory.py --sessions 1000 10000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+from _common import emit, load_app
+
+app = load_app()
+
+
+def legacy_sessions(count: int, with_tokens: bool):
+    active_sessions, user_tokens = {}, {}
+    for i in range(count):
+        session_id = f"{i:08d}-0000-4000-8000-000000000000"
+        active_sessions[session_id] = {
+            "id": session_id,
+            "created_at": datetime.now().isoformat(),
+            "last_activity": datetime.now().isoformat(),
+            "active_connections": [],
+            "scenario_status": {},
+            "user_preferences": {},
+            "client_info": {},
+        }
+        user_tokens[session_id] = {}
+        if with_tokens:
+            user_tokens[session_id]["victim"] = f"{i:064d}"
+            user_tokens[session_id]["attacker"] = f"{i:064d}"
+            active_sessions[session_id]["active_connections"].append("victim")
+    return active_sessions, user_tokens
+
+
+def record_sessions(count: int, with_tokens: bool):
+    store = app.MemorySessionStore()
+    for i in range(count):
+        session_id = f"{i:08d}-0000-4000-8000-000000000000"
+        store.create_session(app.SessionRecord(session_id, time.time(), store.clock()))
+        if with_tokens:
+            store.set_token(session_id, "victim", f"{i:064d}")
+            store.set_token(session_id, "attacker", f"{i:064d}")
+            store.add_connection(session_id, "victim")
+    return store
+
+
+def measure(builder, count: int, with_tokens: bool) -> float:
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    keep = builder(count, with_tokens)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del keep
+    # Session ids are shared by both layouts; leave them out of the delta
+    ids = sum(len(f"{i:08d}-0000-4000-8000-000000000000") + 49 for i in range(count))
+    return (used - ids) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--json", default="", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for count in args.sessions:
+        for with_tokens in (False, True):
+            legacy = measure(legacy_sessions, count, with_tokens)
+            record = measure(record_sessions, count, with_tokens)
+            results.append(
+                {
+                    "sessions": count,
+                    "tokens": with_tokens,
+                    "legacy bytes/session": legacy,
+                    "record bytes/session": record,
+                    "saved": f"{(1 - record / legacy) * 100:.0f}%",
+                }
+            )
+    emit(results, args.json)
+
+
+if __name__ == "__main__":
+    main()
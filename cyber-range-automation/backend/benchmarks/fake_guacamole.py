@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Guacamole REST API, for load tests.
+
+Implements the calls the backend makes: ``POST /api/tokens`` (login),
+``DELETE /api/tokens/<token>`` (logout),
+``GET /api/session/data/<ds>/connections`` and ``GET /api/languages``.
+Tokens are tracked, so a logged-out token is rejected with 403 the way
+Guacamole does. The connection list holds the shared ``victim`` and
+``attacker`` connections plus ``--labs`` lab pairs named like
+``webapp-victim-01``.
+
+Every response is delayed by ``--latency`` ms (plus up to ``--jitter``
+ms). ``--error-rate`` answers a fraction of requests with
+``--error-status``, and ``--hang-rate`` stalls a fraction for
+``--hang-seconds`` to exercise the backend's timeouts. ``--errors-on``
+limits both to some endpoints. ``GET /_fake/stats`` returns request
+counts. ``POST /_fake/config`` with a JSON body changes any of the
+injection settings while a test runs, e.g. to simulate an outage.
+
+    python benchmarks/fake_guacamole.py --port 18090 --latency 20 --jitter 10
+    GUAC_BASE=http://127.0.0.1:18090/guacamole python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+ENDPOINTS = ("login", "logout", "connections", "languages")
+ROLES = ("victim", "attacker")
+
+
+class FakeGuacamole:
+    """State shared by the request handlers: tokens, settings and counters"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        hang_rate: float = 0.0,
+        hang_seconds: float = 15.0,
+        errors_on=ENDPOINTS,
+        labs: int = 0,
+        scenario: str = "webapp",
+        data_source: str = "mysql",
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.errors_on = set(errors_on)
+        self.data_source = data_source
+        self.connections = self._connections(labs, scenario)
+        self._tokens: Dict[str, str] = {}  # token -> username
+        self._lock = threading.Lock()
+        self.counts = {name: 0 for name in ENDPOINTS}
+        self.injected = {name: 0 for name in ENDPOINTS}
+        self.issued = 0
+        self.revoked = 0
+
+    @staticmethod
+    def _connections(labs: int, scenario: str) -> Dict[str, Dict[str, Any]]:
+        connections = {
+            "2": {"identifier": "2", "name": "victim", "protocol": "rdp"},
+            "4": {"identifier": "4", "name": "attacker", "protocol": "ssh"},
+        }
+        next_id = 100
+        for slot in range(1, labs + 1):
+            for role in ROLES:
+                cid = str(next_id)
+                connections[cid] = {
+                    "identifier": cid,
+                    "name": f"{scenario}-{role}-{slot:02d}",
+                    "protocol": "rdp" if role == "victim" else "ssh",
+                }
+                next_id += 1
+        return connections
+
+    def configure(self, **settings) -> Dict[str, Any]:
+        for key in ("latency_ms", "jitter_ms", "error_rate", "hang_rate", "hang_seconds"):
+            if key in settings:
+                setattr(self, key, float(settings[key]))
+        if "error_status" in settings:
+            self.error_status = int(settings["error_status"])
+        if "errors_on" in settings:
+            self.errors_on = set(settings["errors_on"])
+        return self.settings()
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "latency_ms": self.latency_ms,
+            "jitter_ms": self.jitter_ms,
+            "error_rate": self.error_rate,
+            "error_status": self.error_status,
+            "hang_rate": self.hang_rate,
+            "hang_seconds": self.hang_seconds,
+            "errors_on": sorted(self.errors_on),
+        }
+
+    def delay(self, endpoint: str) -> Optional[int]:
+        """Sleep for the configured latency; returns an injected status, if any"""
+        with self._lock:
+            self.counts[endpoint] += 1
+        injected = endpoint in self.errors_on
+        if injected and random.random() < self.hang_rate:
+            with self._lock:
+                self.injected[endpoint] += 1
+            time.sleep(self.hang_seconds)
+            return 504
+        time.sleep((self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000)
+        if injected and random.random() < self.error_rate:
+            with self._lock:
+                self.injected[endpoint] += 1
+            return self.error_status
+        return None
+
+    def login(self, username: str) -> str:
+        token = uuid.uuid4().hex.upper()
+        with self._lock:
+            self._tokens[token] = username
+            self.issued += 1
+        return token
+
+    def logout(self, token: str) -> bool:
+        with self._lock:
+            if self._tokens.pop(token, None) is None:
+                return False
+            self.revoked += 1
+            return True
+
+    def valid(self, token: Optional[str]) -> bool:
+        return token is not None and token in self._tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": dict(self.counts),
+                "injected": dict(self.injected),
+                "tokens_issued": self.issued,
+                "tokens_revoked": self.revoked,
+                "tokens_live": len(self._tokens),
+                "settings": self.settings(),
+            }
+
+
+def _route(method: str, path: str, prefix: str) -> Tuple[Optional[str], str]:
+    """Map a request to an endpoint name and its trailing argument"""
+    if path.startswith(prefix):
+        path = path[len(prefix):]
+    if path == "/api/tokens" and method == "POST":
+        return "login", ""
+    if path.startswith("/api/tokens/") and method == "DELETE":
+        return "logout", path[len("/api/tokens/"):]
+    if path == "/api/languages" and method == "GET":
+        return "languages", ""
+    parts = path.split("/")
+    # /api/session/data/<ds>/connections
+    if (
+        method == "GET"
+        and len(parts) == 6
+        and parts[1:4] == ["api", "session", "data"]
+        and parts[5] == "connections"
+    ):
+        return "connections", parts[4]
+    return None, path
+
+
+def make_handler(fake: FakeGuacamole, prefix: str = "/guacamole"):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: Any = None):
+            payload = b"" if body is None else json.dumps(body).encode()
+            self.send_response(status)
+            if payload:
+                self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            if payload:
+                self.wfile.write(payload)
+
+        def _body(self) -> bytes:
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _handle(self, method: str):
+            url = urlsplit(self.path)
+            body = self._body()
+            if url.path == "/_fake/stats":
+                return self._send(200, fake.stats())
+            if url.path == "/_fake/config" and method == "POST":
+                return self._send(200, fake.configure(**json.loads(body or b"{}")))
+
+            endpoint, arg = _route(method, url.path, prefix)
+            if endpoint is None:
+                return self._send(404, {"message": "Not found", "type": "NOT_FOUND"})
+            status = fake.delay(endpoint)
+            if status is not None:
+                return self._send(status, {"message": "Injected failure", "type": "INTERNAL_ERROR"})
+
+            if endpoint == "login":
+                form = parse_qs(body.decode())
+                username = (form.get("username") or [""])[0]
+                if not username:
+                    return self._send(403, {"message": "Invalid login", "type": "INVALID_CREDENTIALS"})
+                return self._send(
+                    200,
+                    {
+                        "authToken": fake.login(username),
+                        "username": username,
+                        "dataSource": fake.data_source,
+                        "availableDataSources": [fake.data_source],
+                    },
+                )
+            if endpoint == "logout":
+                if fake.logout(arg):
+                    return self._send(204)
+                return self._send(404, {"message": "No such token", "type": "NOT_FOUND"})
+            if endpoint == "languages":
+                return self._send(200, {"en": "English"})
+
+            token = (parse_qs(url.query).get("token") or [None])[0]
+            token = token or self.headers.get("Guacamole-Token")
+            if not fake.valid(token):
+                return self._send(403, {"message": "Permission denied", "type": "PERMISSION_DENIED"})
+            if arg != fake.data_source:
+                return self._send(404, {"message": "No such data source", "type": "NOT_FOUND"})
+            return self._send(200, fake.connections)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # a class's worth of simultaneous connects
+
+
+def serve(
+    fake: FakeGuacamole, host: str = "127.0.0.1", port: int = 0, prefix: str = "/guacamole"
+) -> ThreadingHTTPServer:
+    """Start the server on a daemon thread; ``port=0`` picks a free port"""
+    server = _Server((host, port), make_handler(fake, prefix))
+    threading.Thread(target=server.serve_forever, name="fake-guacamole", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--prefix", default="/guacamole", help="path GUAC_BASE ends with")
+    parser.add_argument("--latency", type=float, default=0.0, help="ms added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random ms, uniform")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="fraction that stalls")
+    parser.add_argument("--hang-seconds", type=float, default=15.0)
+    parser.add_argument(
+        "--errors-on", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS),
+        help="endpoints that errors and hangs apply to",
+    )
+    parser.add_argument("--labs", type=int, default=0, help="lab pairs to list")
+    parser.add_argument("--scenario", default="webapp", help="scenario name of the lab pairs")
+    args = parser.parse_args()
+
+    fake = FakeGuacamole(
+        latency_ms=args.latency,
+        jitter_ms=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+        errors_on=args.errors_on,
+        labs=args.labs,
+        scenario=args.scenario,
+    )
+    server = serve(fake, args.host, args.port, args.prefix)
+    print(
+        f"Fake Guacamole on http://{args.host}:{server.server_port}{args.prefix}"
+        f" ({len(fake.connections)} connections)",
+        flush=True,
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()